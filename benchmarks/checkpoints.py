@@ -0,0 +1,116 @@
+"""
+Время исторических запросов (состояние на момент record_id и изменения
+между двумя record_id) на SQLite без контрольных точек и с ними.
+Запускается из корня репозитория: python -m benchmarks.checkpoints
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict
+
+import sqlalchemy as sa
+from sqlalchemy.orm import Session
+
+from checkpoint import CheckpointIndex
+from model.model import Base, Entity
+
+DEFAULT_ENTITIES = 10_000
+DEFAULT_RECORDS = 1_000_000
+DEFAULT_INTERVAL = 100_000
+DELTA = 5_000
+SEED_BATCH = 10_000
+
+
+def seed(engine: sa.Engine, entities: int, records: int) -> None:
+    rng = random.Random(0)
+    table = Entity.__table__
+    with engine.begin() as connection:
+        for start in range(0, records, SEED_BATCH):
+            connection.execute(
+                table.insert(),
+                [
+                    {
+                        "id": rng.randint(1, entities),
+                        "foo": f"foo-{rng.randrange(100)}",
+                        "bar": f"bar-{rng.randrange(7)}",
+                    }
+                    for _ in range(min(SEED_BATCH, records - start))
+                ],
+            )
+
+
+def run_queries(
+    session: Session, index: CheckpointIndex, records: int
+) -> Dict[str, float]:
+    point = records - DELTA
+
+    cases: Dict[str, Callable[[], object]] = {
+        f"state at {point}": lambda: index.state_at(session, point),
+        f"changes in ({point}, {records}]": lambda: index.changes_between(
+            session, point, records
+        ),
+    }
+    return {name: measure(func) for name, func in cases.items()}
+
+
+def measure(func: Callable[[], object], repeat: int = 3) -> float:
+    """Возвращает лучшее время выполнения из repeat запусков."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=DEFAULT_ENTITIES,
+        help="Number of tracked entities",
+    )
+    parser.add_argument(
+        "--records",
+        type=int,
+        default=DEFAULT_RECORDS,
+        help="Number of history records",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=DEFAULT_INTERVAL,
+        help="Number of records between checkpoints",
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = sa.create_engine(
+            "sqlite:///" + os.path.join(directory, "bench.db")
+        )
+        Base.metadata.create_all(engine)
+        seed(engine, args.entities, args.records)
+        index = CheckpointIndex(interval=args.interval)
+
+        with Session(engine) as session:
+            before = run_queries(session, index, args.records)
+            started = time.perf_counter()
+            created = index.maintain(session)
+            build = time.perf_counter() - started
+            after = run_queries(session, index, args.records)
+        engine.dispose()
+
+    print(
+        f"Records: {args.records}, entities: {args.entities},"
+        f" checkpoints: {len(created)} every {args.interval}"
+        f" (built in {build:.1f} s)"
+    )
+    print(f"{'query':<32} {'no checkpoints, ms':>19} {'checkpoints, ms':>16}")
+    for name in before:
+        print(
+            f"{name:<32} {before[name] * 1000:19.1f}"
+            f" {after[name] * 1000:16.1f}"
+        )
@@ -0,0 +1,155 @@
+"""
+Время основных запросов на SQLite без индексов и с индексами,
+объявленными в моделях: составным (id, record_id) на test_table
+и уникальным на api_keys.key.
+Запускается из корня репозитория: python -m benchmarks.indexes
+"""
+import argparse
+import datetime as dt
+import os
+import random
+import tempfile
+import time
+from typing import Callable, Dict
+
+import sqlalchemy as sa
+
+from model.base import check_indexes
+from model.model import ApiKey, Base, Entity
+from tracking import ENTITY_TABLE
+
+DEFAULT_ENTITIES = 100_000
+DEFAULT_VERSIONS = 10
+DEFAULT_KEYS = 10_000
+LOOKUPS = 200
+BASELINE_CHUNK = 500
+
+
+def seed(engine: sa.Engine, entities: int, versions: int, keys: int) -> None:
+    entity_table = Entity.__table__
+    key_table = ApiKey.__table__
+    now = dt.datetime.now()
+    with engine.begin() as connection:
+        for version in range(versions):
+            connection.execute(
+                entity_table.insert(),
+                [
+                    {"id": i, "foo": f"foo-{version}", "bar": f"bar-{i % 7}"}
+                    for i in range(1, entities + 1)
+                ],
+            )
+        connection.execute(
+            key_table.insert(),
+            [
+                {
+                    "name": f"key-{i}",
+                    "description": "",
+                    "created_at": now,
+                    "valid_until": now + dt.timedelta(days=365),
+                    "key": f"{i:032x}",
+                }
+                for i in range(keys)
+            ],
+        )
+
+
+def drop_indexes(engine: sa.Engine) -> None:
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.drop(connection, checkfirst=True)
+
+
+def run_queries(
+    engine: sa.Engine, entities: int, keys: int
+) -> Dict[str, float]:
+    rng = random.Random(0)
+    with engine.connect() as connection:
+        max_record_id = connection.scalar(ENTITY_TABLE.max_record_id_query())
+        cursor = max_record_id // 2
+        chunk_size = min(BASELINE_CHUNK, entities)
+
+        def initial_state() -> None:
+            connection.execute(ENTITY_TABLE.latest_rows_query()).all()
+
+        def baseline() -> None:
+            chunk = rng.sample(range(1, entities + 1), chunk_size)
+            query = ENTITY_TABLE.latest_rows_query(
+                ENTITY_TABLE.key.in_(chunk), ENTITY_TABLE.monotonic <= cursor
+            )
+            connection.execute(query).all()
+
+        def api_keys() -> None:
+            for _ in range(LOOKUPS):
+                key = f"{rng.randrange(keys):032x}"
+                connection.execute(
+                    sa.select(ApiKey.__table__).where(
+                        ApiKey.__table__.c.key == key
+                    )
+                ).first()
+
+        cases: Dict[str, Callable[[], None]] = {
+            "initial state (latest per id)": initial_state,
+            f"baseline, {chunk_size} ids": baseline,
+            f"api key lookup x{LOOKUPS}": api_keys,
+        }
+        return {name: measure(func) for name, func in cases.items()}
+
+
+def measure(func: Callable[[], None], repeat: int = 3) -> float:
+    """Возвращает лучшее время выполнения из repeat запусков."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=DEFAULT_ENTITIES,
+        help="Number of tracked entities",
+    )
+    parser.add_argument(
+        "--versions",
+        type=int,
+        default=DEFAULT_VERSIONS,
+        help="Number of records per entity",
+    )
+    parser.add_argument(
+        "--keys", type=int, default=DEFAULT_KEYS, help="Number of API keys"
+    )
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        engine = sa.create_engine(
+            "sqlite:///" + os.path.join(directory, "bench.db")
+        )
+        Base.metadata.create_all(engine)
+        drop_indexes(engine)
+        seed(engine, args.entities, args.versions, args.keys)
+
+        with engine.begin() as connection:
+            missing = check_indexes(connection)
+        before = run_queries(engine, args.entities, args.keys)
+        with engine.begin() as connection:
+            check_indexes(connection, create=True)
+            connection.exec_driver_sql("ANALYZE")
+        after = run_queries(engine, args.entities, args.keys)
+        engine.dispose()
+
+    print(
+        f"Records: {args.entities * args.versions}"
+        f" ({args.entities} entities x {args.versions}), keys: {args.keys}"
+    )
+    print(f"Missing indexes before: {', '.join(missing)}")
+    print(f"{'query':<32} {'no index, ms':>14} {'indexed, ms':>14}")
+    for name in before:
+        print(
+            f"{name:<32} {before[name] * 1000:14.1f}"
+            f" {after[name] * 1000:14.1f}"
+        )
@@ -0,0 +1,386 @@
+"""
+Нагрузочный тест мониторов изменений. Заполняет test_table объектами
+с историей заданной глубины, запускает писателя, добавляющего изменения
+с заданной частотой, и много одновременных потребителей: через Python API
+(ChangeMonitor в отдельных потоках) и через веб-сервис (main.app в том же
+процессе через httpx.ASGITransport).
+
+Писатель записывает в атрибут foo время записи, поэтому задержка обновления
+измеряется от записи изменения в базу данных до его получения потребителем.
+Печатаются время получения начального состояния, процентили задержки,
+пропускная способность и пиковый объем памяти процесса (RSS).
+
+По умолчанию используется временный файл SQLite. Для MySQL передаются
+--dburl и --async-dburl; записи в этом случае добавляются к существующим.
+Запускается из корня репозитория: python -m benchmarks.load
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import httpx
+import sqlalchemy as sa
+
+from model.base import Alchemy, AsyncAlchemy
+from model.model import Base, Entity, Patch
+from monitor import ChangeMonitor
+
+DEFAULT_ENTITIES = 10_000
+DEFAULT_HISTORY = 5
+DEFAULT_RATE = 500.0
+DEFAULT_DURATION = 10.0
+DEFAULT_CONSUMERS = 20
+DEFAULT_WAIT = 1.0
+WRITER_TICK = 0.05
+SEED_BATCH = 10_000
+
+
+class Stats:
+    """Результаты одного режима нагрузки, собираемые из разных потоков."""
+
+    def __init__(self) -> None:
+        self.snapshots: List[float] = []
+        self.latencies: List[float] = []
+        self.requests = 0
+        self.patches = 0
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def add_snapshot(self, elapsed: float) -> None:
+        with self._lock:
+            self.snapshots.append(elapsed)
+
+    def add_update(self, written_at: List[float], patches: int) -> None:
+        now = time.time()
+        with self._lock:
+            self.requests += 1
+            self.patches += patches
+            self.latencies.extend(now - moment for moment in written_at)
+
+    def add_error(self) -> None:
+        with self._lock:
+            self.errors += 1
+
+
+def seed(engine: sa.Engine, entities: int, history: int) -> None:
+    """Создает entities объектов с history записями у каждого."""
+    table = Entity.__table__
+    rows = (
+        {"id": entity_id, "foo": f"seed-{version}", "bar": "bar"}
+        for version in range(history)
+        for entity_id in range(1, entities + 1)
+    )
+    with engine.begin() as connection:
+        batch: List[Dict[str, Any]] = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == SEED_BATCH:
+                connection.execute(table.insert(), batch)
+                batch = []
+        if batch:
+            connection.execute(table.insert(), batch)
+
+
+def write_changes(
+    engine: sa.Engine,
+    entities: int,
+    rate: float,
+    stop: threading.Event,
+    written: List[int],
+) -> None:
+    """
+    Добавляет изменения случайных объектов с частотой rate записей
+    в секунду, пока не установлен stop. Количество записей сохраняет
+    в written[0].
+    """
+    rng = random.Random(0)
+    table = Entity.__table__
+    started = time.monotonic()
+    count = 0
+    while not stop.is_set():
+        due = int((time.monotonic() - started) * rate) - count
+        if due > 0:
+            rows = [
+                {
+                    "id": rng.randint(1, entities),
+                    "foo": "t%.6f" % time.time(),
+                    "bar": "bar",
+                }
+                for _ in range(due)
+            ]
+            with engine.begin() as connection:
+                connection.execute(table.insert(), rows)
+            count += due
+            written[0] = count
+        stop.wait(WRITER_TICK)
+
+
+def written_at(patch: Dict[str, Any]) -> Optional[float]:
+    """Возвращает время записи изменения, сохраненное писателем в foo."""
+    value = patch["value"]
+    if isinstance(value, dict):
+        value = value.get("foo")
+    if isinstance(value, str) and value.startswith("t"):
+        return float(value[1:])
+    return None
+
+
+def patch_to_dict(patch: Patch) -> Dict[str, Any]:
+    return {"op": patch.operation, "path": patch.path, "value": patch.value}
+
+
+def record_update(stats: Stats, patches: List[Dict[str, Any]]) -> None:
+    moments = [written_at(patch) for patch in patches]
+    stats.add_update(
+        [moment for moment in moments if moment is not None], len(patches)
+    )
+
+
+def api_consumer(
+    dburl: str, deadline: float, wait: float, stats: Stats
+) -> None:
+    """Потребитель, работающий через ChangeMonitor."""
+    try:
+        monitor = ChangeMonitor(dburl=dburl)
+        started = time.perf_counter()
+        monitor.get_initial_state()
+        stats.add_snapshot(time.perf_counter() - started)
+        while time.monotonic() < deadline:
+            patches = monitor.get_patches(
+                wait=min(wait, max(deadline - time.monotonic(), 0))
+            )
+            record_update(stats, [patch_to_dict(patch) for patch in patches])
+    except Exception:
+        stats.add_error()
+        raise
+
+
+def run_api(dburl: str, consumers: int, duration: float, wait: float) -> Stats:
+    stats = Stats()
+    deadline = time.monotonic() + duration
+    threads = [
+        threading.Thread(
+            target=api_consumer, args=(dburl, deadline, wait, stats)
+        )
+        for _ in range(consumers)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return stats
+
+
+async def http_consumer(
+    client: httpx.AsyncClient, deadline: float, wait: float, stats: Stats
+) -> None:
+    """Потребитель, работающий через веб-сервис."""
+    try:
+        response = await client.post(
+            "/api/v1/create", data={"name": "benchmark"}
+        )
+        key = json.loads(response.json())["key"]
+        started = time.perf_counter()
+        response = await client.get(
+            "/api/v1/get_initial_data", params={"api_key": key}
+        )
+        response.raise_for_status()
+        stats.add_snapshot(time.perf_counter() - started)
+        while time.monotonic() < deadline:
+            response = await client.get(
+                "/api/v1/get_updates",
+                params={
+                    "api_key": key,
+                    "wait": min(wait, max(deadline - time.monotonic(), 0)),
+                },
+            )
+            response.raise_for_status()
+            record_update(stats, json.loads(response.text))
+    except Exception:
+        stats.add_error()
+        raise
+
+
+async def run_http(
+    async_dburl: str, consumers: int, duration: float, wait: float
+) -> Stats:
+    # движок создается до импорта веб-сервиса, поэтому он использует
+    # переданную базу данных, а не connection_params.json
+    AsyncAlchemy(dburl=async_dburl)
+    import main
+
+    stats = Stats()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(
+            transport=transport, base_url="http://benchmark", timeout=None
+        ) as client:
+            deadline = time.monotonic() + duration
+            await asyncio.gather(
+                *(
+                    http_consumer(client, deadline, wait, stats)
+                    for _ in range(consumers)
+                ),
+                return_exceptions=True,
+            )
+    return stats
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    index = min(int(fraction * len(ordered)), len(ordered) - 1)
+    return ordered[index]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss в байтах на macOS и в килобайтах на Linux
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def report(
+    mode: str,
+    stats: Stats,
+    duration: float,
+    written: int,
+    elapsed: float,
+    consumers: int,
+) -> None:
+    ms = 1000
+    print(f"[{mode}] consumers: {consumers}, errors: {stats.errors}")
+    print(
+        "  snapshot, ms:       "
+        f"p50 {percentile(stats.snapshots, 0.5) * ms:8.1f}"
+        f"  max {max(stats.snapshots, default=float('nan')) * ms:8.1f}"
+    )
+    print(
+        "  update latency, ms: "
+        f"p50 {percentile(stats.latencies, 0.5) * ms:8.1f}"
+        f"  p95 {percentile(stats.latencies, 0.95) * ms:8.1f}"
+        f"  p99 {percentile(stats.latencies, 0.99) * ms:8.1f}"
+    )
+    print(
+        f"  throughput:         {written / elapsed:8.1f} writes/s"
+        f"  {stats.patches / duration:10.1f} patches/s"
+        f"  {stats.requests / duration:8.1f} requests/s"
+    )
+    print(f"  peak RSS:           {peak_rss_mb():8.1f} MB")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dburl", help="Database URL in SQLAlchemy format")
+    parser.add_argument(
+        "--async-dburl",
+        help="Database URL with an async driver for the web service",
+    )
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=DEFAULT_ENTITIES,
+        help="Number of tracked entities to seed",
+    )
+    parser.add_argument(
+        "--history",
+        type=int,
+        default=DEFAULT_HISTORY,
+        help="Number of seeded records per entity",
+    )
+    parser.add_argument(
+        "--rate",
+        type=float,
+        default=DEFAULT_RATE,
+        help="Target number of written changes per second",
+    )
+    parser.add_argument(
+        "--duration",
+        type=float,
+        default=DEFAULT_DURATION,
+        help="Duration of each mode in seconds",
+    )
+    parser.add_argument(
+        "--consumers",
+        type=int,
+        default=DEFAULT_CONSUMERS,
+        help="Number of concurrent consumers",
+    )
+    parser.add_argument(
+        "--wait",
+        type=float,
+        default=DEFAULT_WAIT,
+        help="Long polling timeout of update requests in seconds",
+    )
+    parser.add_argument(
+        "--modes",
+        nargs="+",
+        choices=["api", "http"],
+        default=["api", "http"],
+        help="Consumer kinds to run",
+    )
+    args = parser.parse_args()
+
+    directory = None
+    dburl, async_dburl = args.dburl, args.async_dburl
+    if not dburl:
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "load.db")
+        dburl = "sqlite:///" + path
+        async_dburl = "sqlite+aiosqlite:///" + path
+    if "http" in args.modes and not async_dburl:
+        parser.error("--async-dburl is required with --dburl for http mode")
+
+    engine = sa.create_engine(dburl)
+    if engine.dialect.name == "sqlite":
+        with engine.connect() as connection:
+            connection.exec_driver_sql("PRAGMA journal_mode=WAL")
+    Base.metadata.create_all(engine)
+    started = time.perf_counter()
+    seed(engine, args.entities, args.history)
+    print(
+        f"Seeded {args.entities * args.history} records"
+        f" ({args.entities} entities x {args.history})"
+        f" in {time.perf_counter() - started:.1f} s"
+    )
+    Alchemy(dburl=dburl)
+
+    for mode in args.modes:
+        stop = threading.Event()
+        written = [0]
+        writer = threading.Thread(
+            target=write_changes,
+            args=(engine, args.entities, args.rate, stop, written),
+        )
+        started = time.perf_counter()
+        writer.start()
+        try:
+            if mode == "api":
+                stats = run_api(
+                    dburl, args.consumers, args.duration, args.wait
+                )
+            else:
+                stats = asyncio.run(
+                    run_http(
+                        async_dburl, args.consumers, args.duration, args.wait
+                    )
+                )
+        finally:
+            stop.set()
+            writer.join()
+        elapsed = time.perf_counter() - started
+        report(mode, stats, args.duration, written[0], elapsed, args.consumers)
+
+    engine.dispose()
+    if directory is not None:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
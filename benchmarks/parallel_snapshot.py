@@ -0,0 +1,115 @@
+"""
+Время получения начального состояния ChangeMonitor по истории изменений
+одним запросом и параллельно по диапазонам объектов в разном количестве
+потоков. По умолчанию используется временный файл SQLite; для MySQL
+передается --dburl, записи в этом случае добавляются к существующим.
+Запускается из корня репозитория: python -m benchmarks.parallel_snapshot
+"""
+import argparse
+import os
+import tempfile
+import time
+from typing import List
+
+import sqlalchemy as sa
+
+from model.base import Alchemy
+from model.model import Base, Entity
+from monitor import ChangeMonitor
+from serialization import SNAPSHOT_TYPES
+
+DEFAULT_ENTITIES = 200_000
+DEFAULT_VERSIONS = 5
+DEFAULT_WORKERS = [1, 2, 4, 8]
+SEED_BATCH = 10_000
+
+
+def seed(engine: sa.Engine, entities: int, versions: int) -> None:
+    table = Entity.__table__
+    with engine.begin() as connection:
+        for version in range(versions):
+            for start in range(1, entities + 1, SEED_BATCH):
+                stop = min(start + SEED_BATCH, entities + 1)
+                connection.execute(
+                    table.insert(),
+                    [
+                        {"id": i, "foo": f"foo-{version}", "bar": f"b{i % 7}"}
+                        for i in range(start, stop)
+                    ],
+                )
+
+
+def snapshot(dburl: str, media_type: str, workers: int) -> float:
+    """Возвращает время получения начального состояния новым монитором."""
+    monitor = ChangeMonitor(dburl=dburl)
+    started = time.perf_counter()
+    for _ in monitor.iter_initial_state(
+        media_type=media_type, workers=workers
+    ):
+        pass
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--dburl", help="Database URL in SQLAlchemy format")
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=DEFAULT_ENTITIES,
+        help="Number of tracked entities to seed",
+    )
+    parser.add_argument(
+        "--versions",
+        type=int,
+        default=DEFAULT_VERSIONS,
+        help="Number of seeded records per entity",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        nargs="+",
+        default=DEFAULT_WORKERS,
+        help="Numbers of worker threads to compare",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per case, best is shown"
+    )
+    args = parser.parse_args()
+
+    directory = None
+    dburl = args.dburl
+    if not dburl:
+        directory = tempfile.mkdtemp()
+        dburl = "sqlite:///" + os.path.join(directory, "snapshot.db")
+
+    engine = sa.create_engine(dburl)
+    Base.metadata.create_all(engine)
+    seed(engine, args.entities, args.versions)
+    engine.dispose()
+    Alchemy(dburl=dburl)
+
+    print(
+        f"Records: {args.entities * args.versions}"
+        f" ({args.entities} entities x {args.versions})"
+    )
+    print(f"{'format':<22} {'workers':>7} {'ms':>9} {'speedup':>8}")
+    for media_type in SNAPSHOT_TYPES:
+        serial = None
+        for workers in args.workers:
+            times: List[float] = [
+                snapshot(dburl, media_type, workers)
+                for _ in range(args.repeat)
+            ]
+            best = min(times)
+            serial = serial or best
+            print(
+                f"{media_type:<22} {workers:>7} {best * 1000:9.1f}"
+                f" {serial / best:7.2f}x"
+            )
+
+    Alchemy(dburl=dburl).dispose()
+    if directory is not None:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
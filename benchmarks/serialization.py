@@ -0,0 +1,107 @@
+"""
+Сравнение скорости сериализации списка патчей.
+Прежний путь кодирует значение каждого патча add отдельным вызовом
+json.dumps(..., cls=EntityEncoder), а затем весь список через PatchEncoder.
+Новый путь (serialization.dump_patches) строит словари и кодирует их
+одним вызовом стандартным json или orjson, если он установлен.
+Измеряется формирование патчей по готовым сущностям и их кодирование.
+Запускается из корня репозитория: python -m benchmarks.serialization
+"""
+import argparse
+import json
+import time
+from typing import Any, Callable, List
+
+from model.model import Entity, EntityEncoder, Patch, PatchEncoder
+import serialization
+
+DEFAULT_COUNTS = [10_000, 100_000]
+DEFAULT_REPEAT = 5
+
+
+def build_entities(count: int) -> List[Entity]:
+    return [
+        Entity(entity_id=i, foo="foo-%d" % i, bar="bar-%d" % (i % 7))
+        for i in range(count)
+    ]
+
+
+def build_patches(
+    entities: List[Entity], to_value: Callable[[Entity], Any]
+) -> List[Patch]:
+    # половина патчей - новые объекты, половина - замены атрибутов
+    patches = []
+    for i, entity in enumerate(entities):
+        if i % 2:
+            patches.append(Patch(path=f"/{i}/foo", value=entity.foo))
+        else:
+            patches.append(
+                Patch(operation="add", path=f"/{i}", value=to_value(entity))
+            )
+    return patches
+
+
+def legacy_dump(entities: List[Entity]) -> str:
+    patches = build_patches(
+        entities, lambda entity: json.dumps(entity, cls=EntityEncoder)
+    )
+    return json.dumps(patches, cls=PatchEncoder)
+
+
+def stdlib_dump(entities: List[Entity]) -> str:
+    patches = build_patches(entities, serialization.entity_to_dict)
+    return json.dumps(
+        [serialization.patch_to_dict(patch) for patch in patches],
+        ensure_ascii=False,
+    )
+
+
+def single_pass_dump(entities: List[Entity]) -> str:
+    patches = build_patches(entities, serialization.entity_to_dict)
+    return serialization.dump_patches(patches)
+
+
+def measure(
+    func: Callable[[List[Entity]], str], entities: List[Entity], repeat: int
+) -> float:
+    """Возвращает лучшее время выполнения из repeat запусков."""
+    best = float("inf")
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(entities)
+        best = min(best, time.perf_counter() - started)
+    return best
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--counts",
+        type=int,
+        nargs="+",
+        default=DEFAULT_COUNTS,
+        help="Numbers of patches to serialize",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=DEFAULT_REPEAT,
+        help="Number of runs, the best one is reported",
+    )
+    args = parser.parse_args()
+
+    print(f"Serialization backend: {serialization.BACKEND}")
+    cases = [
+        ("encoders (double dumps)", legacy_dump),
+        ("single pass, json", stdlib_dump),
+        (f"single pass, {serialization.BACKEND}", single_pass_dump),
+    ]
+    for count in args.counts:
+        entities = build_entities(count)
+        print(f"Patches: {count}")
+        for name, func in cases:
+            elapsed = measure(func, entities, args.repeat)
+            print(
+                f"  {name:<26} {elapsed * 1000:9.1f} ms"
+                f" {elapsed / count * 1e6:7.2f} us/patch"
+            )
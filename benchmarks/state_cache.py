@@ -0,0 +1,76 @@
+"""
+Сравнение потребления памяти кэшем состояния монитора.
+Сравнивает словарь ORM-объектов Entity (прежний ChangeMonitor._cache)
+с колоночным хранилищем StateStore на заданном количестве объектов.
+Запускается из корня репозитория: python -m benchmarks.state_cache
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+from typing import Callable, Tuple
+
+from model.model import Entity
+from state import StateStore
+
+DEFAULT_COUNT = 1_000_000
+DISTINCT_VALUES = 1000
+
+
+def _values(i: int) -> Tuple[str, str]:
+    # значения повторяются, как у реальных справочных атрибутов;
+    # строки создаются заново, как при чтении из базы данных
+    return "foo-%d" % (i % DISTINCT_VALUES), "bar-%d" % (i % 7)
+
+
+def build_orm_cache(count: int) -> dict:
+    cache = {}
+    for i in range(count):
+        foo, bar = _values(i)
+        cache[i] = Entity(entity_id=i, foo=foo, bar=bar, record_id=i)
+    return cache
+
+
+def build_state_store(count: int) -> StateStore:
+    store = StateStore(Entity.relevant_atributes)
+    for i in range(count):
+        store.put(i, i, _values(i))
+    return store
+
+
+def measure(build: Callable[[int], object], count: int) -> Tuple[int, float]:
+    """
+    Строит кэш и возвращает объем занятой им памяти в байтах и время построения.
+    """
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    cache = build(count)
+    elapsed = time.perf_counter() - started
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del cache
+    gc.collect()
+    return size, elapsed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--count",
+        type=int,
+        default=DEFAULT_COUNT,
+        help="Number of entities in the cache",
+    )
+    args = parser.parse_args()
+
+    results = [
+        ("dict[int, Entity]", measure(build_orm_cache, args.count)),
+        ("StateStore", measure(build_state_store, args.count)),
+    ]
+    print(f"Entities: {args.count}")
+    for name, (size, elapsed) in results:
+        print(
+            f"{name:<20} {size / 2**20:10.1f} MiB"
+            f" {size / args.count:8.1f} B/entity {elapsed:8.2f} s"
+        )
@@ -0,0 +1,68 @@
+"""
+Размер и время кодирования начального состояния в разных форматах ответа
+(JSON, колоночные NDJSON и MessagePack) без сжатия и со сжатием gzip и zstd.
+Форматы и алгоритмы, библиотеки для которых не установлены, пропускаются.
+Запускается из корня репозитория: python -m benchmarks.wire_formats
+"""
+import argparse
+import time
+from typing import Any, List, Sequence, Tuple
+
+import compression
+import serialization
+
+DEFAULT_ENTITIES = 100_000
+BATCH_SIZE = 1000
+FIELDS = ["foo", "bar"]
+
+
+def build_items(count: int) -> List[Tuple[int, Sequence[Any]]]:
+    return [
+        (i, ("foo-%d" % (i * 7919 % 1_000_000), "bar-%d" % (i % 7)))
+        for i in range(1, count + 1)
+    ]
+
+
+def encode_state(
+    items: List[Tuple[int, Sequence[Any]]], media_type: str
+) -> bytes:
+    """Кодирует состояние пачками, как это делает монитор."""
+    writer = serialization.state_writer(media_type)
+    chunks = [writer.begin(), writer.begin_table("test_table", FIELDS)]
+    for start in range(0, len(items), BATCH_SIZE):
+        stop = start + BATCH_SIZE
+        chunks.append(writer.chunk(items[start:stop]))
+    chunks += [writer.end_table(), writer.end()]
+    return b"".join(
+        chunk.encode() if isinstance(chunk, str) else chunk for chunk in chunks
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--entities",
+        type=int,
+        default=DEFAULT_ENTITIES,
+        help="Number of entities in the snapshot",
+    )
+    args = parser.parse_args()
+
+    items = build_items(args.entities)
+    print(
+        f"Entities: {args.entities}, serialization: {serialization.BACKEND},"
+        f" compression: {', '.join(compression.ENCODINGS)}"
+    )
+    print(f"{'format':<22} {'encoding':<9} {'bytes':>11} {'ms':>8}")
+    baseline = None
+    for media_type in serialization.SNAPSHOT_TYPES:
+        for encoding in [compression.IDENTITY] + compression.ENCODINGS:
+            started = time.perf_counter()
+            body = encode_state(items, media_type)
+            body, _ = compression.compress_body(body, encoding)
+            elapsed = time.perf_counter() - started
+            baseline = baseline or len(body)
+            print(
+                f"{media_type:<22} {encoding:<9} {len(body):>11}"
+                f" {elapsed * 1000:8.1f}  x{baseline / len(body):.1f}"
+            )
@@ -0,0 +1,335 @@
+"""
+Кэши в памяти процесса, используемые веб-сервисом.
+"""
+from collections import OrderedDict
+import datetime as dt
+import logging as log
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+import metrics
+
+DEFAULT_MAXSIZE: int = 1024
+DEFAULT_TTL: float = 60.0
+DEFAULT_IDLE_TIMEOUT: float = 900.0
+DEFAULT_MEMORY_BUDGET: int = 1 << 30
+# сколько помнить вытесненные мониторы, чтобы сообщать клиентам о вытеснении
+DEFAULT_TOMBSTONES: int = 100000
+DEFAULT_TOMBSTONE_TTL: float = 86400.0
+
+
+class LRUCache:
+    """
+    Потокобезопасный LRU-кэш с ограничением времени жизни записей
+    и счетчиками попаданий и промахов. Кроме количества записей можно
+    ограничить их суммарный размер, например для закодированных ответов.
+
+    Args:
+        maxsize (int): Максимальное количество записей.
+        ttl (float): Время жизни записи в секундах.
+        max_bytes (Optional[int]): Максимальный суммарный размер записей в байтах.
+        sizeof (Callable[[Any], int]): Функция, вычисляющая размер значения.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = DEFAULT_MAXSIZE,
+        ttl: float = DEFAULT_TTL,
+        max_bytes: Optional[int] = None,
+        sizeof: Callable[[Any], int] = len,
+    ) -> None:
+        """
+        Создает пустой кэш.
+
+        Args:
+            maxsize (int): Максимальное количество записей. (default: DEFAULT_MAXSIZE)
+            ttl (float): Время жизни записи в секундах. (default: DEFAULT_TTL)
+            max_bytes (Optional[int]): Максимальный суммарный размер записей в байтах, None - без ограничения. (default: None)
+            sizeof (Callable[[Any], int]): Функция, вычисляющая размер значения; используется, только если задан max_bytes. (default: len)
+        """
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._max_bytes = max_bytes
+        self._sizeof = sizeof
+        self._data: "OrderedDict[Hashable, Tuple[Any, float, int]]" = (
+            OrderedDict()
+        )
+        self._lock = threading.Lock()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        """
+        Возвращает значение из кэша.
+
+        Args:
+            key (Hashable): Ключ записи.
+
+        Returns:
+            Optional[Any]: Значение или None, если записи нет или срок ее жизни истек.
+        """
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None:
+                value, expires_at, _ = item
+                if expires_at > time.monotonic():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                self._remove(key)
+            self.misses += 1
+            return None
+
+    def put(
+        self, key: Hashable, value: Any, ttl: Optional[float] = None
+    ) -> None:
+        """
+        Сохраняет значение в кэш, вытесняя самую давно использованную запись
+        при переполнении.
+
+        Args:
+            key (Hashable): Ключ записи.
+            value (Any): Значение.
+            ttl (Optional[float]): Время жизни записи в секундах, если оно меньше стандартного. (default: None)
+        """
+        ttl = self._ttl if ttl is None else min(ttl, self._ttl)
+        if ttl <= 0:
+            return
+        size = 0 if self._max_bytes is None else self._sizeof(value)
+        if self._max_bytes is not None and size > self._max_bytes:
+            return
+        with self._lock:
+            self._remove(key)
+            self._data[key] = (value, time.monotonic() + ttl, size)
+            self.nbytes += size
+            while len(self._data) > self._maxsize or (
+                self._max_bytes is not None and self.nbytes > self._max_bytes
+            ):
+                self._remove(next(iter(self._data)))
+
+    def invalidate(self, key: Hashable) -> None:
+        """
+        Удаляет запись из кэша.
+
+        Args:
+            key (Hashable): Ключ записи.
+        """
+        with self._lock:
+            self._remove(key)
+
+    def clear(self) -> None:
+        """Удаляет все записи из кэша."""
+        with self._lock:
+            self._data.clear()
+            self.nbytes = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику использования кэша.
+
+        Returns:
+            Dict[str, int]: Количество попаданий, промахов и записей, а если задан max_bytes, и их суммарный размер.
+        """
+        stats = {"hits": self.hits, "misses": self.misses, "size": len(self)}
+        if self._max_bytes is not None:
+            stats["bytes"] = self.nbytes
+        return stats
+
+    def _remove(self, key: Hashable) -> None:
+        """Удаляет запись, если она есть. Вызывается под блокировкой."""
+        item = self._data.pop(key, None)
+        if item is not None:
+            self.nbytes -= item[2]
+
+
+class _MonitorEntry:
+    """Монитор в реестре и отметки для его вытеснения."""
+
+    __slots__ = ("monitor", "last_access", "expires_at")
+
+    def __init__(self, monitor: Any, expires_at: Optional[dt.datetime]):
+        self.monitor = monitor
+        self.last_access = time.monotonic()
+        self.expires_at = expires_at
+
+
+class MonitorRegistry:
+    """
+    Реестр мониторов потребителей веб-сервиса по API ключам. Мониторы
+    вытесняются методом sweep, если к ним не обращались дольше idle_timeout
+    секунд, если истек срок действия ключа или если суммарный размер кэшей
+    мониторов превышает memory_budget байт (в порядке давности последнего
+    обращения). Причина вытеснения запоминается, чтобы сообщить клиенту,
+    можно ли восстановить монитор или нужно заново получить начальное
+    состояние.
+
+    Args:
+        idle_timeout (float): Время без обращений до вытеснения в секундах.
+        memory_budget (Optional[int]): Максимальный суммарный размер кэшей мониторов в байтах, None - без ограничения.
+        tombstones (int): Сколько вытесненных ключей помнить.
+        tombstone_ttl (float): Сколько секунд помнить вытесненный ключ.
+    """
+
+    def __init__(
+        self,
+        idle_timeout: float = DEFAULT_IDLE_TIMEOUT,
+        memory_budget: Optional[int] = DEFAULT_MEMORY_BUDGET,
+        tombstones: int = DEFAULT_TOMBSTONES,
+        tombstone_ttl: float = DEFAULT_TOMBSTONE_TTL,
+    ) -> None:
+        """
+        Создает пустой реестр.
+
+        Args:
+            idle_timeout (float): Время без обращений до вытеснения в секундах. (default: DEFAULT_IDLE_TIMEOUT)
+            memory_budget (Optional[int]): Максимальный суммарный размер кэшей мониторов в байтах, None - без ограничения. (default: DEFAULT_MEMORY_BUDGET)
+            tombstones (int): Сколько вытесненных ключей помнить. (default: DEFAULT_TOMBSTONES)
+            tombstone_ttl (float): Сколько секунд помнить вытесненный ключ. (default: DEFAULT_TOMBSTONE_TTL)
+        """
+        self._idle_timeout = idle_timeout
+        self._memory_budget = memory_budget
+        self._entries: "OrderedDict[str, _MonitorEntry]" = OrderedDict()
+        self._evicted = LRUCache(maxsize=tombstones, ttl=tombstone_ttl)
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Возвращает монитор и отмечает обращение к нему.
+
+        Args:
+            key (str): API ключ потребителя.
+
+        Returns:
+            Optional[Any]: Монитор или None, если его нет в реестре.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            entry.last_access = time.monotonic()
+            self._entries.move_to_end(key)
+            return entry.monitor
+
+    def peek(self, key: str) -> Optional[Any]:
+        """
+        Возвращает монитор, не отмечая обращение к нему.
+
+        Args:
+            key (str): API ключ потребителя.
+
+        Returns:
+            Optional[Any]: Монитор или None, если его нет в реестре.
+        """
+        entry = self._entries.get(key)
+        return None if entry is None else entry.monitor
+
+    def put(
+        self,
+        key: str,
+        monitor: Any,
+        expires_at: Optional[dt.datetime] = None,
+    ) -> None:
+        """
+        Добавляет монитор потребителя, заменяя предыдущий, и забывает
+        о его вытеснении.
+
+        Args:
+            key (str): API ключ потребителя.
+            monitor (Any): Монитор.
+            expires_at (Optional[dt.datetime]): Окончание срока действия ключа. (default: None)
+        """
+        with self._lock:
+            self._entries[key] = _MonitorEntry(monitor, expires_at)
+            self._entries.move_to_end(key)
+        self._evicted.invalidate(key)
+
+    def pop(self, key: str) -> Optional[Any]:
+        """
+        Удаляет монитор потребителя без отметки о вытеснении.
+
+        Args:
+            key (str): API ключ потребителя.
+
+        Returns:
+            Optional[Any]: Удаленный монитор или None.
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        return None if entry is None else entry.monitor
+
+    def eviction_reason(self, key: str) -> Optional[str]:
+        """
+        Возвращает причину вытеснения монитора потребителя.
+
+        Args:
+            key (str): API ключ потребителя.
+
+        Returns:
+            Optional[str]: "idle", "expired", "memory" или None, если монитор не вытеснялся.
+        """
+        return self._evicted.get(key)
+
+    def sweep(self) -> List[Tuple[str, str]]:
+        """
+        Вытесняет мониторы с истекшим сроком действия ключа или без
+        обращений дольше idle_timeout, а затем самые давно использованные
+        мониторы, пока суммарный размер кэшей больше memory_budget.
+        Последний использованный монитор не вытесняется по размеру.
+
+        Returns:
+            List[Tuple[str, str]]: Ключи вытесненных мониторов и причины вытеснения.
+        """
+        now = dt.datetime.now()
+        idle_since = time.monotonic() - self._idle_timeout
+        evicted: List[Tuple[str, str]] = []
+
+        for key, entry in list(self._entries.items()):
+            if entry.expires_at is not None and entry.expires_at <= now:
+                evicted.append((key, "expired"))
+            elif entry.last_access < idle_since:
+                evicted.append((key, "idle"))
+        for key, reason in evicted:
+            self._evict(key, reason)
+
+        if self._memory_budget is not None:
+            entries = list(self._entries.items())
+            sizes = [entry.monitor.nbytes() for _, entry in entries]
+            total = sum(sizes)
+            for (key, _), size in zip(entries[:-1], sizes):
+                if total <= self._memory_budget:
+                    break
+                self._evict(key, "memory")
+                evicted.append((key, "memory"))
+                total -= size
+        return evicted
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Возвращает статистику реестра.
+
+        Returns:
+            Dict[str, int]: Количество мониторов и вытеснений.
+        """
+        return {"size": len(self), "evictions": self.evictions}
+
+    def _evict(self, key: str, reason: str) -> None:
+        """Удаляет монитор и запоминает причину вытеснения."""
+        with self._lock:
+            if self._entries.pop(key, None) is None:
+                return
+            self.evictions += 1
+        self._evicted.put(key, reason)
+        metrics.MONITOR_EVICTIONS.labels(reason).inc()
+        log.info("Evicted monitor of API key %s...: %s", key[:4], reason)
@@ -0,0 +1,117 @@
+"""
+Захват изменений триггером: альтернатива опросу истории test_table
+по диапазону record_id. Триггер (см. Alchemy.install_change_capture) при
+вставке каждой записи пишет в таблицу change_log компактное событие -
+идентификаторы записи и объекта, битовую маску изменившихся атрибутов
+и значения только этих атрибутов. Мониторы в режиме change_capture читают
+новые события через общий источник изменений и формируют изменения прямо
+по ним, не сравнивая записи с предыдущим состоянием объектов, поэтому
+обновления не обращаются к истории изменений, а старые записи истории
+можно переносить в архив. Нужно только, чтобы материализованное состояние
+(latest_state) и контрольные точки успели учесть архивируемые записи.
+
+События, которые уже прошли все курсоры потребителей, удаляются функцией
+prune. Record_id событий совпадают с record_id записей истории, поэтому
+курсоры мониторов и отметки начального состояния в обоих режимах одинаковы.
+
+Функции принимают синхронную сессию, поэтому их можно вызывать и напрямую,
+и из AsyncSession.run_sync.
+"""
+import json
+import logging as log
+from typing import Dict, Iterable, List
+
+import sqlalchemy as sa
+from sqlalchemy.orm.session import Session
+
+from model.model import ChangeLog
+from notify import Change
+from tracking import ENTITY_TABLE, TrackedTable
+
+# источник событий для ChangeFeed; строки событий: record_id, entity_id,
+# created, changed и значения атрибутов в порядке ENTITY_TABLE.fields
+CHANGE_LOG: TrackedTable = TrackedTable(
+    ChangeLog,
+    key=ChangeLog.entity_id,
+    monotonic=ChangeLog.record_id,
+    fields=["created", "changed", *ENTITY_TABLE.fields],
+)
+
+
+def enabled(filename: str) -> bool:
+    """
+    Проверяет, включен ли захват изменений триггером необязательным
+    параметром "change_capture" файла параметров подключения.
+
+    Args:
+        filename (str): Имя файла, содержащего параметры для подключения к базе данных.
+
+    Returns:
+        bool: True, если захват изменений включен.
+    """
+    with open(filename, "r") as file:
+        return bool(json.load(file).get("change_capture", False))
+
+
+def to_changes(
+    rows: Iterable[sa.Row], fields: Iterable[str] = ENTITY_TABLE.fields
+) -> List[Change]:
+    """
+    Формирует изменения по событиям. Несколько событий одного объекта
+    объединяются в одно изменение: для каждого атрибута берется последнее
+    значение, а изменение получает record_id последнего события.
+
+    Args:
+        rows (Iterable[sa.Row]): События, упорядоченные по record_id (колонки CHANGE_LOG.row_columns).
+        fields (Iterable[str]): Отслеживаемые атрибуты в порядке битов маски. (default: ENTITY_TABLE.fields)
+
+    Returns:
+        List[Change]: Изменения в порядке record_id их последних событий.
+    """
+    fields = tuple(fields)
+    merged: Dict[int, Change] = {}
+    for row in rows:
+        created, mask, values = row[2], row[3], row[4:]
+        changed = {
+            field: value
+            for i, (field, value) in enumerate(zip(fields, values))
+            if created or mask >> i & 1
+        }
+        previous = merged.pop(row.entity_id, None)
+        if previous is not None:
+            created = created or previous.created
+            changed = {**previous.fields, **changed}
+        merged[row.entity_id] = Change(
+            row.entity_id,
+            row.record_id,
+            changed,
+            created=bool(created),
+            table=ENTITY_TABLE.name,
+        )
+    return list(merged.values())
+
+
+def prune(session: Session, record_id: int) -> int:
+    """
+    Удаляет события с record_id не больше указанного. Вызывающий должен
+    передать минимальный курсор всех потребителей: события до него уже
+    никому не нужны, а новые потребители начинают с начального состояния.
+
+    Args:
+        session (Session): Сессия SQLAlchemy.
+        record_id (int): Минимальный курсор потребителей.
+
+    Returns:
+        int: Количество удаленных событий.
+    """
+    result = session.execute(
+        sa.delete(ChangeLog).where(ChangeLog.record_id <= record_id)
+    )
+    session.commit()
+    if result.rowcount:
+        log.info(
+            "Pruned %d change events up to record id %d",
+            result.rowcount,
+            record_id,
+        )
+    return result.rowcount
@@ -0,0 +1,338 @@
+"""
+Контрольные точки истории изменений таблицы Entity для исторических
+запросов: состояния объектов на момент record_id и изменений между двумя
+record_id. Контрольная точка хранит состояние всех объектов на момент
+своей отметки и создается через каждые interval записей истории, поэтому
+запрос загружает ближайшую предшествующую контрольную точку и дочитывает
+из истории только записи после нее, а не всю историю с начала.
+
+Методы принимают синхронную сессию, поэтому их можно вызывать и напрямую,
+и из AsyncSession.run_sync.
+"""
+import datetime as dt
+import logging as log
+from typing import Dict, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import Session
+
+from model.model import Checkpoint, CheckpointEntry
+from notify import Change
+from state import StateStore
+from tracking import ENTITY_TABLE
+
+DEFAULT_INTERVAL: int = 100000
+DEFAULT_KEEP: int = 24
+INSERT_BATCH_SIZE: int = 10000
+READ_BATCH_SIZE: int = 10000
+BASELINE_CHUNK_SIZE: int = 500
+
+# колонки checkpoint_entries в порядке ENTITY_TABLE.row_columns
+CHECKPOINT_COLUMNS: List[sa.ColumnElement] = [
+    CheckpointEntry.record_id,
+    CheckpointEntry.entity_id,
+    *(getattr(CheckpointEntry, field) for field in ENTITY_TABLE.fields),
+]
+
+
+class CheckpointIndex:
+    """
+    Создает контрольные точки и отвечает по ним на исторические запросы.
+
+    Отметки контрольных точек кратны interval. Новая контрольная точка
+    строится из предыдущей и записей истории после нее, поэтому стоимость
+    ее создания не зависит от длины истории. Хранятся только keep последних
+    контрольных точек; запросы до самой ранней из них читают историю
+    с начала.
+
+    Args:
+        interval (int): Количество записей истории между контрольными точками.
+        keep (int): Количество хранимых контрольных точек.
+    """
+
+    def __init__(
+        self, interval: int = DEFAULT_INTERVAL, keep: int = DEFAULT_KEEP
+    ) -> None:
+        """
+        Создает объект для работы с контрольными точками.
+
+        Args:
+            interval (int): Количество записей истории между контрольными точками. (default: DEFAULT_INTERVAL)
+            keep (int): Количество хранимых контрольных точек. (default: DEFAULT_KEEP)
+        """
+        self._interval = interval
+        self._keep = keep
+
+    def nearest(self, session: Session, record_id: int) -> Optional[int]:
+        """
+        Возвращает отметку ближайшей контрольной точки не новее record_id.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            record_id (int): Идентификатор записи.
+
+        Returns:
+            Optional[int]: Отметка контрольной точки или None, если такой нет.
+        """
+        return session.scalar(
+            sa.select(sa.func.max(Checkpoint.record_id)).filter(
+                Checkpoint.record_id <= record_id
+            )
+        )
+
+    def state_at(self, session: Session, record_id: int) -> StateStore:
+        """
+        Восстанавливает состояние объектов на момент record_id: загружает
+        ближайшую контрольную точку и применяет к ней последние записи
+        объектов, появившиеся после нее.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            record_id (int): Идентификатор записи, на момент которой нужно состояние.
+
+        Returns:
+            StateStore: Состояние объектов, у которых есть записи не новее record_id.
+        """
+        store = StateStore(ENTITY_TABLE.fields)
+        base = self.nearest(session, record_id)
+        criteria = [ENTITY_TABLE.monotonic <= record_id]
+        if base is None:
+            log.debug("No checkpoint before record id %d", record_id)
+        else:
+            query = (
+                sa.select(*CHECKPOINT_COLUMNS)
+                .filter(CheckpointEntry.checkpoint_id == base)
+                .order_by(CheckpointEntry.entity_id)
+            )
+            for row in session.execute(query):
+                store.put(row.entity_id, row.record_id, row[2:])
+            criteria.append(ENTITY_TABLE.monotonic > base)
+
+        query = ENTITY_TABLE.latest_rows_query(*criteria).order_by(
+            ENTITY_TABLE.key
+        )
+        for row in session.execute(query):
+            store.put(row.entity_id, row.record_id, row[2:])
+        return store
+
+    def changes_between(
+        self, session: Session, start: int, stop: int
+    ) -> List[Change]:
+        """
+        Формирует изменения объектов по записям истории с record_id больше
+        start и не больше stop, как если бы монитор с курсором start получил
+        обновления до stop. Предыдущее состояние изменившихся объектов
+        берется из ближайшей к start контрольной точки и записей после нее.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            start (int): Курсор, от которого формируются изменения.
+            stop (int): Последний учитываемый record_id.
+
+        Returns:
+            List[Change]: Изменения в порядке record_id их последних записей, возможно пустой.
+        """
+        query = ENTITY_TABLE.rows_query(
+            ENTITY_TABLE.monotonic > start,
+            ENTITY_TABLE.monotonic <= stop,
+        ).execution_options(yield_per=READ_BATCH_SIZE)
+        # последняя запись каждого объекта в порядке record_id; записи
+        # читаются пачками, в памяти остается по одной записи на объект
+        latest: Dict[int, sa.Row] = {}
+        for row in session.execute(query):
+            latest.pop(row.entity_id, None)
+            latest[row.entity_id] = row
+        baseline = self._baseline(session, list(latest), start)
+
+        fields = ENTITY_TABLE.fields
+        changes: List[Change] = []
+        for row in latest.values():
+            values = row[2:]
+            old_values = baseline.get(row.entity_id)
+            if old_values is None:
+                changed = dict(zip(fields, values))
+            else:
+                changed = {
+                    field: value
+                    for field, value, old_value in zip(
+                        fields, values, old_values
+                    )
+                    if StateStore.differs(value, old_value)
+                }
+                if not changed:
+                    continue
+            changes.append(
+                Change(
+                    row.entity_id,
+                    row.record_id,
+                    changed,
+                    created=old_values is None,
+                    table=ENTITY_TABLE.name,
+                )
+            )
+        return changes
+
+    def page_stop(
+        self, session: Session, start: int, stop: int, max_records: int
+    ) -> Tuple[int, bool]:
+        """
+        Находит границу страницы изменений: record_id, до которого
+        в диапазоне (start, stop] не больше max_records записей истории.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            start (int): Курсор, от которого формируются изменения.
+            stop (int): Последний учитываемый record_id диапазона.
+            max_records (int): Максимальное количество записей страницы.
+
+        Returns:
+            Tuple[int, bool]: Последний record_id страницы и признак того, что в диапазоне остались записи после нее.
+        """
+        record_ids = session.scalars(
+            sa.select(ENTITY_TABLE.monotonic)
+            .filter(
+                ENTITY_TABLE.monotonic > start,
+                ENTITY_TABLE.monotonic <= stop,
+            )
+            .order_by(ENTITY_TABLE.monotonic)
+            .offset(max_records - 1)
+            .limit(2)
+        ).all()
+        if len(record_ids) < 2:
+            return stop, False
+        return record_ids[0], True
+
+    def create(self, session: Session, record_id: int) -> bool:
+        """
+        Создает контрольную точку с отметкой record_id.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            record_id (int): Отметка контрольной точки.
+
+        Returns:
+            bool: True, если контрольная точка создана, False, если ее одновременно создал другой процесс.
+        """
+        store = self.state_at(session, record_id)
+        try:
+            session.add(
+                Checkpoint(
+                    record_id=record_id,
+                    entities=len(store),
+                    created_at=dt.datetime.now(),
+                )
+            )
+            session.flush()
+            batch: List[Dict[str, object]] = []
+            for entity_id, entry_record_id, values in store.items():
+                entry = dict(zip(ENTITY_TABLE.fields, values))
+                entry.update(
+                    checkpoint_id=record_id,
+                    entity_id=entity_id,
+                    record_id=entry_record_id,
+                )
+                batch.append(entry)
+                if len(batch) == INSERT_BATCH_SIZE:
+                    session.execute(sa.insert(CheckpointEntry), batch)
+                    batch = []
+            if batch:
+                session.execute(sa.insert(CheckpointEntry), batch)
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            log.warning("Concurrent checkpoint creation at %d", record_id)
+            return False
+        log.info(
+            "Created checkpoint at record id %d with %d entities",
+            record_id,
+            len(store),
+        )
+        return True
+
+    def maintain(self, session: Session) -> List[int]:
+        """
+        Создает недостающие контрольные точки до текущего максимального
+        record_id (не больше keep последних) и удаляет устаревшие.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+
+        Returns:
+            List[int]: Отметки созданных контрольных точек.
+        """
+        target = session.scalar(ENTITY_TABLE.max_record_id_query()) or 0
+        last = session.scalar(sa.select(sa.func.max(Checkpoint.record_id)))
+        latest = target // self._interval * self._interval
+        first = max(
+            (last or 0) + self._interval,
+            latest - (self._keep - 1) * self._interval,
+            self._interval,
+        )
+        created = [
+            record_id
+            for record_id in range(first, latest + 1, self._interval)
+            if self.create(session, record_id)
+        ]
+        self.prune(session)
+        return created
+
+    def prune(self, session: Session) -> int:
+        """
+        Удаляет контрольные точки старше keep последних.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+
+        Returns:
+            int: Количество удаленных контрольных точек.
+        """
+        stale = list(
+            session.scalars(
+                sa.select(Checkpoint.record_id)
+                .order_by(Checkpoint.record_id.desc())
+                .offset(self._keep)
+            )
+        )
+        if not stale:
+            return 0
+        session.execute(
+            sa.delete(CheckpointEntry).where(
+                CheckpointEntry.checkpoint_id.in_(stale)
+            )
+        )
+        session.execute(
+            sa.delete(Checkpoint).where(Checkpoint.record_id.in_(stale))
+        )
+        session.commit()
+        log.info("Removed %d stale checkpoints", len(stale))
+        return len(stale)
+
+    def _baseline(
+        self, session: Session, entity_ids: List[int], record_id: int
+    ) -> StateStore:
+        """
+        Восстанавливает состояние указанных объектов на момент record_id
+        по ближайшей контрольной точке и записям после нее.
+        """
+        store = StateStore(ENTITY_TABLE.fields)
+        base = self.nearest(session, record_id)
+        for start in range(0, len(entity_ids), BASELINE_CHUNK_SIZE):
+            stop = start + BASELINE_CHUNK_SIZE
+            chunk = entity_ids[start:stop]
+            criteria = [
+                ENTITY_TABLE.key.in_(chunk),
+                ENTITY_TABLE.monotonic <= record_id,
+            ]
+            if base is not None:
+                query = sa.select(*CHECKPOINT_COLUMNS).filter(
+                    CheckpointEntry.checkpoint_id == base,
+                    CheckpointEntry.entity_id.in_(chunk),
+                )
+                for row in session.execute(query):
+                    store.put(row.entity_id, row.record_id, row[2:])
+                criteria.append(ENTITY_TABLE.monotonic > base)
+            query = ENTITY_TABLE.latest_rows_query(*criteria)
+            for row in session.execute(query):
+                store.put(row.entity_id, row.record_id, row[2:])
+        return store
@@ -0,0 +1,127 @@
+"""
+Сжатие ответов веб-сервиса по заголовку Accept-Encoding: zstd (если
+установлен zstandard) или gzip. Ответы целиком сжимаются функцией
+compress_body, потоковые ответы - compress_stream по мере генерации частей.
+Ответы меньше MIN_SIZE байт не сжимаются.
+"""
+import zlib
+from typing import AsyncIterator, Dict, List, Optional, Tuple, Union
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover - zstandard необязателен
+    zstandard = None
+
+IDENTITY: str = "identity"
+GZIP: str = "gzip"
+ZSTD: str = "zstd"
+# поддерживаемые алгоритмы в порядке предпочтения сервера
+ENCODINGS: List[str] = ([ZSTD] if zstandard else []) + [GZIP]
+GZIP_LEVEL: int = 6
+ZSTD_LEVEL: int = 3
+MIN_SIZE: int = 512
+
+
+def negotiate(accept_encoding: Optional[str]) -> str:
+    """
+    Выбирает алгоритм сжатия по заголовку Accept-Encoding. При равном
+    приоритете выбирается алгоритм, раньше идущий в ENCODINGS.
+
+    Args:
+        accept_encoding (Optional[str]): Значение заголовка Accept-Encoding.
+
+    Returns:
+        str: Один из ENCODINGS или IDENTITY.
+    """
+    if not accept_encoding:
+        return IDENTITY
+    quality: Dict[str, float] = {}
+    for item in accept_encoding.split(","):
+        coding, *params = item.strip().lower().split(";")
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        quality[coding.strip()] = q
+
+    best, best_q = IDENTITY, 0.0
+    for encoding in ENCODINGS:
+        q = quality.get(encoding, quality.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def headers(encoding: str) -> Dict[str, str]:
+    """
+    Возвращает заголовки ответа, сжатого алгоритмом encoding.
+
+    Args:
+        encoding (str): Алгоритм сжатия.
+
+    Returns:
+        Dict[str, str]: Заголовки Content-Encoding (если ответ сжат) и Vary.
+    """
+    result = {"Vary": "Accept, Accept-Encoding"}
+    if encoding != IDENTITY:
+        result["Content-Encoding"] = encoding
+    return result
+
+
+def _compressor(encoding: str) -> "zlib._Compress":
+    """Создает потоковый компрессор алгоритма encoding."""
+    if encoding == ZSTD:
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+    # wbits=31 - формат gzip
+    return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def _to_bytes(data: Union[str, bytes]) -> bytes:
+    return data.encode() if isinstance(data, str) else data
+
+
+def compress_body(body: Union[str, bytes], encoding: str) -> Tuple[bytes, str]:
+    """
+    Сжимает тело ответа, если оно не меньше MIN_SIZE байт.
+
+    Args:
+        body (Union[str, bytes]): Тело ответа.
+        encoding (str): Выбранный алгоритм сжатия.
+
+    Returns:
+        Tuple[bytes, str]: Тело ответа и фактически примененный алгоритм.
+    """
+    data = _to_bytes(body)
+    if encoding == IDENTITY or len(data) < MIN_SIZE:
+        return data, IDENTITY
+    compressor = _compressor(encoding)
+    return compressor.compress(data) + compressor.flush(), encoding
+
+
+async def compress_stream(
+    chunks: AsyncIterator[Union[str, bytes]], encoding: str
+) -> AsyncIterator[bytes]:
+    """
+    Сжимает части потокового ответа по мере их появления.
+
+    Args:
+        chunks (AsyncIterator[Union[str, bytes]]): Части ответа.
+        encoding (str): Выбранный алгоритм сжатия.
+
+    Yields:
+        bytes: Очередная часть сжатого ответа.
+    """
+    if encoding == IDENTITY:
+        async for chunk in chunks:
+            yield _to_bytes(chunk)
+        return
+    compressor = _compressor(encoding)
+    async for chunk in chunks:
+        data = compressor.compress(_to_bytes(chunk))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,240 @@
+"""
+Общий источник изменений (change feed) для всех мониторов процесса,
+по одному на каждую отслеживаемую таблицу.
+Новые записи отслеживаемой таблицы читаются из базы данных один раз за цикл
+опроса и складываются в упорядоченный по record_id кольцевой буфер.
+Каждый монитор хранит только свой курсор (максимальный полученный record_id)
+и читает из буфера записи после него, поэтому нагрузка на базу данных
+не зависит от количества потребителей.
+
+Методы, обращающиеся к базе данных, принимают синхронную сессию, поэтому
+их можно вызывать и напрямую, и из AsyncSession.run_sync.
+"""
+import bisect
+import logging as log
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+import sqlalchemy as sa
+from sqlalchemy.orm.session import Session
+
+from tracking import ENTITY_TABLE, TrackedTable
+
+DEFAULT_CAPACITY: int = 10000
+DEFAULT_POLL_INTERVAL: float = 1.0
+MIN_WAIT_INTERVAL: float = 0.1
+
+
+class ChangeFeed:
+    """
+    Общий для процесса читатель новых записей отслеживаемой таблицы.
+
+    Буфер покрывает полуинтервал (low, high] по record_id. Запросы курсоров,
+    которые отстали дальше начала буфера, обслуживаются отдельным запросом
+    к базе данных в обход буфера.
+
+    Args:
+        table (TrackedTable): Отслеживаемая таблица.
+        capacity (int): Максимальное количество записей в буфере.
+        poll_interval (float): Минимальный интервал между опросами базы данных в секундах.
+    """
+
+    _instances: "Dict[Tuple[int, str], ChangeFeed]" = {}
+    _instances_lock = threading.Lock()
+
+    def __init__(
+        self,
+        table: TrackedTable = ENTITY_TABLE,
+        capacity: int = DEFAULT_CAPACITY,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+    ) -> None:
+        """
+        Создает пустой источник изменений. Начальная позиция определяется
+        при первом обращении к базе данных (см. start).
+
+        Args:
+            table (TrackedTable): Отслеживаемая таблица. (default: ENTITY_TABLE)
+            capacity (int): Максимальное количество записей в буфере. (default: DEFAULT_CAPACITY)
+            poll_interval (float): Минимальный интервал между опросами базы данных в секундах. (default: DEFAULT_POLL_INTERVAL)
+        """
+        self._table = table
+        self._capacity = capacity
+        self._poll_interval = poll_interval
+
+        self._lock = threading.Lock()
+        self._poll_lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._record_ids: List[int] = []
+        self._rows: List[sa.Row] = []
+
+        self._low: Optional[int] = None
+        self._high: Optional[int] = None
+        self._last_poll = time.monotonic()
+
+    @classmethod
+    def shared(
+        cls, alch: object, table: TrackedTable = ENTITY_TABLE
+    ) -> "ChangeFeed":
+        """
+        Возвращает общий источник изменений таблицы для переданного объекта
+        Alchemy, создавая его при первом обращении.
+
+        Args:
+            alch (object): Объект для работы с базой данных (Alchemy или AsyncAlchemy).
+            table (TrackedTable): Отслеживаемая таблица. (default: ENTITY_TABLE)
+
+        Returns:
+            ChangeFeed: Общий источник изменений.
+        """
+        key = (id(alch), table.name)
+        with cls._instances_lock:
+            feed = cls._instances.get(key)
+            if feed is None:
+                feed = cls(table)
+                cls._instances[key] = feed
+            return feed
+
+    @property
+    def high(self) -> int:
+        """Максимальный record_id, прочитанный из базы данных."""
+        return self._high or 0
+
+    @property
+    def wait_interval(self) -> float:
+        """Интервал, с которым ожидающим потребителям имеет смысл проверять буфер."""
+        return max(self._poll_interval, MIN_WAIT_INTERVAL)
+
+    def start(self, session: Session) -> None:
+        """
+        Запоминает текущий максимальный record_id как начало буфера,
+        если это еще не было сделано. Должен вызываться до снятия снимка
+        начального состояния, чтобы курсор потребителя попал в буфер.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+        """
+        if self._high is not None:
+            return
+        max_record_id = session.scalar(self._table.max_record_id_query()) or 0
+
+        with self._lock:
+            if self._high is None:
+                self._low = self._high = max_record_id
+                self._last_poll = time.monotonic()
+                log.info(
+                    "Started change feed for %s at record id %d",
+                    self._table.name,
+                    max_record_id,
+                )
+
+    def refresh(self, session: Session, force: bool = False) -> None:
+        """
+        Дочитывает новые записи из базы данных в буфер. Опрос выполняется
+        не чаще одного раза за poll_interval, а одновременные вызовы
+        из разных потоков не приводят к повторным запросам.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            force (bool): Выполнить опрос независимо от интервала. (default: False)
+        """
+        if self._high is None:
+            self.start(session)
+            return
+        if (
+            not force
+            and time.monotonic() - self._last_poll < self._poll_interval
+        ):
+            return
+        if not self._poll_lock.acquire(blocking=False):
+            return  # опрос уже выполняется в другом потоке
+        try:
+            query = self._table.rows_query(self._table.monotonic > self._high)
+            rows = session.execute(query).all()
+
+            with self._lock:
+                for row in rows:
+                    self._record_ids.append(row.record_id)
+                    self._rows.append(row)
+                if rows:
+                    self._high = rows[-1].record_id
+                    self._changed.notify_all()
+                self._trim()
+            self._last_poll = time.monotonic()
+        finally:
+            self._poll_lock.release()
+
+        if rows:
+            log.debug(
+                "Change feed read %d rows up to %d", len(rows), self._high
+            )
+
+    def wait(
+        self,
+        session_factory: Callable[[], Session],
+        after: int,
+        timeout: float,
+    ) -> bool:
+        """
+        Ожидает появления записей с record_id больше указанного.
+        Ожидающие потоки не обращаются к базе данных сами по себе: опрос
+        выполняет только один из них и не чаще одного раза за poll_interval.
+
+        Args:
+            session_factory (Callable[[], Session]): Фабрика сессий SQLAlchemy.
+            after (int): Курсор потребителя (последний полученный record_id).
+            timeout (float): Максимальное время ожидания в секундах.
+
+        Returns:
+            bool: True, если новые записи появились, иначе False.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with session_factory() as session:
+                self.refresh(session)
+            with self._changed:
+                if self.high > after:
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(min(remaining, self.wait_interval))
+
+    def read(
+        self, session: Session, after: int, limit: Optional[int] = None
+    ) -> List[sa.Row]:
+        """
+        Возвращает записи с record_id больше указанного, упорядоченные по record_id.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            after (int): Курсор потребителя (последний полученный record_id).
+            limit (Optional[int]): Максимальное количество записей, None - без ограничения. (default: None)
+
+        Returns:
+            List[sa.Row]: Новые записи после курсора (колонки TrackedTable.row_columns).
+        """
+        self.refresh(session)
+
+        with self._lock:
+            if after >= self._low:
+                idx = bisect.bisect_right(self._record_ids, after)
+                stop = None if limit is None else idx + limit
+                return self._rows[idx:stop]
+            high = self._high
+
+        log.debug(
+            "Cursor %d is behind change feed buffer, reading from DB", after
+        )
+        query = self._table.rows_query(
+            self._table.monotonic > after, self._table.monotonic <= high
+        ).limit(limit)
+        return list(session.execute(query).all())
+
+    def _trim(self) -> None:
+        """Удаляет из буфера самые старые записи сверх capacity."""
+        excess = len(self._rows) - self._capacity
+        if excess > 0:
+            self._low = self._record_ids[excess - 1]
+            del self._record_ids[:excess]
+            del self._rows[:excess]
@@ -1,23 +1,224 @@
+import asyncio
+from contextlib import asynccontextmanager
+import datetime as dt
 import json
+import logging as log
+from typing import (
+    Any,
+    AsyncIterator,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
+from urllib.parse import urlencode
 from typing_extensions import Annotated
 from fastapi import FastAPI, Form, HTTPException, Request, status
-from fastapi.responses import FileResponse, HTMLResponse, JSONResponse
+from fastapi.responses import (
+    FileResponse,
+    HTMLResponse,
+    JSONResponse,
+    Response,
+    StreamingResponse,
+)
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 import uvicorn
 import sqlalchemy as sa
 
-from model.base import Alchemy
-from model.model import ApiKey, ApiKeyEncoder, Entity
-from monitor import ChangeMonitor
+from cache import LRUCache, MonitorRegistry
+import changelog
+from checkpoint import CheckpointIndex
+from feed import ChangeFeed
+import compression
+import metrics
+from model.base import AsyncAlchemy
+from model.model import ApiKey, ApiKeyEncoder, Entity, Patch
+from monitor import AsyncChangeMonitor, change_capture_cursor, to_patches
+from monitor_state import create_state_backend
+import serialization
+from snapshot import SnapshotMaterializer
+from tracking import ENTITY_TABLE
 
 DEFAULT_FILENAME = "connection_params.json"
+MAX_WAIT = 30.0  # максимальное время ожидания обновлений при long polling
+SSE_KEEPALIVE = 15.0
+MAX_UPDATE_LIMIT = 100000  # максимальный размер страницы обновлений
+SSE_PAGE_SIZE = 10000
+API_KEY_CACHE_SIZE = 4096
+API_KEY_CACHE_TTL = 60.0
+SNAPSHOT_REFRESH_INTERVAL = 60.0
+MONITOR_IDLE_TIMEOUT = 900.0  # больше MAX_WAIT и SSE_KEEPALIVE
+MONITOR_MEMORY_BUDGET = 1 << 30  # суммарный размер кэшей мониторов в байтах
+MONITOR_SWEEP_INTERVAL = 30.0
+CURSOR_SWEEP_CHUNK = 500  # ключей в одном запросе проверки курсоров
+OBJECTS_PAGE_SIZE = 100
+MAX_OBJECTS_PAGE_SIZE = 1000
+FRAGMENT_CACHE_SIZE = 256
+FRAGMENT_CACHE_TTL = 300.0
+CHECKPOINT_MAINTAIN_INTERVAL = 60.0
+PAYLOAD_CACHE_SIZE = 1024
+PAYLOAD_CACHE_BYTES = 256 << 20
+PAYLOAD_CACHE_TTL = 300.0
+CHANGE_LOG_PRUNE_INTERVAL = 60.0
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    await db.create_all()
+    tasks = [
+        asyncio.create_task(_refresh_latest_state()),
+        asyncio.create_task(_maintain_checkpoints()),
+        asyncio.create_task(_evict_monitors()),
+    ]
+    if change_capture:
+        await db.install_change_capture()
+        tasks.append(asyncio.create_task(_prune_change_log()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await db.dispose()
+
+
+async def _refresh_latest_state() -> None:
+    """
+    Периодически доводит материализованное состояние до текущего, чтобы
+    новым потребителям оставалось догнать только недавние изменения.
+    """
+    while True:
+        try:
+            async with db.get_session() as session:
+                await session.run_sync(materializer.refresh)
+        except Exception:
+            log.exception("Failed to refresh latest state")
+        await asyncio.sleep(SNAPSHOT_REFRESH_INTERVAL)
+
+
+async def _maintain_checkpoints() -> None:
+    """
+    Периодически создает контрольные точки истории изменений для запросов
+    /api/v1/state_at и /api/v1/patches_between и удаляет устаревшие.
+    """
+    while True:
+        try:
+            async with db.get_session() as session:
+                await session.run_sync(checkpoints.maintain)
+        except Exception:
+            log.exception("Failed to maintain checkpoints")
+        await asyncio.sleep(CHECKPOINT_MAINTAIN_INTERVAL)
+
+
+async def _evict_monitors() -> None:
+    """
+    Периодически вытесняет мониторы неактивных потребителей, потребителей
+    с истекшими ключами и, при превышении бюджета памяти, самые давно
+    использованные. Неактивные и вытесненные по памяти мониторы удаляются
+    только из памяти процесса: потребитель мог перейти к другому рабочему
+    процессу, а при следующем обращении сюда монитор восстановится
+    из общего хранилища. Из общего хранилища удаляется только состояние
+    мониторов истекших и отозванных ключей, после чего их потребителям
+    нужно заново получить начальное состояние.
+    """
+    while True:
+        await asyncio.sleep(MONITOR_SWEEP_INTERVAL)
+        try:
+            for key, reason in monitors.sweep():
+                if reason == "expired":
+                    await state_backend.delete(key)
+            await _delete_stale_cursors()
+        except Exception:
+            log.exception("Failed to evict monitors")
+
+
+async def _delete_stale_cursors() -> None:
+    """
+    Удаляет из общего хранилища состояние мониторов, ключи которых истекли
+    или отозваны, в том числе не загруженных ни в один рабочий процесс.
+    """
+    keys = await state_backend.api_keys()
+    now = dt.datetime.now()
+    while keys:
+        chunk, keys = keys[:CURSOR_SWEEP_CHUNK], keys[CURSOR_SWEEP_CHUNK:]
+        async with db.get_session() as session:
+            valid = set(
+                await session.scalars(
+                    sa.select(ApiKey.key).where(
+                        ApiKey.key.in_(chunk), ApiKey.valid_until > now
+                    )
+                )
+            )
+        for key in chunk:
+            if key not in valid:
+                await state_backend.delete(key)
+                log.info("Deleted cursor of stale API key %s...", key[:4])
+
+
+async def _prune_change_log() -> None:
+    """
+    Периодически удаляет события change_log, которые прошли все курсоры:
+    сохраненные в общем хранилище и мониторов этого процесса. Потребители,
+    получающие начальное состояние в любом рабочем процессе, учитываются
+    по предварительным курсорам в общем хранилище (см. _reserve_cursor).
+    Пока курсоров нет, события не удаляются.
+    """
+    while True:
+        await asyncio.sleep(CHANGE_LOG_PRUNE_INTERVAL)
+        try:
+            cursors = [
+                cursor
+                for cursor in (
+                    await state_backend.min_cursor(),
+                    change_capture_cursor(),
+                )
+                if cursor is not None
+            ]
+            if cursors:
+                async with db.get_session() as session:
+                    await session.run_sync(changelog.prune, min(cursors))
+        except Exception:
+            log.exception("Failed to prune change log")
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(metrics.RequestMetricsMiddleware)
 app.mount("/static", StaticFiles(directory="static"), name="static")
 templates = Jinja2Templates(directory="templates")
-db = Alchemy(filename=DEFAULT_FILENAME)
-monitors = {}
+db = AsyncAlchemy(filename=DEFAULT_FILENAME)
+monitors = MonitorRegistry(
+    idle_timeout=MONITOR_IDLE_TIMEOUT, memory_budget=MONITOR_MEMORY_BUDGET
+)
+state_backend = create_state_backend(DEFAULT_FILENAME, db)
+change_capture = changelog.enabled(DEFAULT_FILENAME)
+materializer = SnapshotMaterializer()
+checkpoints = CheckpointIndex()
+api_keys_cache = LRUCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
+# закодированные и сжатые ответы по диапазону курсоров (None, курсор) для
+# начального состояния и (курсор, курсор) для обновлений, формату и сжатию
+payloads = LRUCache(
+    maxsize=PAYLOAD_CACHE_SIZE,
+    ttl=PAYLOAD_CACHE_TTL,
+    max_bytes=PAYLOAD_CACHE_BYTES,
+    sizeof=lambda item: len(item[0]),
+)
+# отрисованные таблицы страниц /objects; ключ включает максимальный record_id,
+# поэтому новые записи истории делают старые фрагменты недостижимыми
+fragments_cache = LRUCache(maxsize=FRAGMENT_CACHE_SIZE, ttl=FRAGMENT_CACHE_TTL)
+# задачи удаления предварительных курсоров прерванных загрузок
+_releases: Set[asyncio.Task] = set()
+
+
+def _pool_connections() -> Dict[Tuple[str], float]:
+    """Размер пула соединений и количество соединений по состояниям."""
+    return {
+        (state,): value
+        for state, value in db.pool_status().items()
+        if state != "pool"
+    }
+
+
+metrics.DB_POOL_CONNECTIONS.set_function(_pool_connections)
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -32,40 +233,160 @@ async def favicon():
 
 @app.get("/objects", response_class=HTMLResponse)
 @app.get("/objects/all", response_class=HTMLResponse)
-def get_all_objects(request: Request):
-    with db.get_session() as session:
-        query = sa.select(Entity)
-        result = session.scalars(query)
-        entities = result.all()
+async def get_all_objects(
+    request: Request,
+    after: int = 0,
+    limit: int = OBJECTS_PAGE_SIZE,
+    latest: bool = False,
+):
+    limit = _page_size(limit)
+    async with db.get_session() as session:
+        watermark = await session.scalar(
+            sa.select(sa.func.max(Entity.record_id))
+        )
+        key = ("objects", after, limit, latest, watermark)
+        table = fragments_cache.get(key)
+        if table is None:
+            if latest:
+                query = _latest_page_query(after, limit)
+            else:
+                query = (
+                    sa.select(Entity)
+                    .filter(Entity.record_id > after)
+                    .order_by(Entity.record_id)
+                    .limit(limit + 1)
+                )
+            entities = list((await session.scalars(query)).all())
+            next_after = _next_cursor(
+                entities, limit, "entity_id" if latest else "record_id"
+            )
+            table = templates.get_template("objects_table.html").render(
+                entities=entities,
+                next_page=_page_url(
+                    "/objects", next_after, limit, latest=latest
+                ),
+            )
+            fragments_cache.put(key, table)
 
     return templates.TemplateResponse(
-        "objects.html", {"request": request, "entities": entities}
+        "objects.html", {"request": request, "table": table, "latest": latest}
     )
 
 
 @app.get("/objects/{entity_id}", response_class=HTMLResponse)
-def get_object(request: Request, entity_id: int):
+async def get_object(
+    request: Request,
+    entity_id: int,
+    after: int = 0,
+    limit: int = OBJECTS_PAGE_SIZE,
+):
     if entity_id <= 0:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid entity id"
         )
-    with db.get_session() as session:
-        query = sa.select(Entity).filter(Entity.entity_id == entity_id)
-        result = session.scalars(query)
-        entities = result.all()
-
-    if len(entities) == 0:
-        return templates.TemplateResponse(
-            "object.html",
-            {"request": request, "entity_id": entity_id, "entities": entities},
+    limit = _page_size(limit)
+    async with db.get_session() as session:
+        watermark = await session.scalar(
+            sa.select(sa.func.max(Entity.record_id)).filter(
+                Entity.entity_id == entity_id
+            )
         )
+        key = ("object", entity_id, after, limit, watermark)
+        table = fragments_cache.get(key)
+        if table is None:
+            query = (
+                sa.select(Entity)
+                .filter(
+                    Entity.entity_id == entity_id, Entity.record_id > after
+                )
+                .order_by(Entity.record_id)
+                .limit(limit + 1)
+            )
+            entities = list((await session.scalars(query)).all())
+            table = ""
+            if entities or after:
+                next_after = _next_cursor(entities, limit, "record_id")
+                table = templates.get_template("object_table.html").render(
+                    entities=entities,
+                    next_page=_page_url(
+                        f"/objects/{entity_id}", next_after, limit
+                    ),
+                )
+            fragments_cache.put(key, table)
 
     return templates.TemplateResponse(
         "object.html",
-        {"request": request, "entity_id": entity_id, "entities": entities},
+        {"request": request, "entity_id": entity_id, "table": table},
+    )
+
+
+def _page_size(limit: int) -> int:
+    """
+    Проверяет размер страницы и ограничивает его MAX_OBJECTS_PAGE_SIZE.
+
+    Raises:
+        HTTPException: Если размер страницы не положителен.
+    """
+    if limit <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid limit"
+        )
+    return min(limit, MAX_OBJECTS_PAGE_SIZE)
+
+
+def _latest_page_query(after: int, limit: int) -> sa.Select:
+    """
+    Формирует запрос страницы последних записей объектов с entity_id больше
+    after. Ограничение применяется к группировке, поэтому по индексу
+    (id, record_id) читаются только объекты страницы, а не вся таблица.
+    Запрос возвращает на одну запись больше limit, чтобы определить,
+    есть ли следующая страница.
+    """
+    page = (
+        sa.select(
+            Entity.entity_id,
+            sa.func.max(Entity.record_id).label("max_record_id"),
+        )
+        .filter(Entity.entity_id > after)
+        .group_by(Entity.entity_id)
+        .order_by(Entity.entity_id)
+        .limit(limit + 1)
+        .subquery("page")
+    )
+    return (
+        sa.select(Entity)
+        .join(page, Entity.record_id == page.c.max_record_id)
+        .order_by(Entity.entity_id)
     )
 
 
+def _next_cursor(
+    entities: List[Entity], limit: int, column: str
+) -> Optional[int]:
+    """
+    Отбрасывает лишнюю запись страницы и возвращает курсор следующей
+    страницы - значение column последней записи, или None, если страница
+    последняя.
+    """
+    if len(entities) <= limit:
+        return None
+    del entities[limit:]
+    return getattr(entities[-1], column)
+
+
+def _page_url(
+    path: str, after: Optional[int], limit: int, **params: Any
+) -> Optional[str]:
+    """Формирует ссылку на страницу с курсором after или None без курсора."""
+    if after is None:
+        return None
+    query = {"after": after, "limit": limit}
+    query.update(
+        (name, str(value).lower()) for name, value in params.items() if value
+    )
+    return f"{path}?{urlencode(query)}"
+
+
 @app.get("/api/v1/start", response_class=HTMLResponse)
 async def start(request: Request):
     return templates.TemplateResponse("api_start.html", {"request": request})
@@ -78,19 +399,20 @@ async def create_api_key(
 ):
     api_key = ApiKey(name=name, description=description)
 
-    with db.get_session() as session:
+    async with db.get_session() as session:
         session.add(api_key)
         json_response = json.dumps(api_key, cls=ApiKeyEncoder)
-        session.commit()
+        await session.commit()
 
+    api_keys_cache.invalidate(api_key.key)
     return json_response
 
 
 @app.get("/api/v1/keys", response_class=HTMLResponse)
 async def get_api_keys(request: Request):
-    with db.get_session() as session:
+    async with db.get_session() as session:
         query = sa.select(ApiKey)
-        result = session.scalars(query)
+        result = await session.scalars(query)
         api_keys = list(result.all())
 
     return templates.TemplateResponse(
@@ -98,43 +420,528 @@ async def get_api_keys(request: Request):
     )
 
 
-@app.get("/api/v1/get_initial_data", response_class=HTMLResponse)
-def get_initial_data(api_key: str):
-    with db.get_session() as session:
-        query = sa.select(ApiKey).filter(ApiKey.key == api_key)
-        api_key_obj = session.scalar(query)
+@app.post("/api/v1/revoke", response_class=JSONResponse)
+async def revoke_api_key(key: Annotated[str, Form()]):
+    async with db.get_session() as session:
+        query = sa.select(ApiKey).filter(ApiKey.key == key)
+        api_key_obj = await session.scalar(query)
+        if api_key_obj is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND, detail="Unknown API key"
+            )
+        api_key_obj.valid_until = dt.datetime.now()
+        await session.commit()
+
+    api_keys_cache.invalidate(key)
+    monitors.pop(key)
+    await state_backend.delete(key)
+    return json.dumps(api_key_obj, cls=ApiKeyEncoder)
+
+
+@app.get("/api/v1/cache_stats", response_class=JSONResponse)
+async def get_cache_stats():
+    return {
+        "api_keys": api_keys_cache.stats(),
+        "fragments": fragments_cache.stats(),
+        "payloads": payloads.stats(),
+        "monitors": monitors.stats(),
+        "db_pool": db.pool_status(),
+    }
+
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return Response(metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
+async def _get_api_key(api_key: str) -> ApiKey:
+    """
+    Возвращает действительный API ключ. Проверенные ключи кэшируются
+    не дольше API_KEY_CACHE_TTL секунд и не дольше срока их действия,
+    поэтому повторные запросы не обращаются к базе данных.
+
+    Raises:
+        HTTPException: Если ключ не существует или срок его действия истек.
+    """
+    api_key_obj = api_keys_cache.get(api_key)
     if api_key_obj is None:
+        async with db.get_session() as session:
+            query = sa.select(ApiKey).filter(ApiKey.key == api_key)
+            api_key_obj = await session.scalar(query)
+        if api_key_obj is None:
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Invalid API key",
+            )
+        ttl = (api_key_obj.valid_until - dt.datetime.now()).total_seconds()
+        api_keys_cache.put(api_key, api_key_obj, ttl=ttl)
+
+    if not api_key_obj.is_valid():
+        api_keys_cache.invalidate(api_key)
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="API key expired"
+        )
+    return api_key_obj
+
+
+def _negotiate(request: Request, offered: List[str]) -> Tuple[str, str]:
+    """Выбирает формат ответа и алгоритм его сжатия по заголовкам запроса."""
+    media_type = serialization.negotiate(
+        request.headers.get("accept"), offered
+    )
+    encoding = compression.negotiate(request.headers.get("accept-encoding"))
+    return media_type, encoding
+
+
+@app.get("/api/v1/state_at", response_class=HTMLResponse)
+async def get_state_at(request: Request, api_key: str, record_id: int):
+    if record_id < 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid record id"
+        )
+    media_type, encoding = _negotiate(request, serialization.SNAPSHOT_TYPES)
+    await _get_api_key(api_key)
+    # состояние на уже прочитанный record_id больше не меняется
+    etag = _etag(record_id)
+    final = record_id <= await _current_watermark()
+    if final and _not_modified(request, etag):
+        return _not_modified_response(etag)
+    key = (None, etag, media_type, encoding)
+    item = payloads.get(key) if final else None
+    if item is None:
+        async with db.get_session() as session:
+            store = await session.run_sync(checkpoints.state_at, record_id)
+        body = serialization.dump_state(
+            ENTITY_TABLE.name,
+            store.fields,
+            ((entity_id, values) for entity_id, _, values in store.items()),
+            media_type,
+        )
+        item = compression.compress_body(body, encoding)
+        if final:
+            payloads.put(key, item)
+    return _payload_response(item, media_type, etag if final else None)
+
+
+@app.get("/api/v1/patches_between", response_class=HTMLResponse)
+async def get_patches_between(
+    request: Request,
+    api_key: str,
+    start: int,
+    stop: int,
+    limit: Optional[int] = None,
+):
+    if start < 0 or stop < start:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key"
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid record id range",
         )
-    if api_key_obj.is_valid:
-        if api_key_obj.key in monitors:
+    if limit is not None and limit <= 0:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid limit"
+        )
+    # в диапазоне не больше stop - start записей истории
+    if limit is None and stop - start > MAX_UPDATE_LIMIT:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Record id range exceeds {MAX_UPDATE_LIMIT}, use limit",
+        )
+    media_type, encoding = _negotiate(request, serialization.UPDATE_TYPES)
+    await _get_api_key(api_key)
+    final = stop <= await _current_watermark()
+    has_more = False
+    if limit is not None and stop - start > min(limit, MAX_UPDATE_LIMIT):
+        async with db.get_session() as session:
+            stop, has_more = await session.run_sync(
+                checkpoints.page_stop,
+                start,
+                stop,
+                min(limit, MAX_UPDATE_LIMIT),
+            )
+    etag = _etag(stop)
+    if final and _not_modified(request, etag):
+        return _not_modified_response(etag)
+    # ключ совпадает с ключом обновлений монитора с курсором start
+    key = (_etag(start), etag, media_type, encoding, limit is not None)
+    item = payloads.get(key + (has_more,)) if final else None
+    if item is None:
+        async with db.get_session() as session:
+            changes = await session.run_sync(
+                checkpoints.changes_between, start, stop
+            )
+        if limit is None:
+            body = serialization.dump_patches(to_patches(changes), media_type)
+        else:
+            body = serialization.dump_update_page(
+                to_patches(changes), has_more, stop, media_type
+            )
+        item = compression.compress_body(body, encoding)
+        if final:
+            payloads.put(key + (has_more,), item)
+    return _payload_response(item, media_type, etag if final else None)
+
+
+def _etag(watermark: Union[int, Dict[str, int]]) -> str:
+    """
+    Формирует слабый ETag состояния по курсору (record_id или record_id по
+    именам таблиц): состояние на один и тот же курсор всегда одинаково.
+    """
+    if isinstance(watermark, dict):
+        value = ",".join(
+            f"{name}:{record_id}"
+            for name, record_id in sorted(watermark.items())
+        )
+    else:
+        value = str(watermark)
+    return f'W/"{value}"'
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """Совпадает ли ETag с одним из перечисленных в If-None-Match (слабое сравнение)."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = (tag.strip() for tag in header.split(","))
+    return etag[2:] in (
+        tag[2:] if tag.startswith("W/") else tag for tag in tags
+    )
+
+
+def _not_modified_response(etag: str) -> Response:
+    headers = compression.headers(compression.IDENTITY)
+    headers["ETag"] = etag
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+
+def _payload_response(
+    item: Tuple[bytes, str], media_type: str, etag: Optional[str] = None
+) -> Response:
+    """Формирует ответ из сжатого тела и примененного алгоритма сжатия."""
+    body, encoding = item
+    headers = compression.headers(encoding)
+    if etag is not None:
+        headers["ETag"] = etag
+    return Response(body, media_type=media_type, headers=headers)
+
+
+async def _current_watermark() -> int:
+    """
+    Возвращает максимальный record_id таблицы Entity по общему источнику
+    изменений, который обращается к базе данных не чаще своего интервала
+    опроса.
+    """
+    feed = ChangeFeed.shared(db, ENTITY_TABLE)
+    async with db.get_session() as session:
+        await session.run_sync(feed.refresh)
+    return feed.high
+
+
+@app.get("/api/v1/get_initial_data", response_class=HTMLResponse)
+async def get_initial_data(
+    request: Request, api_key: str, stream: bool = False
+):
+    media_type, encoding = _negotiate(request, serialization.SNAPSHOT_TYPES)
+    api_key_obj = await _get_api_key(api_key)
+    if api_key_obj.key in monitors:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="You have already got initial data",
+        )
+    monitor = AsyncChangeMonitor(
+        DEFAULT_FILENAME,
+        materialized=True,
+        name=str(api_key_obj.api_key_id),
+        change_capture=change_capture,
+    )
+    # потребитель, у которого уже есть состояние на текущий курсор, или
+    # готовое представление состояния на этот курсор избавляют от загрузки
+    # начального состояния: монитор продолжает работу с курсора
+    watermark = await _current_watermark()
+    etag = _etag(watermark)
+    if _not_modified(request, etag):
+        monitor.resume(watermark)
+        await _register_monitor(api_key_obj, monitor)
+        return _not_modified_response(etag)
+    cached = payloads.get((None, etag, media_type, encoding))
+    if cached is not None:
+        monitor.resume(watermark)
+        await _register_monitor(api_key_obj, monitor)
+        return _payload_response(cached, media_type, etag)
+
+    await _reserve_cursor(api_key_obj, watermark)
+    if stream:
+        return StreamingResponse(
+            compression.compress_stream(
+                _stream_initial_state(
+                    api_key_obj, monitor, media_type, watermark
+                ),
+                encoding,
+            ),
+            media_type=media_type,
+            headers=compression.headers(encoding),
+        )
+    try:
+        chunks = [
+            chunk
+            async for chunk in monitor.iter_initial_state(
+                media_type=media_type
+            )
+        ]
+    except BaseException:
+        _release_cursor(api_key_obj.key, watermark)
+        raise
+    await _register_monitor(api_key_obj, monitor)
+    if media_type == serialization.MSGPACK:
+        body: serialization.Payload = b"".join(chunks)
+    else:
+        body = "".join(chunks)
+    etag = _etag(monitor.watermark)
+    item = compression.compress_body(body, encoding)
+    payloads.put((None, etag, media_type, encoding), item)
+    return _payload_response(item, media_type, etag)
+
+
+async def _stream_initial_state(
+    api_key_obj: ApiKey,
+    monitor: AsyncChangeMonitor,
+    media_type: str,
+    reserved: int,
+) -> AsyncIterator[serialization.Payload]:
+    """
+    Отдает начальное состояние по частям и регистрирует монитор только после
+    успешной передачи, чтобы прерванную загрузку можно было повторить.
+    """
+    try:
+        async for chunk in monitor.iter_initial_state(media_type=media_type):
+            yield chunk
+    except BaseException:
+        _release_cursor(api_key_obj.key, reserved)
+        raise
+    await _register_monitor(api_key_obj, monitor)
+
+
+async def _reserve_cursor(api_key_obj: ApiKey, record_id: int) -> None:
+    """
+    В режиме захвата изменений сохраняет в общее хранилище
+    предварительный курсор потребителя перед загрузкой начального
+    состояния. Отметка начального состояния будет не меньше record_id,
+    поэтому, пока загрузка идет, ни один рабочий процесс не удалит
+    события change_log, которые понадобятся монитору после нее.
+    """
+    if change_capture:
+        await state_backend.save(api_key_obj.key, record_id, replace=True)
+
+
+def _release_cursor(key: str, record_id: int) -> None:
+    """
+    Удаляет предварительный курсор прерванной загрузки начального
+    состояния, чтобы он не задерживал очистку change_log. Удаление
+    выполняется отдельной задачей: загрузка могла быть прервана отменой,
+    в которой ожидание уже невозможно.
+    """
+
+    async def release() -> None:
+        try:
+            if (
+                monitors.peek(key) is None
+                and await state_backend.load_cursor(key) == record_id
+            ):
+                await state_backend.delete(key)
+        except Exception:
+            log.exception("Failed to release cursor of %s...", key[:4])
+
+    if change_capture:
+        task = asyncio.get_running_loop().create_task(release())
+        _releases.add(task)
+        task.add_done_callback(_releases.discard)
+
+
+async def _register_monitor(
+    api_key_obj: ApiKey, monitor: AsyncChangeMonitor
+) -> None:
+    """Регистрирует монитор, получивший начальное состояние, и его курсор."""
+    monitors.put(api_key_obj.key, monitor, api_key_obj.valid_until)
+    await state_backend.save(api_key_obj.key, monitor.cursor, replace=True)
+
+
+async def _get_monitor(api_key_obj: ApiKey) -> AsyncChangeMonitor:
+    """
+    Возвращает монитор потребителя. Монитор в памяти процесса используется
+    без обращения к общему хранилищу: если потребителя тем временем обслужил
+    другой рабочий процесс, это обнаружится при сохранении курсора
+    (см. _collect_patches). Монитора в памяти нет после перезапуска или
+    вытеснения, тогда он восстанавливается из хранилища без повторной
+    загрузки начального состояния.
+
+    Raises:
+        HTTPException: Если монитор потребителя был вытеснен или потребитель еще не получал начальное состояние.
+    """
+    key = api_key_obj.key
+    monitor = monitors.get(key)
+    if monitor is not None:
+        return monitor
+
+    record_id = await state_backend.load_cursor(key)
+    if record_id is None:
+        # курсор удаляется из общего хранилища для истекших ключей
+        reason = monitors.eviction_reason(key)
+        if reason is not None:
             raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="You have already got initial data",
+                status_code=status.HTTP_410_GONE,
+                detail=f"Monitor was evicted ({reason}), re-snapshot required",
             )
-        monitor = ChangeMonitor(DEFAULT_FILENAME)
-        monitors[api_key_obj.key] = monitor
-        return monitor.get_initial_state()
+        raise HTTPException(
+            status_code=status.HTTP_425_TOO_EARLY,
+            detail="You need to get initial data first",
+        )
+    monitor = AsyncChangeMonitor(
+        DEFAULT_FILENAME,
+        name=str(api_key_obj.api_key_id),
+        change_capture=change_capture,
+    )
+    monitor.resume(record_id, await state_backend.load_entries(key))
+    monitors.put(key, monitor, api_key_obj.valid_until)
+    return monitor
+
+
+async def _save_monitor(
+    key: str, monitor: AsyncChangeMonitor, expected: int
+) -> bool:
+    """
+    Сохраняет курсор и изменившиеся объекты монитора в общее хранилище,
+    если там все еще сохранен курсор expected, с которого монитор начинал
+    запрос. Состояние монитора, вытесненного во время запроса,
+    не сохраняется, чтобы не восстановить удаленный при вытеснении курсор.
+
+    Returns:
+        bool: False, если курсор в хранилище изменил другой рабочий процесс или он удален.
+    """
+    if monitors.peek(key) is not monitor:
+        return True
+    return await state_backend.save(
+        key, monitor.cursor, monitor.last_changes(), expected=expected
+    )
+
+
+async def _collect_patches(
+    api_key_obj: ApiKey,
+    monitor: AsyncChangeMonitor,
+    wait: float = 0,
+    max_records: Optional[int] = None,
+) -> Tuple[AsyncChangeMonitor, str, List[Patch]]:
+    """
+    Получает патчи монитора и сохраняет его курсор. Если курсор в общем
+    хранилище успел продвинуть другой рабочий процесс, монитор в памяти
+    устарел и его патчи не отдаются: монитор восстанавливается
+    из хранилища, и патчи формируются заново.
+
+    Returns:
+        Tuple[AsyncChangeMonitor, str, List[Patch]]: Монитор, ETag курсора, с которого сформированы патчи, и патчи.
+
+    Raises:
+        HTTPException: Если курсор потребителя удален из общего хранилища.
+    """
+    while True:
+        cursor = monitor.cursor
+        start = _etag(monitor.watermark)
+        patch_list = await monitor.get_patches(wait, max_records)
+        if await _save_monitor(api_key_obj.key, monitor, cursor):
+            return monitor, start, patch_list
+        log.info("Monitor %s is stale, resuming", monitor.name)
+        monitors.pop(api_key_obj.key)
+        monitor = await _get_monitor(api_key_obj)
+        wait = 0
 
 
 @app.get("/api/v1/get_updates", response_class=HTMLResponse)
-def get_updates(api_key: str):
-    with db.get_session() as session:
-        query = sa.select(ApiKey).filter(ApiKey.key == api_key)
-        api_key_obj = session.scalar(query)
-    if api_key_obj is None:
+async def get_updates(
+    request: Request,
+    api_key: str,
+    wait: float = 0,
+    limit: Optional[int] = None,
+):
+    if limit is not None and limit <= 0:
         raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid API key"
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid limit"
         )
-    if api_key_obj.is_valid:
-        if api_key_obj.key not in monitors:
-            raise HTTPException(
-                status_code=status.HTTP_425_TOO_EARLY,
-                detail="You need to get initial data first",
+    media_type, encoding = _negotiate(request, serialization.UPDATE_TYPES)
+    api_key_obj = await _get_api_key(api_key)
+    monitor = await _get_monitor(api_key_obj)
+    wait = min(max(wait, 0), MAX_WAIT)
+    start = _etag(monitor.watermark)
+    if _not_modified(request, start) and not (
+        await monitor.wait_for_updates(wait)
+    ):
+        return _not_modified_response(start)
+
+    max_records = None if limit is None else min(limit, MAX_UPDATE_LIMIT)
+    monitor, start, patch_list = await _collect_patches(
+        api_key_obj, monitor, wait, max_records
+    )
+    etag = _etag(monitor.watermark)
+    # потребители с одинаковым курсором получают одинаковые обновления
+    key = (start, etag, media_type, encoding, max_records is not None)
+    item = payloads.get(key + (monitor.has_more,))
+    if item is None:
+        if max_records is None:
+            body = serialization.dump_patches(patch_list, media_type)
+        else:
+            body = serialization.dump_update_page(
+                patch_list, monitor.has_more, monitor.watermark, media_type
             )
-        monitor = monitors[api_key_obj.key]
-        return monitor.get_update()
+        item = compression.compress_body(body, encoding)
+        payloads.put(key + (monitor.has_more,), item)
+    return _payload_response(item, media_type, etag)
+
+
+@app.get("/api/v1/stream_updates")
+async def stream_updates(api_key: str):
+    api_key_obj = await _get_api_key(api_key)
+    monitor = await _get_monitor(api_key_obj)
+    return StreamingResponse(
+        _stream_updates(api_key_obj, monitor),
+        media_type="text/event-stream",
+    )
+
+
+async def _stream_updates(
+    api_key_obj: ApiKey, monitor: AsyncChangeMonitor
+) -> AsyncIterator[str]:
+    """
+    Отдает пачки патчей в формате Server-Sent Events по мере их появления.
+    Каждая пачка строится не более чем по SSE_PAGE_SIZE записям истории,
+    поэтому отставший потребитель догоняет изменения частями. Если
+    обновлений нет дольше SSE_KEEPALIVE секунд, отправляет комментарий,
+    чтобы соединение не закрывалось промежуточными прокси. Если монитор
+    вытеснен, отправляет событие evicted и завершает поток: после
+    вытеснения по неактивности или памяти поток можно открыть заново
+    с того же курсора, после истечения ключа нужно заново получить
+    начальное состояние.
+    """
+    key = api_key_obj.key
+    while monitors.get(key) is monitor:
+        try:
+            monitor, _, patch_list = await _collect_patches(
+                api_key_obj, monitor, SSE_KEEPALIVE, SSE_PAGE_SIZE
+            )
+        except HTTPException:
+            break  # курсор удален из общего хранилища
+        if patch_list:
+            yield "data: %s\n\n" % serialization.dump_patches(patch_list)
+        else:
+            yield ": keepalive\n\n"
+
+    reason = monitors.eviction_reason(key)
+    if reason is not None:
+        # курсор удаляется из общего хранилища только для истекших ключей
+        detail = (
+            "re-snapshot required"
+            if reason == "expired"
+            else "reconnect to resume"
+        )
+        yield "event: evicted\ndata: %s\n\n" % serialization.dumps(
+            {"reason": reason, "detail": detail}
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,487 @@
+"""
+Метрики процесса в текстовом формате Prometheus (версия 0.0.4).
+Счетчики, значения и гистограммы регистрируются в общем реестре при
+создании и отдаются веб-сервисом на /metrics. Значения, которые дешевле
+вычислить при чтении, чем поддерживать (отставание мониторов, размер
+кэшей), задаются функцией, вызываемой при формировании ответа.
+
+Метрики хранятся в памяти процесса: при запуске с несколькими рабочими
+процессами каждый из них отдает собственные значения.
+"""
+from contextlib import contextmanager
+import math
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import sqlalchemy as sa
+
+CONTENT_TYPE: str = "text/plain; version=0.0.4"
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+COUNT_BUCKETS: Tuple[float, ...] = (0, 1, 10, 100, 1000, 10000, 100000)
+
+LabelValues = Tuple[str, ...]
+Sample = Tuple[str, Dict[str, str], float]
+GaugeCallback = Callable[[], Union[float, Dict[LabelValues, float]]]
+
+
+class Registry:
+    """
+    Реестр метрик, формирующий ответ в текстовом формате Prometheus.
+    """
+
+    def __init__(self) -> None:
+        self._metrics: Dict[str, "Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "Metric") -> None:
+        """
+        Добавляет метрику в реестр.
+
+        Raises:
+            ValueError: Если метрика с таким именем уже зарегистрирована.
+        """
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        """
+        Формирует текущие значения всех метрик.
+
+        Returns:
+            str: Метрики в текстовом формате Prometheus.
+        """
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.type_name}")
+            for suffix, labels, value in metric.samples():
+                lines.append(
+                    f"{metric.name}{suffix}{_format_labels(labels)}"
+                    f" {_format_value(value)}"
+                )
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class Metric:
+    """
+    Базовый класс метрики с необязательными метками. Значения для каждого
+    набора значений меток хранятся отдельно и создаются при первом
+    обращении через labels.
+
+    Args:
+        name (str): Имя метрики.
+        documentation (str): Описание метрики.
+        labelnames (Sequence[str]): Имена меток.
+        registry (Optional[Registry]): Реестр, по умолчанию REGISTRY.
+    """
+
+    type_name: str = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        registry: Optional[Registry] = None,
+    ) -> None:
+        self.name = name
+        self.help = documentation
+        self.labelnames: Tuple[str, ...] = tuple(labelnames)
+        self._children: Dict[LabelValues, Any] = {}
+        self._lock = threading.Lock()
+        (registry or REGISTRY).register(self)
+
+    def labels(self, *values: Any) -> Any:
+        """
+        Возвращает значение метрики для набора значений меток.
+
+        Args:
+            *values (Any): Значения меток в порядке labelnames.
+
+        Raises:
+            ValueError: Если количество значений не совпадает с количеством меток.
+        """
+        if len(values) != len(self.labelnames):
+            raise ValueError(
+                f"Metric {self.name} expects labels {self.labelnames}"
+            )
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def samples(self) -> Iterator[Sample]:
+        """
+        Перебирает значения метрики.
+
+        Yields:
+            Sample: Суффикс имени, метки и значение.
+        """
+        with self._lock:
+            children = list(self._children.items())
+        for values, child in children:
+            labels = dict(zip(self.labelnames, values))
+            for suffix, extra, value in child.samples():
+                yield suffix, {**labels, **extra}, value
+
+    def _new_child(self) -> Any:
+        raise NotImplementedError
+
+
+class _Value:
+    """Значение счетчика или текущего значения для одного набора меток."""
+
+    def __init__(self) -> None:
+        self._value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        with self._lock:
+            self._value -= amount
+
+    def set(self, value: float) -> None:
+        self._value = float(value)
+
+    def samples(self) -> Iterator[Sample]:
+        yield "", {}, self._value
+
+
+class Counter(Metric):
+    """Монотонно возрастающий счетчик."""
+
+    type_name = "counter"
+
+    def inc(self, amount: float = 1) -> None:
+        """Увеличивает счетчик метрики без меток."""
+        self.labels().inc(amount)
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+class Gauge(Metric):
+    """
+    Текущее значение. Если задана функция callback, значения вычисляются
+    ею при формировании ответа: функция возвращает число для метрики без
+    меток или словарь значений по наборам значений меток.
+
+    Args:
+        name (str): Имя метрики.
+        documentation (str): Описание метрики.
+        labelnames (Sequence[str]): Имена меток.
+        callback (Optional[GaugeCallback]): Функция, вычисляющая значения.
+        registry (Optional[Registry]): Реестр, по умолчанию REGISTRY.
+    """
+
+    type_name = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[GaugeCallback] = None,
+        registry: Optional[Registry] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self._callback = callback
+
+    def set(self, value: float) -> None:
+        """Задает значение метрики без меток."""
+        self.labels().set(value)
+
+    def set_function(self, callback: Optional[GaugeCallback]) -> None:
+        """
+        Задает функцию, вычисляющую значения при формировании ответа.
+
+        Args:
+            callback (Optional[GaugeCallback]): Функция или None, чтобы вернуться к заданным значениям.
+        """
+        self._callback = callback
+
+    def samples(self) -> Iterator[Sample]:
+        if self._callback is None:
+            yield from super().samples()
+            return
+        values = self._callback()
+        if not isinstance(values, dict):
+            values = {(): values}
+        for label_values, value in values.items():
+            yield "", dict(zip(self.labelnames, label_values)), value
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+
+class _Buckets:
+    """Распределение наблюдений гистограммы для одного набора меток."""
+
+    def __init__(self, bounds: Tuple[float, ...]) -> None:
+        self._bounds = bounds
+        self._counts = [0] * (len(bounds) + 1)
+        self._sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = len(self._bounds)
+        for i, bound in enumerate(self._bounds):
+            if value <= bound:
+                index = i
+                break
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+
+    @contextmanager
+    def time(self) -> Iterator[None]:
+        """Измеряет время выполнения блока в секундах."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started)
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            counts = list(self._counts)
+            total = self._sum
+        cumulative = 0
+        for bound, count in zip(self._bounds + (math.inf,), counts):
+            cumulative += count
+            yield "_bucket", {"le": _format_value(bound)}, cumulative
+        yield "_sum", {}, total
+        yield "_count", {}, cumulative
+
+
+class Histogram(Metric):
+    """
+    Гистограмма наблюдений с фиксированными границами корзин.
+
+    Args:
+        name (str): Имя метрики.
+        documentation (str): Описание метрики.
+        labelnames (Sequence[str]): Имена меток.
+        buckets (Sequence[float]): Верхние границы корзин по возрастанию.
+        registry (Optional[Registry]): Реестр, по умолчанию REGISTRY.
+    """
+
+    type_name = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = LATENCY_BUCKETS,
+        registry: Optional[Registry] = None,
+    ) -> None:
+        super().__init__(name, documentation, labelnames, registry)
+        self._bounds = tuple(sorted(buckets))
+
+    def observe(self, value: float) -> None:
+        """Добавляет наблюдение метрики без меток."""
+        self.labels().observe(value)
+
+    def time(self) -> Any:
+        """Измеряет время выполнения блока для метрики без меток."""
+        return self.labels().time()
+
+    def _new_child(self) -> _Buckets:
+        return _Buckets(self._bounds)
+
+
+def _escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("\n", "\\n")
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    items = ",".join(
+        '%s="%s"' % (name, _escape(value).replace('"', '\\"'))
+        for name, value in labels.items()
+    )
+    return "{%s}" % items
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def render() -> str:
+    """
+    Формирует текущие значения метрик общего реестра.
+
+    Returns:
+        str: Метрики в текстовом формате Prometheus.
+    """
+    return REGISTRY.render()
+
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to produce the response headers, by route",
+    ["method", "route", "status"],
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds",
+    "Database statement execution time, by statement type",
+    ["statement"],
+)
+SERIALIZATION_SECONDS = Histogram(
+    "serialization_duration_seconds",
+    "JSON serialization time, by payload kind",
+    ["kind"],
+)
+UPDATE_ROWS = Histogram(
+    "change_monitor_update_rows",
+    "History rows read by one update request",
+    buckets=COUNT_BUCKETS,
+)
+UPDATE_PATCHES = Histogram(
+    "change_monitor_update_patches",
+    "Patches emitted by one update request",
+    buckets=COUNT_BUCKETS,
+)
+# значения задаются функциями модуля monitor
+MONITOR_LAG = Gauge(
+    "change_monitor_lag_records",
+    "Newest record id known to the change feed minus the monitor cursor",
+    ["monitor", "table"],
+)
+MONITOR_EVICTIONS = Counter(
+    "change_monitor_evictions_total",
+    "Monitors evicted from the web service registry, by reason",
+    ["reason"],
+)
+MONITOR_CACHE_BYTES = Gauge(
+    "change_monitor_cache_bytes",
+    "Approximate memory used by the state caches of all monitors",
+)
+# значения задаются веб-сервисом по Alchemy.pool_status
+DB_POOL_CONNECTIONS = Gauge(
+    "db_pool_connections",
+    "Database connection pool size and connections by state",
+    ["state"],
+)
+
+
+class RequestMetricsMiddleware:
+    """
+    ASGI-middleware, измеряющее время до отправки заголовков ответа
+    по шаблонам маршрутов (например, /objects/{entity_id}), чтобы
+    количество меток не зависело от параметров запросов. Для потоковых
+    ответов учитывается время до начала передачи.
+
+    Args:
+        app (Callable): ASGI-приложение.
+    """
+
+    def __init__(self, app: Callable) -> None:
+        self.app = app
+
+    async def __call__(
+        self, scope: Dict[str, Any], receive: Callable, send: Callable
+    ) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        observed = False
+
+        def observe(status: int) -> None:
+            nonlocal observed
+            observed = True
+            # маршрут записывается в scope при разборе запроса
+            route = scope.get("route")
+            HTTP_REQUEST_SECONDS.labels(
+                scope["method"],
+                getattr(route, "path", "unmatched"),
+                status,
+            ).observe(time.perf_counter() - started)
+
+        async def send_wrapper(message: Dict[str, Any]) -> None:
+            if message["type"] == "http.response.start" and not observed:
+                observe(message["status"])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if not observed:
+                observe(500)
+
+
+def instrument_engine(engine: sa.Engine) -> None:
+    """
+    Подключает измерение времени выполнения запросов к движку SQLAlchemy
+    (для AsyncEngine передается его sync_engine).
+
+    Args:
+        engine (sa.Engine): Движок базы данных.
+    """
+    sa.event.listen(engine, "before_cursor_execute", _before_execute)
+    sa.event.listen(engine, "after_cursor_execute", _after_execute)
+    sa.event.listen(engine, "handle_error", _on_error)
+
+
+def _before_execute(conn, cursor, statement, parameters, context, many):
+    conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+
+def _after_execute(conn, cursor, statement, parameters, context, many):
+    started = conn.info["query_started"].pop()
+    kind = statement.lstrip().split(None, 1)[0].lower() if statement else ""
+    DB_QUERY_SECONDS.labels(kind).observe(time.perf_counter() - started)
+
+
+def _on_error(context) -> None:
+    if context.connection is None:
+        return
+    started = context.connection.info.get("query_started")
+    if started:
+        started.pop()
@@ -1,15 +1,37 @@
 import json
-from typing import Optional
+import logging as log
+from typing import Any, Dict, List, Optional, Tuple
+import sqlalchemy as sa
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import (
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.orm.session import Session
 
-from model.model import Base
+from model.model import Base, ChangeLog, Entity
 from errors import ParameterError
+import metrics
+
+# параметры пула соединений, которые можно задать в разделе "pool"
+# файла с параметрами подключения
+POOL_OPTIONS = ("pool_size", "max_overflow", "pool_pre_ping", "pool_recycle")
+DEFAULT_POOL_OPTIONS: Dict[str, Any] = {
+    "pool_pre_ping": True,
+    "pool_recycle": 3600,
+}
+# параметры, которые поддерживает только пул с ограниченным размером
+_QUEUE_POOL_OPTIONS = ("pool_size", "max_overflow")
+# триггер, записывающий события изменений test_table в change_log
+CHANGE_CAPTURE_TRIGGER = "test_table_change_capture"
 
 
 class Alchemy:
     _instance: Optional["Alchemy"] = None
+    # поле файла с параметрами подключения, из которого берется драйвер
+    _DRIVER_FIELD: str = "driver"
 
     def __new__(cls, *args, **kwargs) -> "Alchemy":
         """
@@ -28,39 +50,80 @@ class Alchemy:
     ) -> None:
         """
         Инициализирует объект Alchemy для работы с базой данных.
+        Движок с пулом соединений создается один раз, повторные вызовы
+        (например, при создании очередного монитора) только проверяют,
+        что параметры подключения не изменились. Вызов без параметров
+        возвращает уже инициализированный объект.
 
         Args:
             dburl (Optional[str]): Строка подключения к базе данных SQLAlchemy.
             filename (Optional[str]): Имя файла, содержащего настройки подключения к базе данных.
 
         Raises:
-            ParameterError: Если не указаны ни dburl, ни filename.
+            ParameterError: Если не указаны ни dburl, ни filename или если они задают другое подключение, чем при первой инициализации.
         """
-        if dburl:
-            self._dburl = dburl
-        elif filename:
-            with open(filename, encoding="utf-8") as file:
-                data = json.load(file)
+        # экземпляр один на процесс: движок, пул соединений и таблицы
+        # создаются только при первой инициализации
+        if self.initialized:
+            self._check_settings(dburl, filename)
+            return
+        dburl, options = self._settings(dburl, filename)
 
-                self._check_required_fields(data)
+        self._engine = create_engine(dburl, **options)
+        metrics.instrument_engine(self._engine)
+        Base.metadata.create_all(self._engine)
+        self._session_factory = sessionmaker(bind=self._engine)
+        self.check_indexes()
 
-                dialect = data["dialect"]
-                driver = data["driver"]
-                username = data["username"]
-                password = data["password"]
-                host = data["host"]
-                port = data["port"]
-                database = data["database"]
+    @property
+    def initialized(self) -> bool:
+        """Создан ли уже движок базы данных."""
+        return getattr(self, "_engine", None) is not None
 
-                dburl = f"{dialect}+{driver}://{username}:{password}@{host}:{port}/{database}"  # noqa: E501
-        else:
-            raise ParameterError(
-                "No dburl or filename specified. Unable to initialize."
+    def pool_status(self) -> Dict[str, Any]:
+        """
+        Возвращает статистику пула соединений.
+
+        Returns:
+            Dict[str, Any]: Класс пула и, если пул ограниченного размера, его размер, количество свободных, выданных и сверхлимитных соединений.
+        """
+        pool = self._engine.pool
+        status: Dict[str, Any] = {"pool": type(pool).__name__}
+        if isinstance(pool, sa.QueuePool):
+            status.update(
+                size=pool.size(),
+                checked_in=pool.checkedin(),
+                checked_out=pool.checkedout(),
+                overflow=max(pool.overflow(), 0),
             )
+        return status
 
-        self._engine = create_engine(dburl)
-        Base.metadata.create_all(self._engine)
-        self._session_factory = sessionmaker(bind=self._engine)
+    def dispose(self) -> None:
+        """Закрывает все соединения пула."""
+        self._engine.dispose()
+
+    def check_indexes(self, create: bool = False) -> List[str]:
+        """
+        Проверяет наличие индексов, объявленных в моделях, в существующих
+        таблицах (create_all создает индексы только вместе с таблицами)
+        и сообщает об отсутствующих.
+
+        Args:
+            create (bool): Создать отсутствующие индексы. (default: False)
+
+        Returns:
+            List[str]: Имена отсутствующих индексов.
+        """
+        with self._engine.begin() as connection:
+            return check_indexes(connection, create)
+
+    def install_change_capture(self) -> None:
+        """
+        Создает триггер, записывающий события изменений отслеживаемых
+        сущностей в таблицу change_log (см. install_change_capture).
+        """
+        with self._engine.begin() as connection:
+            install_change_capture(connection)
 
     def get_session(self) -> Session:
         """
@@ -71,6 +134,132 @@ class Alchemy:
         """
         return self._session_factory()
 
+    def _settings(
+        self, dburl: Optional[str], filename: Optional[str]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Определяет строку подключения и параметры пула соединений
+        и запоминает их вместе с аргументами инициализации.
+
+        Args:
+            dburl (Optional[str]): Строка подключения к базе данных SQLAlchemy.
+            filename (Optional[str]): Имя файла, содержащего настройки подключения к базе данных.
+
+        Returns:
+            Tuple[str, Dict[str, Any]]: Строка подключения и именованные аргументы для создания движка.
+
+        Raises:
+            ParameterError: Если не указаны ни dburl, ни filename.
+        """
+        args = (dburl, filename)
+        if filename and not dburl:
+            dburl = self._read_dburl(filename, driver_field=self._DRIVER_FIELD)
+        elif not dburl:
+            raise ParameterError(
+                "No dburl or filename specified. Unable to initialize."
+            )
+        options = self._engine_options(dburl, filename)
+        self._init_args = args
+        self._dburl = sa.make_url(dburl)
+        self._pool_options = options
+        return dburl, options
+
+    def _check_settings(
+        self, dburl: Optional[str], filename: Optional[str]
+    ) -> None:
+        """
+        Проверяет, что аргументы повторной инициализации задают то же
+        подключение и те же параметры пула, что и при первой.
+
+        Args:
+            dburl (Optional[str]): Строка подключения к базе данных SQLAlchemy.
+            filename (Optional[str]): Имя файла, содержащего настройки подключения к базе данных.
+
+        Raises:
+            ParameterError: Если строка подключения или параметры пула отличаются.
+        """
+        # вызов без параметров только возвращает существующий объект
+        args = (dburl, filename)
+        if not any(args) or args == self._init_args:
+            return
+        if filename and not dburl:
+            dburl = self._read_dburl(filename, driver_field=self._DRIVER_FIELD)
+        if sa.make_url(dburl) != self._dburl:
+            raise ParameterError(
+                f"{type(self).__name__} is already initialized with"
+                f" another database: {self._dburl!r}"
+            )
+        options = self._engine_options(dburl, filename)
+        if options != self._pool_options:
+            raise ParameterError(
+                f"{type(self).__name__} is already initialized with"
+                f" other pool options: {self._pool_options}"
+            )
+
+    def _engine_options(
+        self, dburl: str, filename: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Формирует параметры пула соединений: значения по умолчанию,
+        дополненные разделом "pool" файла с параметрами подключения.
+        Параметры размера пула отбрасываются, если диалект использует
+        пул без ограничения размера (например, NullPool для SQLite).
+
+        Args:
+            dburl (str): Строка подключения к базе данных SQLAlchemy.
+            filename (Optional[str]): Имя файла, содержащего настройки подключения к базе данных. (default: None)
+
+        Returns:
+            Dict[str, Any]: Именованные аргументы для create_engine.
+
+        Raises:
+            ParameterError: Если в разделе "pool" указан неизвестный параметр.
+        """
+        options = dict(DEFAULT_POOL_OPTIONS)
+        if filename:
+            with open(filename, encoding="utf-8") as file:
+                config = json.load(file).get("pool", {})
+            unknown = [name for name in config if name not in POOL_OPTIONS]
+            if unknown:
+                raise ParameterError(
+                    f"Unknown pool options: {', '.join(unknown)}"
+                )
+            options.update(config)
+
+        url = sa.make_url(dburl)
+        pool_class = url.get_dialect().get_pool_class(url)
+        if not issubclass(pool_class, sa.QueuePool):
+            for name in _QUEUE_POOL_OPTIONS:
+                if options.pop(name, None) is not None:
+                    log.debug("Ignoring %s for %s", name, pool_class.__name__)
+        return options
+
+    def _read_dburl(self, filename: str, driver_field: str = "driver") -> str:
+        """
+        Формирует строку подключения к базе данных из файла с параметрами.
+
+        Args:
+            filename (str): Имя файла, содержащего настройки подключения к базе данных.
+            driver_field (str): Имя поля с драйвером базы данных. (default: "driver")
+
+        Returns:
+            str: Строка подключения к базе данных SQLAlchemy.
+        """
+        with open(filename, encoding="utf-8") as file:
+            data = json.load(file)
+
+            self._check_required_fields(data)
+
+            dialect = data["dialect"]
+            driver = data.get(driver_field) or data["driver"]
+            username = data["username"]
+            password = data["password"]
+            host = data["host"]
+            port = data["port"]
+            database = data["database"]
+
+            return f"{dialect}+{driver}://{username}:{password}@{host}:{port}/{database}"  # noqa: E501
+
     def _check_required_fields(self, fields: dict) -> None:
         """
         Проверяет наличие обязательных полей в данных конфигурации.
@@ -100,3 +289,212 @@ class Alchemy:
             raise ParameterError(
                 f"Missing fields in configuration file: {', '.join(missing_fields)}"  # noqa: E501
             )
+
+
+class AsyncAlchemy(Alchemy):
+    """
+    Асинхронный вариант Alchemy на основе AsyncEngine и AsyncSession.
+    Драйвер берется из поля "async_driver" файла с параметрами подключения.
+    """
+
+    _instance: Optional["AsyncAlchemy"] = None
+    _DRIVER_FIELD: str = "async_driver"
+
+    def __init__(
+        self, dburl: Optional[str] = None, filename: Optional[str] = None
+    ) -> None:
+        """
+        Инициализирует объект AsyncAlchemy для работы с базой данных.
+        Таблицы не создаются автоматически, для этого нужно вызвать create_all.
+        Как и у Alchemy, движок создается только при первом вызове,
+        а повторные вызовы проверяют параметры подключения.
+
+        Args:
+            dburl (Optional[str]): Строка подключения к базе данных SQLAlchemy с асинхронным драйвером.
+            filename (Optional[str]): Имя файла, содержащего настройки подключения к базе данных.
+
+        Raises:
+            ParameterError: Если не указаны ни dburl, ни filename или если они задают другое подключение, чем при первой инициализации.
+        """
+        if self.initialized:
+            self._check_settings(dburl, filename)
+            return
+        dburl, options = self._settings(dburl, filename)
+
+        self._engine = create_async_engine(dburl, **options)
+        metrics.instrument_engine(self._engine.sync_engine)
+        self._session_factory = async_sessionmaker(
+            bind=self._engine, expire_on_commit=False
+        )
+
+    async def create_all(self) -> None:
+        """
+        Создает отсутствующие таблицы в базе данных и сообщает
+        об отсутствующих индексах в существующих таблицах.
+        """
+        async with self._engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        await self.check_indexes()
+
+    async def check_indexes(self, create: bool = False) -> List[str]:
+        """
+        Проверяет наличие индексов, объявленных в моделях (см. Alchemy.check_indexes).
+
+        Args:
+            create (bool): Создать отсутствующие индексы. (default: False)
+
+        Returns:
+            List[str]: Имена отсутствующих индексов.
+        """
+        async with self._engine.begin() as conn:
+            return await conn.run_sync(check_indexes, create)
+
+    async def install_change_capture(self) -> None:
+        """
+        Создает триггер, записывающий события изменений отслеживаемых
+        сущностей в таблицу change_log (см. Alchemy.install_change_capture).
+        """
+        async with self._engine.begin() as conn:
+            await conn.run_sync(install_change_capture)
+
+    async def dispose(self) -> None:
+        """Закрывает все соединения пула."""
+        await self._engine.dispose()
+
+    def get_session(self) -> AsyncSession:
+        """
+        Возвращает новую асинхронную сессию SQLAlchemy.
+
+        Returns:
+            AsyncSession: Объект асинхронной сессии SQLAlchemy.
+        """
+        return self._session_factory()
+
+
+def check_indexes(
+    connection: sa.Connection, create: bool = False
+) -> List[str]:
+    """
+    Сравнивает индексы, объявленные в моделях, с индексами в базе данных.
+    Объявленный индекс считается присутствующим, если в таблице есть индекс
+    (или первичный ключ, или ограничение уникальности), начинающийся с тех же
+    колонок, а для уникального индекса - уникальный индекс по тем же колонкам.
+
+    Args:
+        connection (sa.Connection): Соединение с базой данных.
+        create (bool): Создать отсутствующие индексы. (default: False)
+
+    Returns:
+        List[str]: Имена отсутствующих индексов.
+    """
+    inspector = sa.inspect(connection)
+    missing: List[str] = []
+    for table in Base.metadata.sorted_tables:
+        if not table.indexes or not inspector.has_table(table.name):
+            continue
+
+        existing = [
+            (tuple(index["column_names"]), bool(index["unique"]))
+            for index in inspector.get_indexes(table.name)
+        ]
+        existing.extend(
+            (tuple(constraint["column_names"]), True)
+            for constraint in inspector.get_unique_constraints(table.name)
+        )
+        primary_key = inspector.get_pk_constraint(table.name)
+        if primary_key and primary_key["constrained_columns"]:
+            existing.append((tuple(primary_key["constrained_columns"]), True))
+
+        for index in table.indexes:
+            columns = tuple(column.name for column in index.columns)
+            if any(
+                names[: len(columns)] == columns
+                and (not index.unique or (unique and names == columns))
+                for names, unique in existing
+            ):
+                continue
+            missing.append(index.name)
+            if create:
+                index.create(connection)
+                log.info("Created index %s on %s", index.name, table.name)
+            else:
+                log.warning(
+                    "Missing index %s on %s(%s), queries will be slow",
+                    index.name,
+                    table.name,
+                    ", ".join(columns),
+                )
+    return missing
+
+
+def install_change_capture(connection: sa.Connection) -> None:
+    """
+    Создает, если его еще нет, триггер, который после вставки каждой записи
+    в test_table пишет в change_log событие: идентификаторы записи
+    и сущности, признак появления сущности, битовую маску изменившихся
+    атрибутов и новые значения только изменившихся атрибутов. Предыдущие
+    значения берутся из последней более ранней записи сущности, поэтому
+    записи, не изменившие ни одного атрибута, событий не порождают.
+    Поддерживаются SQLite и MySQL (8.0.29+ из-за CREATE TRIGGER IF NOT EXISTS).
+
+    Args:
+        connection (sa.Connection): Соединение с базой данных.
+
+    Raises:
+        ParameterError: Если диалект базы данных не поддерживается.
+    """
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        distinct = "{0} IS NOT {1}"
+    elif dialect in ("mysql", "mariadb"):
+        distinct = "NOT ({0} <=> {1})"
+    else:
+        raise ParameterError(
+            f"Change capture is not supported for dialect {dialect}"
+        )
+
+    quote = connection.dialect.identifier_preparer.quote
+
+    def column(model: type, attr: str) -> str:
+        return quote(model.__mapper__.columns[attr].name)
+
+    table = quote(Entity.__tablename__)
+    record_id = column(Entity, "record_id")
+    entity_id = column(Entity, "entity_id")
+    fields = [column(Entity, attr) for attr in Entity.relevant_atributes]
+    # условия изменения атрибутов; для новой сущности p.* равны NULL
+    changed = [
+        distinct.format(f"p.{field}", f"NEW.{field}") for field in fields
+    ]
+    log_columns = [
+        column(ChangeLog, attr)
+        for attr in ("record_id", "entity_id", "created", "changed")
+    ] + [column(ChangeLog, attr) for attr in Entity.relevant_atributes]
+
+    statement = (
+        f"INSERT INTO {quote(ChangeLog.__tablename__)}"
+        f" ({', '.join(log_columns)})"
+        f" SELECT NEW.{record_id}, NEW.{entity_id}, p.{record_id} IS NULL, "
+        + " + ".join(
+            f"({condition}) * {1 << i}" for i, condition in enumerate(changed)
+        )
+        + "".join(
+            f", CASE WHEN {condition} THEN NEW.{field} END"
+            for field, condition in zip(fields, changed)
+        )
+        + f" FROM (SELECT 1 AS one) AS d LEFT JOIN"
+        f" (SELECT {record_id}, {', '.join(fields)} FROM {table}"
+        f" WHERE {entity_id} = NEW.{entity_id}"
+        f" AND {record_id} < NEW.{record_id}"
+        f" ORDER BY {record_id} DESC LIMIT 1) AS p ON 1 = 1"
+        f" WHERE p.{record_id} IS NULL OR " + " OR ".join(changed)
+    )
+    if dialect == "sqlite":
+        statement = f"BEGIN {statement}; END"
+    connection.execute(
+        sa.text(
+            f"CREATE TRIGGER IF NOT EXISTS {CHANGE_CAPTURE_TRIGGER}"
+            f" AFTER INSERT ON {table} FOR EACH ROW {statement}"
+        )
+    )
+    log.info("Installed change capture trigger on %s", Entity.__tablename__)
@@ -16,6 +16,11 @@ class Entity(Base):
     """Модель отслеживаемой сущности"""
 
     __tablename__: str = "test_table"
+    # последняя запись объекта ищется по (id, record_id): группировка
+    # по id с max(record_id) и выборка истории объекта до курсора
+    __table_args__ = (
+        sa.Index("ix_test_table_id_record_id", "id", "record_id"),
+    )
     relevant_atributes: List[str] = [
         "foo",
         "bar",
@@ -49,6 +54,95 @@ class Entity(Base):
             self.record_id = record_id
 
 
+class LatestState(Base):
+    """
+    Материализованное последнее состояние отслеживаемых сущностей:
+    по одной строке на entity_id с последней записью из test_table.
+    Поддерживается SnapshotMaterializer. Набор атрибутов должен совпадать
+    с Entity.relevant_atributes.
+    """
+
+    __tablename__: str = "latest_state"
+
+    entity_id: so.Mapped[int] = so.mapped_column(
+        "id", sa.Integer, primary_key=True, autoincrement=False
+    )
+    record_id: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    foo: so.Mapped[str] = so.mapped_column(sa.String(255), nullable=False)
+    bar: so.Mapped[str] = so.mapped_column(sa.String(255), nullable=False)
+
+
+class SnapshotWatermark(Base):
+    """Максимальный record_id, учтенный в материализованном состоянии"""
+
+    __tablename__: str = "snapshot_watermarks"
+
+    name: so.Mapped[str] = so.mapped_column(sa.String(64), primary_key=True)
+    record_id: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    updated_at: so.Mapped[dt.datetime] = so.mapped_column(sa.DateTime)
+
+
+class Checkpoint(Base):
+    """
+    Контрольная точка истории: состояние всех отслеживаемых сущностей
+    на момент record_id (записи с record_id не больше него).
+    Поддерживается CheckpointIndex.
+    """
+
+    __tablename__: str = "checkpoints"
+
+    record_id: so.Mapped[int] = so.mapped_column(
+        sa.Integer, primary_key=True, autoincrement=False
+    )
+    entities: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    created_at: so.Mapped[dt.datetime] = so.mapped_column(sa.DateTime)
+
+
+class CheckpointEntry(Base):
+    """
+    Состояние сущности в контрольной точке: последняя запись сущности
+    из test_table не новее отметки контрольной точки. Набор атрибутов
+    должен совпадать с Entity.relevant_atributes.
+    """
+
+    __tablename__: str = "checkpoint_entries"
+
+    checkpoint_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey("checkpoints.record_id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    entity_id: so.Mapped[int] = so.mapped_column(
+        "id", sa.Integer, primary_key=True, autoincrement=False
+    )
+    record_id: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    foo: so.Mapped[str] = so.mapped_column(sa.String(255), nullable=False)
+    bar: so.Mapped[str] = so.mapped_column(sa.String(255), nullable=False)
+
+
+class ChangeLog(Base):
+    """
+    Событие изменения отслеживаемой сущности, записанное триггером
+    при вставке записи в test_table (см. install_change_capture). Хранит
+    битовую маску изменившихся атрибутов (бит i соответствует
+    relevant_atributes[i]) и новые значения только изменившихся атрибутов,
+    для новой сущности - все значения. Набор атрибутов должен совпадать
+    с Entity.relevant_atributes.
+    """
+
+    __tablename__: str = "change_log"
+
+    record_id: so.Mapped[int] = so.mapped_column(
+        sa.Integer, primary_key=True, autoincrement=False
+    )
+    entity_id: so.Mapped[int] = so.mapped_column(
+        "id", sa.Integer, nullable=False
+    )
+    created: so.Mapped[bool] = so.mapped_column(sa.Boolean, nullable=False)
+    changed: so.Mapped[int] = so.mapped_column(sa.Integer, nullable=False)
+    foo: so.Mapped[Optional[str]] = so.mapped_column(sa.String(255))
+    bar: so.Mapped[Optional[str]] = so.mapped_column(sa.String(255))
+
+
 class ApiKey(Base):
     __tablename__: str = "api_keys"
 
@@ -59,7 +153,9 @@ class ApiKey(Base):
     description: so.Mapped[str] = so.mapped_column(sa.String(500))
     created_at: so.Mapped[dt.datetime] = so.mapped_column(sa.DateTime)
     valid_until: so.Mapped[dt.datetime] = so.mapped_column(sa.DateTime)
-    key: so.Mapped[str] = so.mapped_column(sa.String(KEY_LENGTH * 2))
+    key: so.Mapped[str] = so.mapped_column(
+        sa.String(KEY_LENGTH * 2), index=True, unique=True
+    )
 
     def __init__(
         self,
@@ -108,6 +204,36 @@ class ApiKey(Base):
         return secrets.token_hex(KEY_LENGTH)
 
 
+class MonitorCursor(Base):
+    """Сохраненная позиция монитора потребителя с указанным API ключом"""
+
+    __tablename__: str = "monitor_cursors"
+
+    api_key: so.Mapped[str] = so.mapped_column(
+        sa.String(KEY_LENGTH * 2), primary_key=True
+    )
+    record_id: so.Mapped[int] = so.mapped_column(sa.Integer)
+    updated_at: so.Mapped[dt.datetime] = so.mapped_column(sa.DateTime)
+
+    def __init__(
+        self,
+        api_key: str,
+        record_id: int,
+        updated_at: Optional[dt.datetime] = None,
+    ) -> None:
+        """
+        Создает запись о позиции монитора.
+
+        Args:
+            api_key (str): API ключ потребителя.
+            record_id (int): Последний переданный потребителю record_id.
+            updated_at (dt.datetime, optional): Время сохранения. Если не указано, используется текущее время. (default: None)
+        """
+        self.api_key = api_key
+        self.record_id = record_id
+        self.updated_at = updated_at if updated_at else dt.datetime.now()
+
+
 class Patch:
     """Объект для возврата в формате JSON Patch"""
 
@@ -117,6 +243,8 @@ class Patch:
     # список допустимых в данной задаче
     _SUPPORTED_OPERATIONS: List[str] = ["add", "replace"]
 
+    __slots__ = ("operation", "path", "value")
+
     def __init__(
         self,
         operation: str = "replace",
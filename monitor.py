@@ -4,22 +4,791 @@ API для отслеживания изменений объектов. Для
 находятся параметры, необходимые для подключения к базе данных.
 При вызове метода получения обновлений ранее метода получения
 начального состояния правильная работа не гарантируется.
+Для использования внутри цикла событий asyncio предназначен AsyncChangeMonitor,
+у которого методы получения состояния и обновлений являются корутинами.
+
+По умолчанию отслеживается таблица Entity. Монитор может отслеживать
+несколько таблиц из реестра tracking.registry (параметр tables): тогда
+начальное состояние группируется по именам таблиц, а пути патчей начинаются
+с имени таблицы, например /test_table/1/foo.
 """
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from enum import Enum
-import json
 import logging as log
-from typing import Callable, Optional
+import threading
+import time
+import weakref
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
 
 import sqlalchemy as sa
-from errors import WrongStateError
+from sqlalchemy.orm.session import Session
+from errors import ParameterError, WrongStateError
+
+import changelog
+from feed import ChangeFeed
+from model.base import Alchemy, AsyncAlchemy
+from model.model import Patch
+import metrics
+from notify import Change, ChangeNotifier, ChangeSink
+import serialization
+from snapshot import SnapshotMaterializer
+from state import StateStore
+from tracking import ENTITY_TABLE, TrackedTable, registry
+
+DEFAULT_BATCH_SIZE: int = 1000
+BASELINE_CHUNK_SIZE: int = 500
+
+# мониторы процесса для метрик отставания и размера кэшей
+_monitors: "weakref.WeakSet[BaseChangeMonitor]" = weakref.WeakSet()
+
+
+class TableTracker:
+    """
+    Состояние монитора по одной отслеживаемой таблице: курсор, кэш состояния
+    объектов и отметки начального состояния и восстановления. Обращения
+    к базе данных выполняются через переданную синхронную сессию.
+
+    Args:
+        alch (Alchemy): Объект для работы с базой данных.
+        table (TrackedTable): Отслеживаемая таблица.
+        materializer (Optional[SnapshotMaterializer]): Источник материализованного начального состояния.
+        change_capture (bool): Читать ли изменения из событий change_log вместо истории изменений.
+    """
+
+    def __init__(
+        self,
+        alch: Alchemy,
+        table: TrackedTable,
+        materializer: Optional[SnapshotMaterializer] = None,
+        change_capture: bool = False,
+    ) -> None:
+        """
+        Создает состояние монитора по таблице.
+
+        Args:
+            alch (Alchemy): Объект для работы с базой данных.
+            table (TrackedTable): Отслеживаемая таблица.
+            materializer (Optional[SnapshotMaterializer]): Источник материализованного начального состояния. (default: None)
+            change_capture (bool): Читать ли изменения из событий change_log вместо истории изменений, только для ENTITY_TABLE. (default: False)
+
+        Raises:
+            ParameterError: Если захват изменений запрошен не для ENTITY_TABLE.
+        """
+        if change_capture and table is not ENTITY_TABLE:
+            raise ParameterError(
+                f"Change capture is not available for table {table.name}"
+            )
+        self.table = table
+        self.change_capture = change_capture
+        self.feed = ChangeFeed.shared(
+            alch, changelog.CHANGE_LOG if change_capture else table
+        )
+        self.cache = StateStore(table.fields)
+        self.max_record_id = 0
+        self.has_more = False
+        self.rows_read = 0  # записей истории прочитано при последнем опросе
+        self._materializer = materializer
+        self._snapshot_watermark: Optional[int] = None
+        self._baseline_record_id: Optional[int] = None
+        self._changed_ids: List[int] = []
+
+    def resume(
+        self,
+        record_id: int,
+        entries: Iterable[Tuple[int, int, Sequence[Any]]] = (),
+    ) -> None:
+        """
+        Продолжает отслеживание с сохраненного курсора (см. BaseChangeMonitor.resume).
+
+        Args:
+            record_id (int): Последний record_id, переданный потребителю.
+            entries (Iterable[Tuple[int, int, Sequence[Any]]]): Сохраненные entity_id, record_id и значения объектов на момент курсора. (default: ())
+        """
+        for entity_id, entry_record_id, values in entries:
+            self.cache.put(entity_id, entry_record_id, values)
+        self.max_record_id = record_id
+        self._baseline_record_id = record_id
+        log.info(
+            "Resumed tracking %s at record id %d", self.table.name, record_id
+        )
+
+    def last_changes(self) -> List[Tuple[int, int, Tuple[Any, ...]]]:
+        """
+        Возвращает текущие значения объектов, изменившихся при последнем
+        получении обновлений.
+
+        Returns:
+            List[Tuple[int, int, Tuple[Any, ...]]]: entity_id, record_id и значения объектов.
+        """
+        return [
+            (
+                entity_id,
+                self.cache.record_id(entity_id),
+                self.cache.get(entity_id),
+            )
+            for entity_id in self._changed_ids
+            if entity_id in self.cache
+        ]
+
+    def prepare_initial_state(
+        self, session: Session, batch_size: int
+    ) -> sa.Select:
+        """
+        Подготавливает получение начального состояния и формирует его запрос.
+        В материализованном режиме сначала доводит latest_state до текущего
+        состояния и запоминает ее отметку, с которой монитор продолжит работу.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            batch_size (int): Количество записей в одной пачке серверного курсора.
+
+        Returns:
+            sa.Select: Запрос начального состояния с колонками TrackedTable.row_columns.
+        """
+        self.feed.start(session)
+        if self._materializer is not None:
+            self._snapshot_watermark = self._materializer.refresh(session)
+            return self._materializer.query(batch_size)
+        return (
+            self.table.latest_rows_query()
+            .order_by(self.table.key)
+            .execution_options(yield_per=batch_size)
+        )
+
+    def load_partition(
+        self, partition: Iterable[sa.Row]
+    ) -> List[Tuple[int, Sequence[Any]]]:
+        """
+        Сохраняет пачку записей начального состояния в кэш.
+
+        Args:
+            partition (Iterable[sa.Row]): Пачка записей (колонки TrackedTable.row_columns).
+
+        Returns:
+            List[Tuple[int, Sequence[Any]]]: Идентификаторы объектов пачки и значения их атрибутов.
+        """
+        self.store(partition)
+        return [(row.entity_id, row[2:]) for row in partition]
+
+    def store(self, rows: Iterable[sa.Row]) -> None:
+        """
+        Сохраняет записи начального состояния в кэш.
+
+        Args:
+            rows (Iterable[sa.Row]): Записи (колонки TrackedTable.row_columns).
+        """
+        for row in rows:
+            if row.record_id > self.max_record_id:
+                self.max_record_id = row.record_id
+            self.cache.put(row.entity_id, row.record_id, row[2:])
+
+    @property
+    def partitionable(self) -> bool:
+        """
+        Можно ли читать начальное состояние параллельно по диапазонам
+        объектов. Материализованное состояние читается одним запросом:
+        его может одновременно обновлять другой монитор, поэтому диапазоны,
+        прочитанные в разных транзакциях, не были бы согласованы.
+        """
+        return self._materializer is None
+
+    def prepare_partitions(
+        self, session: Session, partitions: int
+    ) -> List[sa.Select]:
+        """
+        Подготавливает параллельное получение начального состояния: фиксирует
+        отметку (текущий максимальный record_id) и делит диапазон
+        идентификаторов объектов на partitions равных частей. Запросы частей
+        читают только записи не новее отметки, поэтому вместе дают
+        согласованное состояние на момент отметки, в каких бы транзакциях
+        они ни выполнялись. Записи после отметки будут получены первым
+        обновлением.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            partitions (int): Количество частей.
+
+        Returns:
+            List[sa.Select]: Запросы частей с колонками TrackedTable.row_columns, упорядоченные по диапазонам; пустой список для пустой таблицы.
+        """
+        self.feed.start(session)
+        key = self.table.key
+        watermark = session.scalar(self.table.max_record_id_query()) or 0
+        self._snapshot_watermark = watermark
+        low, high = session.execute(
+            sa.select(sa.func.min(key), sa.func.max(key)).filter(
+                self.table.monotonic <= watermark
+            )
+        ).one()
+        if low is None:
+            return []
+
+        bounds: List[Any] = []
+        if isinstance(low, int) and isinstance(high, int):
+            step = -(-(high - low + 1) // partitions)
+            bounds = list(range(low + step, high + 1, step))
+        # крайние диапазоны открыты, чтобы не зависеть от точности границ
+        ranges = zip([None] + bounds, bounds + [None])
+        return [
+            self.table.latest_rows_query(
+                self.table.monotonic <= watermark,
+                *([] if start is None else [key >= start]),
+                *([] if stop is None else [key < stop]),
+            ).order_by(key)
+            for start, stop in ranges
+        ]
+
+    def fetch_partition(
+        self,
+        session: Session,
+        query: sa.Select,
+        batch_size: int,
+        writer: serialization.StateWriter,
+    ) -> List[Tuple[List[sa.Row], serialization.Payload]]:
+        """
+        Читает часть начального состояния и кодирует ее пачками по batch_size.
+        Не меняет состояние монитора, поэтому части можно читать одновременно
+        в разных потоках, каждую в своей сессии. Записи сохраняются в кэш
+        позже, методом store.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            query (sa.Select): Запрос части (см. prepare_partitions).
+            batch_size (int): Количество записей в одной пачке.
+            writer (serialization.StateWriter): Кодировщик начального состояния.
+
+        Returns:
+            List[Tuple[List[sa.Row], serialization.Payload]]: Записи пачек и их представления (см. StateWriter.encode_chunk).
+        """
+        rows = session.execute(query).all()
+        return self.encode_partition(rows, batch_size, writer)
+
+    @staticmethod
+    def encode_partition(
+        rows: List[sa.Row], batch_size: int, writer: serialization.StateWriter
+    ) -> List[Tuple[List[sa.Row], serialization.Payload]]:
+        """
+        Кодирует прочитанную часть начального состояния пачками по batch_size.
+
+        Args:
+            rows (List[sa.Row]): Записи части (колонки TrackedTable.row_columns).
+            batch_size (int): Количество записей в одной пачке.
+            writer (serialization.StateWriter): Кодировщик начального состояния.
+
+        Returns:
+            List[Tuple[List[sa.Row], serialization.Payload]]: Записи пачек и их представления.
+        """
+        batches = []
+        for start in range(0, len(rows), batch_size):
+            stop = start + batch_size
+            batch = rows[start:stop]
+            items = [(row.entity_id, row[2:]) for row in batch]
+            batches.append((batch, writer.encode_chunk(items)))
+        return batches
+
+    def finish_initial_state(self, completed: bool) -> None:
+        """
+        Завершает получение начального состояния.
+
+        Args:
+            completed (bool): Было ли начальное состояние передано полностью.
+        """
+        if completed:
+            if self._snapshot_watermark is not None:
+                # записи после отметки будут получены первым обновлением
+                self.max_record_id = self._snapshot_watermark
+            log.info(
+                "Max record id of %s after initial state: %d",
+                self.table.name,
+                self.max_record_id,
+            )
+            log.debug("Number of entities: %d", len(self.cache))
+        else:
+            # передача прервана, начальное состояние можно запросить заново
+            self.cache.clear()
+            self.max_record_id = 0
+            self._snapshot_watermark = None
+
+    def collect_changes(
+        self, session: Session, max_records: Optional[int] = None
+    ) -> List[Change]:
+        """
+        Читает новые записи после курсора и формирует по ним изменения.
+        В режиме захвата изменений записи - это события change_log.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            max_records (Optional[int]): Максимальное количество читаемых записей, None - без ограничения. (default: None)
+
+        Returns:
+            List[Change]: Список изменений, возможно пустой.
+        """
+        self._changed_ids = []
+        rows = self.feed.read(session, self.max_record_id, max_records)
+        self.rows_read = len(rows)
+        if rows:
+            # записи упорядочены по record_id
+            self.max_record_id = max(self.max_record_id, rows[-1].record_id)
+        self.has_more = self.max_record_id < self.feed.high
+        if not rows:
+            return []
+
+        if self.change_capture:
+            changes = self._apply_events(rows)
+        else:
+            latest = self._coalesce(rows)
+            if self._baseline_record_id is not None:
+                self._load_baseline(session, latest)
+            changes = self._diff(latest)
+        self._changed_ids = [change.entity_id for change in changes]
+
+        log.info(
+            "Max record id of %s after patch: %d",
+            self.table.name,
+            self.max_record_id,
+        )
+        return changes
+
+    @staticmethod
+    def _coalesce(rows: Iterable[sa.Row]) -> Iterable[sa.Row]:
+        """
+        Оставляет только последнюю запись каждого объекта, чтобы не отправлять
+        промежуточные значения, которые потребитель тут же перезапишет.
+
+        Args:
+            rows (Iterable[sa.Row]): Записи, упорядоченные по record_id.
+
+        Returns:
+            Iterable[sa.Row]: Последние записи объектов в порядке их record_id.
+        """
+        latest: "dict[int, sa.Row]" = {}
+        for row in rows:
+            latest.pop(row.entity_id, None)
+            latest[row.entity_id] = row
+        return latest.values()
+
+    def _load_baseline(self, session: Session, rows: Iterable[sa.Row]) -> None:
+        """
+        Загружает в кэш состояние на момент курсора восстановления для объектов,
+        которых еще нет в кэше, чтобы сравнивать с ним новые записи.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            rows (Iterable[sa.Row]): Новые записи объектов.
+        """
+        missing = [
+            row.entity_id for row in rows if row.entity_id not in self.cache
+        ]
+        for start in range(0, len(missing), BASELINE_CHUNK_SIZE):
+            stop = start + BASELINE_CHUNK_SIZE
+            chunk = missing[start:stop]
+            query = self.table.latest_rows_query(
+                self.table.key.in_(chunk),
+                self.table.monotonic <= self._baseline_record_id,
+            )
+            for row in session.execute(query):
+                self.cache.put(row.entity_id, row.record_id, row[2:])
+
+    def _apply_events(self, rows: Iterable[sa.Row]) -> List[Change]:
+        """
+        Формирует изменения по событиям change_log и применяет их к кэшу.
+        Предыдущее состояние объектов не нужно, поэтому после восстановления
+        монитора история изменений не читается: изменения объектов, которых
+        нет в кэше, передаются как есть, а в кэш объекты не добавляются.
+
+        Args:
+            rows (Iterable[sa.Row]): События, упорядоченные по record_id.
+
+        Returns:
+            List[Change]: Список изменений, возможно пустой.
+        """
+        fields = self.cache.fields
+        changes = changelog.to_changes(rows, fields)
+        for change in changes:
+            old_values = self.cache.get(change.entity_id)
+            if old_values is None:
+                if not change.created:
+                    continue
+                old_values = (None,) * len(fields)
+            values = [
+                change.fields.get(field, old_value)
+                for field, old_value in zip(fields, old_values)
+            ]
+            self.cache.put(change.entity_id, change.record_id, values)
+        return changes
+
+    def _diff(self, rows: Iterable[sa.Row]) -> List[Change]:
+        """
+        Сравнивает последние записи объектов с кэшем и формирует изменения.
+        Объекты, значения которых не изменились (см. StateStore.unchanged),
+        только получают новый record_id.
+
+        Args:
+            rows (Iterable[sa.Row]): Не более одной записи на объект.
+
+        Returns:
+            List[Change]: Список изменений, возможно пустой.
+        """
+        name = self.table.name
+        fields = self.cache.fields
+        changes: List[Change] = []
+
+        for row in rows:
+            values = row[2:]
+            if row.entity_id not in self.cache:
+                self.cache.put(row.entity_id, row.record_id, values)
+                changes.append(
+                    Change(
+                        row.entity_id,
+                        row.record_id,
+                        dict(zip(fields, values)),
+                        created=True,
+                        table=name,
+                    )
+                )
+            elif self.cache.unchanged(row.entity_id, values):
+                self.cache.touch(row.entity_id, row.record_id)
+            else:
+                old_values = self.cache.get(row.entity_id)
+                self.cache.put(row.entity_id, row.record_id, values)
+                changed = {
+                    field: value
+                    for field, value, old_value in zip(
+                        fields, values, old_values
+                    )
+                    if StateStore.differs(value, old_value)
+                }
+                changes.append(
+                    Change(
+                        row.entity_id,
+                        row.record_id,
+                        changed,
+                        created=False,
+                        table=name,
+                    )
+                )
+
+        return changes
+
+
+class BaseChangeMonitor:
+    """
+    Общая часть синхронного и асинхронного мониторов: состояние по каждой
+    отслеживаемой таблице (TableTracker), формирование патчей и подписчики
+    на изменения. Обращения к базе данных выполняются через синхронную
+    сессию, которую передают наследники.
+    """
+
+    _trackers: List[TableTracker]
+
+    def __init__(
+        self,
+        alch: Alchemy,
+        materialized: bool = False,
+        notifier: Optional[ChangeNotifier] = None,
+        tables: Optional[Sequence[Union[TrackedTable, str]]] = None,
+        name: Optional[str] = None,
+        change_capture: bool = False,
+    ) -> None:
+        """
+        Инициализирует общее состояние монитора.
+
+        Args:
+            alch (Alchemy): Объект для работы с базой данных.
+            materialized (bool): Читать ли начальное состояние таблицы Entity из материализованной таблицы latest_state. (default: False)
+            notifier (Optional[ChangeNotifier]): Объект доставки изменений подписчикам. (default: None)
+            tables (Optional[Sequence[Union[TrackedTable, str]]]): Отслеживаемые таблицы или их имена в реестре, по умолчанию только Entity. (default: None)
+            name (Optional[str]): Имя монитора в метриках, по умолчанию его адрес в памяти. (default: None)
+            change_capture (bool): Читать ли изменения таблицы Entity из событий change_log, записанных триггером (см. changelog). (default: False)
+        """
+        self.name = name or "%x" % id(self)
+        self._alch = alch
+        self._notifier = notifier
+        self._trackers = [
+            TableTracker(
+                alch,
+                table,
+                (
+                    SnapshotMaterializer()
+                    if materialized and table is ENTITY_TABLE
+                    else None
+                ),
+                change_capture and table is ENTITY_TABLE,
+            )
+            for table in registry.resolve(tables)
+        ]
+        # при нескольких таблицах ответы группируются по именам таблиц
+        self._nested = len(self._trackers) > 1
+        self._state = States.INITIALIZED
+        self._rows_read = 0
+        _monitors.add(self)
+
+    @property
+    def cursor(self) -> int:
+        """Последний record_id основной (первой) таблицы, переданный потребителю."""
+        return self._trackers[0].max_record_id
+
+    @property
+    def cursors(self) -> Dict[str, int]:
+        """Последние переданные потребителю record_id по именам таблиц."""
+        return {
+            tracker.table.name: tracker.max_record_id
+            for tracker in self._trackers
+        }
+
+    @property
+    def watermark(self) -> Union[int, Dict[str, int]]:
+        """
+        Достигнутый курсор: record_id для одной таблицы или record_id
+        по именам таблиц для нескольких.
+        """
+        return self.cursors if self._nested else self.cursor
+
+    @property
+    def has_more(self) -> bool:
+        """
+        Остались ли после последнего получения обновлений записи,
+        не вошедшие в него из-за ограничения max_records.
+        """
+        return any(tracker.has_more for tracker in self._trackers)
+
+    @property
+    def pending(self) -> bool:
+        """
+        Есть ли после курсора записи, уже прочитанные общими источниками
+        изменений или не вошедшие в последнюю страницу обновлений.
+        Проверка выполняется без обращений к базе данных.
+        """
+        return any(
+            tracker.has_more or tracker.feed.high > tracker.max_record_id
+            for tracker in self._trackers
+        )
+
+    def _refresh_feeds(self, session: Session) -> None:
+        """Дочитывает новые записи в общие источники изменений (не чаще их интервала опроса)."""
+        for tracker in self._trackers:
+            tracker.feed.refresh(session)
+
+    def subscribe(
+        self, sink: Union[ChangeSink, Callable[[List[Change]], Any]]
+    ) -> ChangeSink:
+        """
+        Подписывает обработчик на изменения объектов. Изменения, полученные
+        при каждом запросе обновлений, доставляются подписчикам пачками
+        в отдельном потоке (см. ChangeNotifier). Если объект доставки не был
+        передан в конструктор, создается объект с настройками по умолчанию.
+
+        Args:
+            sink (Union[ChangeSink, Callable[[List[Change]], Any]]): Подписчик или функция-обработчик пачки изменений.
+
+        Returns:
+            ChangeSink: Добавленный подписчик.
+        """
+        if self._notifier is None:
+            self._notifier = ChangeNotifier()
+        return self._notifier.subscribe(sink)
+
+    def unsubscribe(self, sink: ChangeSink) -> None:
+        """
+        Отписывает обработчик от изменений объектов.
+
+        Args:
+            sink (ChangeSink): Подписчик, возвращенный методом subscribe.
+        """
+        if self._notifier is not None:
+            self._notifier.unsubscribe(sink)
+
+    def close(self) -> None:
+        """
+        Доставляет подписчикам оставшиеся изменения и останавливает поток
+        доставки.
+        """
+        if self._notifier is not None:
+            self._notifier.close()
+
+    def nbytes(self) -> int:
+        """
+        Оценивает объем памяти, занятый кэшами состояния монитора.
+
+        Returns:
+            int: Примерный размер кэшей в байтах.
+        """
+        return sum(tracker.cache.nbytes() for tracker in self._trackers)
+
+    def last_changes(self) -> List[Tuple[int, int, Tuple[Any, ...]]]:
+        """
+        Возвращает текущие значения объектов основной (первой) таблицы,
+        изменившихся при последнем получении обновлений, например для
+        сохранения во внешнее хранилище.
+
+        Returns:
+            List[Tuple[int, int, Tuple[Any, ...]]]: entity_id, record_id и значения объектов.
+        """
+        return self._trackers[0].last_changes()
+
+    def resume(
+        self,
+        record_id: Union[int, Dict[str, int]],
+        entries: Iterable[Tuple[int, int, Sequence[Any]]] = (),
+    ) -> None:
+        """
+        Продолжает отслеживание с сохраненного курсора без получения начального
+        состояния. Переданные значения объектов сразу помещаются в кэш, остальные
+        восстанавливаются лениво: при первом изменении объекта его предыдущее
+        состояние читается из базы данных на момент курсора.
+
+        Args:
+            record_id (Union[int, Dict[str, int]]): Последний record_id, переданный потребителю, или record_id по именам таблиц.
+            entries (Iterable[Tuple[int, int, Sequence[Any]]]): Сохраненные entity_id, record_id и значения объектов основной (первой) таблицы на момент курсора. (default: ())
+
+        Raises:
+            WrongStateError: Если начальное состояние уже было получено.
+            ParameterError: Если курсор указан не для всех отслеживаемых таблиц.
+        """
+        self._check_initialized()
+        if not isinstance(record_id, dict):
+            if self._nested:
+                raise ParameterError("Cursors must be given for every table")
+            record_id = {self._trackers[0].table.name: record_id}
+        missing = [
+            tracker.table.name
+            for tracker in self._trackers
+            if tracker.table.name not in record_id
+        ]
+        if missing:
+            raise ParameterError(f"No cursors for tables: {missing}")
+
+        for index, tracker in enumerate(self._trackers):
+            tracker.resume(
+                record_id[tracker.table.name], entries if index == 0 else ()
+            )
+        self._state = States.GOT_INITIAL_STATE
+
+    def _check_initialized(self) -> None:
+        """
+        Raises:
+            WrongStateError: Если начальное состояние уже было получено.
+        """
+        if self._state is not States.INITIALIZED:
+            raise WrongStateError(
+                "Can`t get initial state, because state is %s" % self._state
+            )
+
+    def _check_got_initial_state(self) -> None:
+        """
+        Raises:
+            WrongStateError: Если начальное состояние еще не было получено.
+        """
+        if self._state is not States.GOT_INITIAL_STATE:
+            raise WrongStateError(
+                "Can`t get update, because you didn`t call get_initial_state"
+            )
 
-from model.base import Alchemy
-from model.model import Entity, EntityEncoder, Patch, PatchEncoder
+    def _finish_initial_state(self, completed: bool) -> None:
+        """
+        Завершает получение начального состояния.
+
+        Args:
+            completed (bool): Было ли начальное состояние передано полностью.
+        """
+        for tracker in self._trackers:
+            tracker.finish_initial_state(completed)
+        if completed:
+            self._state = States.GOT_INITIAL_STATE
+
+    def _collect_changes(
+        self, session: Session, max_records: Optional[int] = None
+    ) -> List[Change]:
+        """
+        Читает новые записи всех отслеживаемых таблиц после их курсоров
+        и формирует по ним изменения.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+            max_records (Optional[int]): Максимальное количество читаемых записей каждой таблицы, None - без ограничения. (default: None)
+
+        Returns:
+            List[Change]: Список изменений, возможно пустой.
+        """
+        changes: List[Change] = []
+        for tracker in self._trackers:
+            changes.extend(tracker.collect_changes(session, max_records))
+            self._rows_read += tracker.rows_read
+        return changes
+
+    def _observe_update(self, patch_list: List[Patch]) -> None:
+        """
+        Записывает в метрики количество прочитанных записей истории
+        и сформированных патчей за последнее получение обновлений.
+        """
+        metrics.UPDATE_ROWS.observe(self._rows_read)
+        metrics.UPDATE_PATCHES.observe(len(patch_list))
+
+    @property
+    def _wait_interval(self) -> float:
+        """Интервал проверки общих буферов при ожидании обновлений."""
+        return min(tracker.feed.wait_interval for tracker in self._trackers)
+
+    @property
+    def _publishing(self) -> bool:
+        """Есть ли подписчики, которым нужно передавать изменения."""
+        return self._notifier is not None and self._notifier.has_subscribers
+
+    def _to_patches(self, changes: Iterable[Change]) -> List[Patch]:
+        """
+        Формирует JSON Patch по списку изменений.
+
+        Args:
+            changes (Iterable[Change]): Изменения объектов.
+
+        Returns:
+            List[Patch]: Список патчей, возможно пустой.
+        """
+        return to_patches(changes, self._nested)
+
+
+def to_patches(changes: Iterable[Change], nested: bool = False) -> List[Patch]:
+    """
+    Формирует JSON Patch по списку изменений: новые объекты добавляются
+    целиком, у остальных заменяются изменившиеся атрибуты.
 
-func: Callable
+    Args:
+        changes (Iterable[Change]): Изменения объектов.
+        nested (bool): Начинать ли пути с имени таблицы. (default: False)
 
+    Returns:
+        List[Patch]: Список патчей, возможно пустой.
+    """
+    patch_list: List[Patch] = []
+    for change in changes:
+        if nested:
+            path = f"/{change.table}/{change.entity_id}"
+        else:
+            path = f"/{change.entity_id}"
+        if change.created:
+            patch_list.append(
+                Patch(operation="add", path=path, value=change.fields)
+            )
+            continue
+        for field, value in change.fields.items():
+            patch_list.append(Patch(path=f"{path}/{field}", value=value))
+    return patch_list
 
-class ChangeMonitor:
+
+class ChangeMonitor(BaseChangeMonitor):
     """
     Класс ChangeMonitor предоставляет API для отслеживания изменений объектов.
 
@@ -32,16 +801,24 @@ class ChangeMonitor:
     Args:
         filename (Optional[str]): Имя файла, содержащего параметры для подключения к базе данных.
         dburl (Optional[str]): URL в формате SQLAlchemy для подключения к базе данных.
+        materialized (bool): Читать ли начальное состояние из материализованной таблицы latest_state.
+        notifier (Optional[ChangeNotifier]): Объект доставки изменений подписчикам.
+        tables (Optional[Sequence[Union[TrackedTable, str]]]): Отслеживаемые таблицы или их имена в реестре.
+        name (Optional[str]): Имя монитора в метриках.
+        change_capture (bool): Читать ли изменения из событий change_log, записанных триггером.
     """
 
-    _max_record_id = 0
-    _cache: "dict[int, Entity]" = {}
     _alch: Alchemy
 
     def __init__(
         self,
         filename: Optional[str] = None,
         dburl: Optional[str] = None,
+        materialized: bool = False,
+        notifier: Optional[ChangeNotifier] = None,
+        tables: Optional[Sequence[Union[TrackedTable, str]]] = None,
+        name: Optional[str] = None,
+        change_capture: bool = False,
     ):
         """
         Конструктор класса ChangeMonitor.
@@ -49,116 +826,527 @@ class ChangeMonitor:
         Args:
             filename (Optional[str]): Имя файла, содержащего параметры для подключения к базе данных.
             dburl (Optional[str]): URL в формате SQLAlchemy для подключения к базе данных.
+            materialized (bool): Читать ли начальное состояние из материализованной таблицы latest_state. (default: False)
+            notifier (Optional[ChangeNotifier]): Объект доставки изменений подписчикам. (default: None)
+            tables (Optional[Sequence[Union[TrackedTable, str]]]): Отслеживаемые таблицы или их имена в реестре, по умолчанию только Entity. (default: None)
+            name (Optional[str]): Имя монитора в метриках, по умолчанию его адрес в памяти. (default: None)
+            change_capture (bool): Читать ли изменения из событий change_log, записанных триггером (см. Alchemy.install_change_capture). (default: False)
 
         """
-        self._alch = Alchemy(dburl=dburl, filename=filename)
-        self._state = States.INITIALIZED
+        super().__init__(
+            Alchemy(dburl=dburl, filename=filename),
+            materialized=materialized,
+            notifier=notifier,
+            tables=tables,
+            name=name,
+            change_capture=change_capture,
+        )
+        self._lock = threading.Lock()
 
         log.info("Initialized change monitor")
 
-    def get_initial_state(self) -> str:
+    def get_initial_state(self, workers: int = 1) -> str:
         """
         Получает начальное состояние объектов.
 
+        Args:
+            workers (int): Количество потоков параллельной загрузки (см. iter_initial_state). (default: 1)
+
         Returns:
             str: JSON-представление начального состояния объектов.
 
         Raises:
             WrongStateError: Если метод вызывается не после инициализации объекта ChangeMonitor.
         """
-        if self._state is not States.INITIALIZED:
-            raise WrongStateError(
-                "Can`t get initial state, because state is %s" % self._state
-            )
+        return "".join(self.iter_initial_state(workers=workers))
+
+    def iter_initial_state(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        media_type: str = serialization.JSON,
+        workers: int = 1,
+    ) -> Iterator[serialization.Payload]:
+        """
+        Получает начальное состояние объектов в потоковом режиме.
+        Записи читаются из базы данных серверным курсором пачками по batch_size,
+        а представление отдается по частям, по одной на пачку,
+        поэтому объем памяти под ответ зависит от размера пачки, а не таблицы.
 
-        with self._alch.get_session() as session:
-            subq = (
-                sa.select(
-                    Entity.entity_id,
-                    sa.func.max(Entity.record_id).label("max_record_id"),
+        Если workers больше 1, состояние таблицы делится на workers диапазонов
+        объектов (см. TableTracker.prepare_partitions), которые читаются
+        и кодируются одновременно в пуле потоков, каждый в своем соединении.
+        Части отдаются в порядке диапазонов; объем памяти в этом режиме
+        зависит от размера диапазонов, а не пачки. Материализованное
+        состояние всегда читается одним запросом.
+
+        Args:
+            batch_size (int): Количество записей в одной пачке. (default: DEFAULT_BATCH_SIZE)
+            media_type (str): Формат представления: serialization.JSON, NDJSON или MSGPACK. (default: serialization.JSON)
+            workers (int): Количество потоков, читающих состояние одновременно; не должно превышать размер пула соединений. (default: 1)
+
+        Yields:
+            serialization.Payload: Очередная часть представления начального состояния объектов (bytes для MSGPACK).
+
+        Raises:
+            WrongStateError: Если метод вызывается не после инициализации объекта ChangeMonitor.
+        """
+        self._check_initialized()
+
+        completed = False
+        try:
+            writer = serialization.state_writer(media_type, self._nested)
+            with self._alch.get_session() as session:
+                yield writer.begin()
+                for tracker in self._trackers:
+                    if workers > 1 and tracker.partitionable:
+                        queries = tracker.prepare_partitions(session, workers)
+                        yield writer.begin_table(
+                            tracker.table.name, tracker.cache.fields
+                        )
+                        yield from self._load_partitions(
+                            tracker, queries, batch_size, writer
+                        )
+                        yield writer.end_table()
+                        continue
+                    query = tracker.prepare_initial_state(session, batch_size)
+                    result = session.execute(query)
+                    yield writer.begin_table(
+                        tracker.table.name, tracker.cache.fields
+                    )
+                    for partition in result.partitions():
+                        yield writer.chunk(tracker.load_partition(partition))
+                    yield writer.end_table()
+                yield writer.end()
+            completed = True
+        finally:
+            self._finish_initial_state(completed)
+
+    def _load_partitions(
+        self,
+        tracker: TableTracker,
+        queries: Sequence[sa.Select],
+        batch_size: int,
+        writer: serialization.StateWriter,
+    ) -> Iterator[serialization.Payload]:
+        """
+        Читает и кодирует части начального состояния таблицы в пуле потоков
+        и сохраняет их в кэш в порядке диапазонов.
+
+        Args:
+            tracker (TableTracker): Состояние монитора по таблице.
+            queries (Sequence[sa.Select]): Запросы частей (см. TableTracker.prepare_partitions).
+            batch_size (int): Количество записей в одной пачке.
+            writer (serialization.StateWriter): Кодировщик начального состояния.
+
+        Yields:
+            serialization.Payload: Очередная пачка представления.
+        """
+        if not queries:
+            return
+
+        def fetch(
+            query: sa.Select,
+        ) -> List[Tuple[List[sa.Row], serialization.Payload]]:
+            with self._alch.get_session() as session:
+                return tracker.fetch_partition(
+                    session, query, batch_size, writer
                 )
-                .group_by(Entity.entity_id)
-                .subquery("t2")
-            )
-            query = (
-                sa.select(Entity)
-                .join(
-                    subq,
-                    sa.and_(
-                        Entity.record_id == subq.c.max_record_id,
-                    ),
+
+        with ThreadPoolExecutor(
+            max_workers=len(queries), thread_name_prefix="snapshot"
+        ) as pool:
+            futures = [pool.submit(fetch, query) for query in queries]
+            try:
+                for future in futures:
+                    for rows, chunk in future.result():
+                        tracker.store(rows)
+                        yield writer.join_chunk(chunk)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    def get_update(
+        self,
+        wait: float = 0,
+        max_records: Optional[int] = None,
+        media_type: str = serialization.JSON,
+    ) -> serialization.Payload:
+        """
+        Получает обновления объектов. Если задан max_records, за один вызов
+        обрабатывается не больше max_records записей истории, а результат
+        возвращается страницей с признаком has_more и достигнутым курсором
+        watermark (record_id или, для нескольких таблиц, record_id по именам
+        таблиц); остальные записи возвращаются следующими вызовами.
+
+        Args:
+            wait (float): Сколько секунд ждать появления обновлений, если их пока нет. (default: 0)
+            max_records (Optional[int]): Максимальное количество записей истории на страницу. (default: None)
+            media_type (str): Формат представления: serialization.JSON или MSGPACK. (default: serialization.JSON)
+
+        Returns:
+            serialization.Payload: Представление списка обновлений объектов или, если задан max_records, объекта {"patches": [...], "has_more": bool, "watermark": int}.
+
+        Raises:
+            WrongStateError: Если метод вызывается до того, как был получен начальный состояние методом get_initial_state.
+        """
+        patch_list = self.get_patches(wait, max_records)
+        if max_records is None:
+            return serialization.dump_patches(patch_list, media_type)
+        return serialization.dump_update_page(
+            patch_list, self.has_more, self.watermark, media_type
+        )
+
+    def get_patches(
+        self, wait: float = 0, max_records: Optional[int] = None
+    ) -> List[Patch]:
+        """
+        Получает обновления объектов в виде списка патчей. Если обновлений нет,
+        ожидает их до wait секунд, не выполняя собственных запросов к базе данных.
+
+        Args:
+            wait (float): Сколько секунд ждать появления обновлений, если их пока нет. (default: 0)
+            max_records (Optional[int]): Максимальное количество записей истории за вызов. (default: None)
+
+        Returns:
+            List[Patch]: Список патчей, возможно пустой.
+
+        Raises:
+            WrongStateError: Если метод вызывается до того, как был получен начальный состояние методом get_initial_state.
+        """
+        patch_list = self._to_patches(self.get_changes(wait, max_records))
+        self._observe_update(patch_list)
+        return patch_list
+
+    def get_changes(
+        self, wait: float = 0, max_records: Optional[int] = None
+    ) -> List[Change]:
+        """
+        Получает обновления объектов в виде списка изменений без формирования
+        JSON Patch и передает их подписчикам. Если обновлений нет, ожидает их
+        до wait секунд, не выполняя собственных запросов к базе данных.
+
+        Args:
+            wait (float): Сколько секунд ждать появления обновлений, если их пока нет. (default: 0)
+            max_records (Optional[int]): Максимальное количество записей истории за вызов. (default: None)
+
+        Returns:
+            List[Change]: Список изменений, возможно пустой.
+
+        Raises:
+            WrongStateError: Если метод вызывается до того, как был получен начальный состояние методом get_initial_state.
+        """
+        self._check_got_initial_state()
+
+        self._rows_read = 0
+        deadline = time.monotonic() + wait
+        while True:
+            with self._lock, self._alch.get_session() as session:
+                changes = self._collect_changes(session, max_records)
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                break
+            if self.has_more:
+                continue  # страница без изменений, читаем следующую
+            if self._nested:
+                time.sleep(min(remaining, self._wait_interval))
+            else:
+                tracker = self._trackers[0]
+                tracker.feed.wait(
+                    self._alch.get_session, tracker.max_record_id, remaining
                 )
-                .order_by(Entity.entity_id)
-            )
 
-            result = session.scalars(query)
-            entites = result.all()
+        if changes and self._publishing:
+            self._notifier.publish(changes)
+        return changes
+
 
-        for entity in entites:
-            if entity.record_id > self._max_record_id:
-                self._max_record_id = entity.record_id
-            self._cache[entity.entity_id] = entity
+class AsyncChangeMonitor(BaseChangeMonitor):
+    """
+    Асинхронный вариант ChangeMonitor для использования внутри цикла событий asyncio.
+    Работает через AsyncAlchemy, поэтому обращения к базе данных не блокируют
+    цикл событий и один процесс может обслуживать много потребителей одновременно.
 
-        log.info("Max record id after initial state: %d", self._max_record_id)
-        log.debug("Number of entities: %d", len(entites))
+    Args:
+        filename (Optional[str]): Имя файла, содержащего параметры для подключения к базе данных.
+        dburl (Optional[str]): URL в формате SQLAlchemy с асинхронным драйвером.
+        materialized (bool): Читать ли начальное состояние из материализованной таблицы latest_state.
+        notifier (Optional[ChangeNotifier]): Объект доставки изменений подписчикам.
+        tables (Optional[Sequence[Union[TrackedTable, str]]]): Отслеживаемые таблицы или их имена в реестре.
+        name (Optional[str]): Имя монитора в метриках.
+        change_capture (bool): Читать ли изменения из событий change_log, записанных триггером.
+    """
+
+    _alch: AsyncAlchemy
+
+    def __init__(
+        self,
+        filename: Optional[str] = None,
+        dburl: Optional[str] = None,
+        materialized: bool = False,
+        notifier: Optional[ChangeNotifier] = None,
+        tables: Optional[Sequence[Union[TrackedTable, str]]] = None,
+        name: Optional[str] = None,
+        change_capture: bool = False,
+    ):
+        """
+        Конструктор класса AsyncChangeMonitor.
+
+        Args:
+            filename (Optional[str]): Имя файла, содержащего параметры для подключения к базе данных.
+            dburl (Optional[str]): URL в формате SQLAlchemy с асинхронным драйвером.
+            materialized (bool): Читать ли начальное состояние из материализованной таблицы latest_state. (default: False)
+            notifier (Optional[ChangeNotifier]): Объект доставки изменений подписчикам. (default: None)
+            tables (Optional[Sequence[Union[TrackedTable, str]]]): Отслеживаемые таблицы или их имена в реестре, по умолчанию только Entity. (default: None)
+            name (Optional[str]): Имя монитора в метриках, по умолчанию его адрес в памяти. (default: None)
+            change_capture (bool): Читать ли изменения из событий change_log, записанных триггером (см. AsyncAlchemy.install_change_capture). (default: False)
+        """
+        super().__init__(
+            AsyncAlchemy(dburl=dburl, filename=filename),
+            materialized=materialized,
+            notifier=notifier,
+            tables=tables,
+            name=name,
+            change_capture=change_capture,
+        )
+        self._lock = asyncio.Lock()
+
+        log.info("Initialized async change monitor")
+
+    async def get_initial_state(self, workers: int = 1) -> str:
+        """
+        Получает начальное состояние объектов.
+
+        Args:
+            workers (int): Количество одновременно читаемых частей (см. iter_initial_state). (default: 1)
+
+        Returns:
+            str: JSON-представление начального состояния объектов.
+
+        Raises:
+            WrongStateError: Если метод вызывается не после инициализации объекта AsyncChangeMonitor.
+        """
+        return "".join(
+            [chunk async for chunk in self.iter_initial_state(workers=workers)]
+        )
+
+    async def iter_initial_state(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        media_type: str = serialization.JSON,
+        workers: int = 1,
+    ) -> AsyncIterator[serialization.Payload]:
+        """
+        Получает начальное состояние объектов в потоковом режиме.
+        Если workers больше 1, диапазоны объектов читаются одновременно
+        в отдельных сессиях, а кодируются в пуле потоков цикла событий
+        (см. ChangeMonitor.iter_initial_state).
+
+        Args:
+            batch_size (int): Количество записей в одной пачке. (default: DEFAULT_BATCH_SIZE)
+            media_type (str): Формат представления: serialization.JSON, NDJSON или MSGPACK. (default: serialization.JSON)
+            workers (int): Количество одновременно читаемых частей; не должно превышать размер пула соединений. (default: 1)
+
+        Yields:
+            serialization.Payload: Очередная часть представления начального состояния объектов (bytes для MSGPACK).
+
+        Raises:
+            WrongStateError: Если метод вызывается не после инициализации объекта AsyncChangeMonitor.
+        """
+        self._check_initialized()
+
+        completed = False
         try:
-            return json.dumps(self._cache, cls=EntityEncoder)
+            writer = serialization.state_writer(media_type, self._nested)
+            async with self._alch.get_session() as session:
+                yield writer.begin()
+                for tracker in self._trackers:
+                    if workers > 1 and tracker.partitionable:
+                        queries = await session.run_sync(
+                            tracker.prepare_partitions, workers
+                        )
+                        yield writer.begin_table(
+                            tracker.table.name, tracker.cache.fields
+                        )
+                        async for chunk in self._load_partitions(
+                            tracker, queries, batch_size, writer
+                        ):
+                            yield chunk
+                        yield writer.end_table()
+                        continue
+                    query = await session.run_sync(
+                        tracker.prepare_initial_state, batch_size
+                    )
+                    result = await session.stream(query)
+                    yield writer.begin_table(
+                        tracker.table.name, tracker.cache.fields
+                    )
+                    async for partition in result.partitions():
+                        yield writer.chunk(tracker.load_partition(partition))
+                    yield writer.end_table()
+                yield writer.end()
+            completed = True
         finally:
-            self._state = States.GOT_INITIAL_STATE
+            self._finish_initial_state(completed)
+
+    async def _load_partitions(
+        self,
+        tracker: TableTracker,
+        queries: Sequence[sa.Select],
+        batch_size: int,
+        writer: serialization.StateWriter,
+    ) -> AsyncIterator[serialization.Payload]:
+        """
+        Читает части начального состояния таблицы одновременно и сохраняет
+        их в кэш в порядке диапазонов (см. ChangeMonitor._load_partitions).
+
+        Args:
+            tracker (TableTracker): Состояние монитора по таблице.
+            queries (Sequence[sa.Select]): Запросы частей (см. TableTracker.prepare_partitions).
+            batch_size (int): Количество записей в одной пачке.
+            writer (serialization.StateWriter): Кодировщик начального состояния.
+
+        Yields:
+            serialization.Payload: Очередная пачка представления.
+        """
+
+        async def fetch(
+            query: sa.Select,
+        ) -> List[Tuple[List[sa.Row], serialization.Payload]]:
+            async with self._alch.get_session() as session:
+                rows = (await session.execute(query)).all()
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                None, tracker.encode_partition, rows, batch_size, writer
+            )
+
+        tasks = [asyncio.ensure_future(fetch(query)) for query in queries]
+        try:
+            for task in tasks:
+                for rows, chunk in await task:
+                    tracker.store(rows)
+                    yield writer.join_chunk(chunk)
+        finally:
+            for task in tasks:
+                task.cancel()
 
-    def get_update(self) -> str:
+    async def get_update(
+        self,
+        wait: float = 0,
+        max_records: Optional[int] = None,
+        media_type: str = serialization.JSON,
+    ) -> serialization.Payload:
         """
-        Получает обновления объектов.
+        Получает обновления объектов, постранично, если задан max_records
+        (см. ChangeMonitor.get_update).
+
+        Args:
+            wait (float): Сколько секунд ждать появления обновлений, если их пока нет. (default: 0)
+            max_records (Optional[int]): Максимальное количество записей истории на страницу. (default: None)
+            media_type (str): Формат представления: serialization.JSON или MSGPACK. (default: serialization.JSON)
 
         Returns:
-            str: JSON-представление списка обновлений объектов.
+            serialization.Payload: Представление списка обновлений объектов или, если задан max_records, объекта {"patches": [...], "has_more": bool, "watermark": int}.
 
         Raises:
             WrongStateError: Если метод вызывается до того, как был получен начальный состояние методом get_initial_state.
         """
-        if self._state is not States.GOT_INITIAL_STATE:
-            raise WrongStateError(
-                "Can`t get update, because you didn`t call get_initial_state"
-            )
+        patch_list = await self.get_patches(wait, max_records)
+        if max_records is None:
+            return serialization.dump_patches(patch_list, media_type)
+        return serialization.dump_update_page(
+            patch_list, self.has_more, self.watermark, media_type
+        )
 
-        patch_list: "list[Patch]" = []
+    async def wait_for_updates(self, wait: float = 0) -> bool:
+        """
+        Ожидает до wait секунд появления записей после курсора, не читая
+        и не обрабатывая их. Новые записи проверяются в общих источниках
+        изменений, которые обращаются к базе данных не чаще своего интервала
+        опроса, поэтому проверка не зависит от количества потребителей.
 
-        with self._alch.get_session() as session:
-            query = (
-                sa.select(Entity)
-                .filter(Entity.record_id > self._max_record_id)
-                .order_by(Entity.record_id)
-            )
+        Args:
+            wait (float): Сколько секунд ждать появления записей. (default: 0)
+
+        Returns:
+            bool: True, если после курсора есть записи (см. pending), иначе False.
+
+        Raises:
+            WrongStateError: Если метод вызывается до того, как был получен начальный состояние методом get_initial_state.
+        """
+        self._check_got_initial_state()
 
-            result = session.scalars(query)
-            entities = result.all()
+        deadline = time.monotonic() + wait
+        while True:
+            async with self._alch.get_session() as session:
+                await session.run_sync(self._refresh_feeds)
+            remaining = deadline - time.monotonic()
+            if self.pending or remaining <= 0:
+                return self.pending
+            await asyncio.sleep(min(remaining, self._wait_interval))
 
-        for entity in entities:
-            if entity.record_id > self._max_record_id:
-                self._max_record_id = entity.record_id
+    async def get_patches(
+        self, wait: float = 0, max_records: Optional[int] = None
+    ) -> List[Patch]:
+        """
+        Получает обновления объектов в виде списка патчей. Если обновлений нет,
+        ожидает их до wait секунд. Ожидающие потребители проверяют общий буфер
+        и не выполняют собственных запросов к базе данных.
 
-            if entity.entity_id not in self._cache:
-                self._cache[entity.entity_id] = entity
-                patch_list.append(
-                    Patch(
-                        operation="add",
-                        path=f"/{entity.entity_id}",
-                        value=json.dumps(entity, cls=EntityEncoder),
+        Args:
+            wait (float): Сколько секунд ждать появления обновлений, если их пока нет. (default: 0)
+            max_records (Optional[int]): Максимальное количество записей истории за вызов. (default: None)
+
+        Returns:
+            List[Patch]: Список патчей, возможно пустой.
+
+        Raises:
+            WrongStateError: Если метод вызывается до того, как был получен начальный состояние методом get_initial_state.
+        """
+        patch_list = self._to_patches(
+            await self.get_changes(wait, max_records)
+        )
+        self._observe_update(patch_list)
+        return patch_list
+
+    async def get_changes(
+        self, wait: float = 0, max_records: Optional[int] = None
+    ) -> List[Change]:
+        """
+        Получает обновления объектов в виде списка изменений без формирования
+        JSON Patch и передает их подписчикам. Постановка в заполненную очередь
+        доставки ожидается в пуле потоков, не блокируя цикл событий.
+
+        Args:
+            wait (float): Сколько секунд ждать появления обновлений, если их пока нет. (default: 0)
+            max_records (Optional[int]): Максимальное количество записей истории за вызов. (default: None)
+
+        Returns:
+            List[Change]: Список изменений, возможно пустой.
+
+        Raises:
+            WrongStateError: Если метод вызывается до того, как был получен начальный состояние методом get_initial_state.
+        """
+        self._check_got_initial_state()
+
+        self._rows_read = 0
+        deadline = time.monotonic() + wait
+        while True:
+            async with self._lock:
+                async with self._alch.get_session() as session:
+                    changes = await session.run_sync(
+                        self._collect_changes, max_records
                     )
-                )
-            else:
-                entity_old = self._cache[entity.entity_id]
-                for field in Entity.relevant_atributes:
-                    if getattr(entity, field) != getattr(entity_old, field):
-                        patch_list.append(
-                            Patch(
-                                path=f"/{entity.entity_id}/{field}",
-                                value=getattr(entity, field),
-                            )
-                        )
+            remaining = deadline - time.monotonic()
+            if changes or remaining <= 0:
+                break
+            if self.has_more:
+                continue  # страница без изменений, читаем следующую
+            await asyncio.sleep(min(remaining, self._wait_interval))
 
-        log.info("Max record id after patch: %d", self._max_record_id)
-        return json.dumps(patch_list, cls=PatchEncoder)
+        if changes and self._publishing:
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(None, self._notifier.publish, changes)
+        return changes
 
 
 class States(Enum):
@@ -172,3 +1360,50 @@ class States(Enum):
 
     INITIALIZED = 0
     GOT_INITIAL_STATE = 1
+
+
+def change_capture_cursor() -> Optional[int]:
+    """
+    Возвращает минимальный курсор мониторов процесса, читающих события
+    change_log. Монитор, еще не получивший начальное состояние, считается
+    стоящим в начале журнала: его отметка станет известна только после
+    загрузки.
+
+    Returns:
+        Optional[int]: Минимальный курсор или None, если таких мониторов нет.
+    """
+    cursors = [
+        (
+            tracker.max_record_id
+            if monitor._state is States.GOT_INITIAL_STATE
+            else 0
+        )
+        for monitor in list(_monitors)
+        for tracker in monitor._trackers
+        if tracker.change_capture
+    ]
+    return min(cursors, default=None)
+
+
+def _monitor_lag() -> Dict[Tuple[str, str], float]:
+    """
+    Вычисляет отставание мониторов, получивших начальное состояние:
+    сколько record_id прочитано общим источником изменений сверх курсора.
+    """
+    return {
+        (monitor.name, tracker.table.name): max(
+            tracker.feed.high - tracker.max_record_id, 0
+        )
+        for monitor in list(_monitors)
+        if monitor._state is States.GOT_INITIAL_STATE
+        for tracker in monitor._trackers
+    }
+
+
+def _cache_bytes() -> float:
+    """Оценивает суммарный объем кэшей состояния всех мониторов."""
+    return sum(monitor.nbytes() for monitor in list(_monitors))
+
+
+metrics.MONITOR_LAG.set_function(_monitor_lag)
+metrics.MONITOR_CACHE_BYTES.set_function(_cache_bytes)
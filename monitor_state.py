@@ -0,0 +1,461 @@
+"""
+Хранилища состояния мониторов веб-сервиса: курсора (последнего переданного
+потребителю record_id) и кэша состояния объектов.
+
+Монитор в памяти процесса - только локальная копия. При запуске нескольких
+рабочих процессов (uvicorn/gunicorn --workers) курсор сохраняется только
+при условии, что в хранилище все еще лежит курсор, с которого начинался
+запрос. Если потребителя успел обслужить другой процесс, сохранение
+не выполняется, а монитор восстанавливается из хранилища. Объекты, значений
+которых нет в хранилище, восстанавливаются лениво из истории изменений
+на момент курсора (см. BaseChangeMonitor.resume).
+
+Доступные реализации:
+
+* MemoryStateBackend - в памяти процесса, подходит только для одного процесса;
+* DatabaseStateBackend - курсоры в таблице monitor_cursors основной базы данных;
+* SQLiteStateBackend - файл SQLite, общий для всех процессов на одном хосте;
+  кроме курсоров хранит значения объектов, изменившихся после получения
+  начального состояния, чтобы восстановление не обращалось за ними к базе.
+"""
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import datetime as dt
+import json
+import logging as log
+import sqlite3
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import sqlalchemy as sa
+
+from errors import ParameterError
+from model.base import AsyncAlchemy
+from model.model import MonitorCursor
+
+# объект в хранилище: entity_id, record_id и значения отслеживаемых атрибутов
+Entry = Tuple[int, int, Tuple[Any, ...]]
+
+DEFAULT_BACKEND: str = "database"
+DEFAULT_SQLITE_PATH: str = "monitor_state.db"
+SQLITE_TIMEOUT: float = 30.0
+
+
+class MonitorStateBackend(ABC):
+    """
+    Базовый класс хранилища состояния мониторов. Хранение значений
+    объектов (load_entries) необязательно.
+    """
+
+    @abstractmethod
+    async def load_cursor(self, api_key: str) -> Optional[int]:
+        """
+        Возвращает сохраненный курсор монитора.
+
+        Args:
+            api_key (str): API ключ потребителя.
+
+        Returns:
+            Optional[int]: Последний переданный потребителю record_id или None, если курсор не сохранялся.
+        """
+
+    @abstractmethod
+    async def min_cursor(self) -> Optional[int]:
+        """
+        Возвращает минимальный сохраненный курсор всех потребителей, например
+        чтобы удалить события change_log, которые уже никому не нужны.
+
+        Returns:
+            Optional[int]: Минимальный курсор или None, если курсоров нет.
+        """
+
+    @abstractmethod
+    async def api_keys(self) -> List[str]:
+        """
+        Возвращает API ключи потребителей с сохраненными курсорами, например
+        чтобы удалить состояние мониторов истекших и отозванных ключей.
+
+        Returns:
+            List[str]: API ключи.
+        """
+
+    async def load_entries(self, api_key: str) -> List[Entry]:
+        """
+        Возвращает сохраненные значения объектов на момент курсора.
+
+        Args:
+            api_key (str): API ключ потребителя.
+
+        Returns:
+            List[Entry]: Значения объектов, возможно неполные или пустые.
+        """
+        return []
+
+    @abstractmethod
+    async def save(
+        self,
+        api_key: str,
+        record_id: int,
+        entries: Sequence[Entry] = (),
+        replace: bool = False,
+        expected: Optional[int] = None,
+    ) -> bool:
+        """
+        Сохраняет курсор монитора и значения изменившихся объектов.
+
+        Args:
+            api_key (str): API ключ потребителя.
+            record_id (int): Последний переданный потребителю record_id.
+            entries (Sequence[Entry]): Объекты, изменившиеся с предыдущего сохранения. (default: ())
+            replace (bool): Заменить сохраненное состояние целиком без проверки expected, например после получения нового начального состояния. (default: False)
+            expected (Optional[int]): Курсор, который должен быть сохранен сейчас, None - без проверки. (default: None)
+
+        Returns:
+            bool: False, если сохраненный курсор отличается от expected (его изменил другой процесс или курсор удален), иначе True.
+        """
+
+    @abstractmethod
+    async def delete(self, api_key: str) -> None:
+        """
+        Удаляет сохраненное состояние монитора.
+
+        Args:
+            api_key (str): API ключ потребителя.
+        """
+
+
+class MemoryStateBackend(MonitorStateBackend):
+    """
+    Хранилище курсоров в памяти процесса. Не переживает перезапуск
+    и не подходит для запуска с несколькими рабочими процессами.
+    """
+
+    def __init__(self) -> None:
+        self._cursors: Dict[str, int] = {}
+
+    async def load_cursor(self, api_key: str) -> Optional[int]:
+        return self._cursors.get(api_key)
+
+    async def min_cursor(self) -> Optional[int]:
+        return min(self._cursors.values(), default=None)
+
+    async def api_keys(self) -> List[str]:
+        return list(self._cursors)
+
+    async def save(
+        self,
+        api_key: str,
+        record_id: int,
+        entries: Sequence[Entry] = (),
+        replace: bool = False,
+        expected: Optional[int] = None,
+    ) -> bool:
+        if (
+            not replace
+            and expected is not None
+            and self._cursors.get(api_key) != expected
+        ):
+            return False
+        self._cursors[api_key] = record_id
+        return True
+
+    async def delete(self, api_key: str) -> None:
+        self._cursors.pop(api_key, None)
+
+
+class DatabaseStateBackend(MonitorStateBackend):
+    """
+    Хранилище курсоров в таблице monitor_cursors основной базы данных.
+    Значения объектов не хранятся: при восстановлении они читаются
+    из истории изменений. Запись в базу данных выполняется только
+    при изменении курсора или замене состояния.
+
+    Args:
+        alch (AsyncAlchemy): Объект для работы с базой данных.
+    """
+
+    def __init__(self, alch: AsyncAlchemy) -> None:
+        """
+        Создает хранилище курсоров.
+
+        Args:
+            alch (AsyncAlchemy): Объект для работы с базой данных.
+        """
+        self._alch = alch
+        self._saved: Dict[str, int] = {}
+
+    async def load_cursor(self, api_key: str) -> Optional[int]:
+        async with self._alch.get_session() as session:
+            cursor = await session.get(MonitorCursor, api_key)
+        if cursor is None:
+            self._saved.pop(api_key, None)
+            return None
+        self._saved[api_key] = cursor.record_id
+        return cursor.record_id
+
+    async def min_cursor(self) -> Optional[int]:
+        async with self._alch.get_session() as session:
+            return await session.scalar(
+                sa.select(sa.func.min(MonitorCursor.record_id))
+            )
+
+    async def api_keys(self) -> List[str]:
+        async with self._alch.get_session() as session:
+            return list(
+                await session.scalars(sa.select(MonitorCursor.api_key))
+            )
+
+    async def save(
+        self,
+        api_key: str,
+        record_id: int,
+        entries: Sequence[Entry] = (),
+        replace: bool = False,
+        expected: Optional[int] = None,
+    ) -> bool:
+        if not replace and self._saved.get(api_key) == record_id:
+            return True
+        async with self._alch.get_session() as session:
+            if replace or expected is None:
+                await session.merge(
+                    MonitorCursor(
+                        api_key=api_key,
+                        record_id=record_id,
+                        updated_at=dt.datetime.now(),
+                    )
+                )
+            else:
+                result = await session.execute(
+                    sa.update(MonitorCursor)
+                    .where(
+                        MonitorCursor.api_key == api_key,
+                        MonitorCursor.record_id == expected,
+                    )
+                    .values(record_id=record_id, updated_at=dt.datetime.now())
+                )
+                if result.rowcount == 0:
+                    self._saved.pop(api_key, None)
+                    log.info("Cursor of %s moved, not saved", api_key)
+                    return False
+            await session.commit()
+        self._saved[api_key] = record_id
+        log.debug("Saved cursor %d for %s", record_id, api_key)
+        return True
+
+    async def delete(self, api_key: str) -> None:
+        async with self._alch.get_session() as session:
+            await session.execute(
+                sa.delete(MonitorCursor).where(
+                    MonitorCursor.api_key == api_key
+                )
+            )
+            await session.commit()
+        self._saved.pop(api_key, None)
+
+
+class SQLiteStateBackend(MonitorStateBackend):
+    """
+    Хранилище состояния мониторов в файле SQLite, общем для всех рабочих
+    процессов на одном хосте. Файл открывается в режиме WAL, поэтому чтение
+    курсоров не блокируется записью из других процессов. Запросы выполняются
+    в отдельном потоке, чтобы не блокировать цикл событий. Неизменившийся
+    курсор без новых значений объектов повторно не записывается.
+
+    Args:
+        path (str): Путь к файлу базы данных SQLite.
+    """
+
+    def __init__(self, path: str = DEFAULT_SQLITE_PATH) -> None:
+        """
+        Создает хранилище. Файл и таблицы создаются при первом обращении.
+
+        Args:
+            path (str): Путь к файлу базы данных SQLite. (default: DEFAULT_SQLITE_PATH)
+        """
+        self._path = path
+        self._conn: Optional[sqlite3.Connection] = None
+        self._saved: Dict[str, int] = {}
+        # одно соединение, все запросы к нему выполняются в одном потоке
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="monitor-state"
+        )
+
+    async def load_cursor(self, api_key: str) -> Optional[int]:
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT record_id FROM monitor_cursors WHERE api_key = ?",
+                (api_key,),
+            ).fetchone()
+        )
+        if row is None:
+            self._saved.pop(api_key, None)
+            return None
+        self._saved[api_key] = row[0]
+        return row[0]
+
+    async def min_cursor(self) -> Optional[int]:
+        row = await self._run(
+            lambda conn: conn.execute(
+                "SELECT MIN(record_id) FROM monitor_cursors"
+            ).fetchone()
+        )
+        return row[0]
+
+    async def api_keys(self) -> List[str]:
+        rows = await self._run(
+            lambda conn: conn.execute(
+                "SELECT api_key FROM monitor_cursors"
+            ).fetchall()
+        )
+        return [row[0] for row in rows]
+
+    async def load_entries(self, api_key: str) -> List[Entry]:
+        rows = await self._run(
+            lambda conn: conn.execute(
+                "SELECT entity_id, record_id, payload FROM monitor_entries"
+                " WHERE api_key = ?",
+                (api_key,),
+            ).fetchall()
+        )
+        return [
+            (entity_id, record_id, tuple(json.loads(payload)))
+            for entity_id, record_id, payload in rows
+        ]
+
+    async def save(
+        self,
+        api_key: str,
+        record_id: int,
+        entries: Sequence[Entry] = (),
+        replace: bool = False,
+        expected: Optional[int] = None,
+    ) -> bool:
+        if (
+            not entries
+            and not replace
+            and self._saved.get(api_key) == record_id
+        ):
+            return True
+        params = [
+            (api_key, entity_id, entry_record_id, json.dumps(list(values)))
+            for entity_id, entry_record_id, values in entries
+        ]
+        updated_at = dt.datetime.now().isoformat()
+
+        def save(conn: sqlite3.Connection) -> bool:
+            with conn:
+                if replace or expected is None:
+                    conn.execute(
+                        "INSERT OR REPLACE INTO monitor_cursors"
+                        " (api_key, record_id, updated_at) VALUES (?, ?, ?)",
+                        (api_key, record_id, updated_at),
+                    )
+                elif not conn.execute(
+                    "UPDATE monitor_cursors SET record_id = ?, updated_at = ?"
+                    " WHERE api_key = ? AND record_id = ?",
+                    (record_id, updated_at, api_key, expected),
+                ).rowcount:
+                    return False
+                if replace:
+                    conn.execute(
+                        "DELETE FROM monitor_entries WHERE api_key = ?",
+                        (api_key,),
+                    )
+                conn.executemany(
+                    "INSERT OR REPLACE INTO monitor_entries"
+                    " (api_key, entity_id, record_id, payload)"
+                    " VALUES (?, ?, ?, ?)",
+                    params,
+                )
+            return True
+
+        if not await self._run(save):
+            self._saved.pop(api_key, None)
+            log.info("Cursor of %s moved, not saved", api_key)
+            return False
+        self._saved[api_key] = record_id
+        log.debug(
+            "Saved cursor %d and %d entries for %s",
+            record_id,
+            len(params),
+            api_key,
+        )
+        return True
+
+    async def delete(self, api_key: str) -> None:
+        def delete(conn: sqlite3.Connection) -> None:
+            with conn:
+                conn.execute(
+                    "DELETE FROM monitor_entries WHERE api_key = ?",
+                    (api_key,),
+                )
+                conn.execute(
+                    "DELETE FROM monitor_cursors WHERE api_key = ?",
+                    (api_key,),
+                )
+
+        await self._run(delete)
+        self._saved.pop(api_key, None)
+
+    async def _run(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполняет функцию с соединением в потоке хранилища."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, lambda: func(self._connect())
+        )
+
+    def _connect(self) -> sqlite3.Connection:
+        """Открывает соединение и создает таблицы при первом обращении."""
+        if self._conn is None:
+            conn = sqlite3.connect(self._path, timeout=SQLITE_TIMEOUT)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            with conn:
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS monitor_cursors ("
+                    " api_key TEXT PRIMARY KEY,"
+                    " record_id INTEGER NOT NULL,"
+                    " updated_at TEXT)"
+                )
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS monitor_entries ("
+                    " api_key TEXT NOT NULL,"
+                    " entity_id INTEGER NOT NULL,"
+                    " record_id INTEGER NOT NULL,"
+                    " payload TEXT NOT NULL,"
+                    " PRIMARY KEY (api_key, entity_id))"
+                )
+            self._conn = conn
+            log.info("Opened monitor state storage %s", self._path)
+        return self._conn
+
+
+def create_state_backend(
+    filename: str, alch: AsyncAlchemy
+) -> MonitorStateBackend:
+    """
+    Создает хранилище состояния мониторов по необязательному разделу
+    monitor_state файла параметров подключения, например
+    {"backend": "sqlite", "path": "/var/run/api/monitor_state.db"}.
+
+    Args:
+        filename (str): Имя файла, содержащего параметры для подключения к базе данных.
+        alch (AsyncAlchemy): Объект для работы с базой данных.
+
+    Returns:
+        MonitorStateBackend: Хранилище состояния мониторов.
+
+    Raises:
+        ParameterError: Если указан неизвестный тип хранилища.
+    """
+    with open(filename, "r") as file:
+        config = json.load(file).get("monitor_state", {})
+
+    backend = config.get("backend", DEFAULT_BACKEND)
+    if backend == "memory":
+        return MemoryStateBackend()
+    if backend == "database":
+        return DatabaseStateBackend(alch)
+    if backend == "sqlite":
+        return SQLiteStateBackend(config.get("path", DEFAULT_SQLITE_PATH))
+    raise ParameterError(f"Unknown monitor state backend: {backend}")
@@ -0,0 +1,217 @@
+"""
+Механизм уведомления об изменениях объектов. Вместо выдачи JSON Patch монитор
+передает подписчикам типизированные изменения (Change) пачками: изменения
+складываются в ограниченную очередь, а отдельный поток доставляет их
+подписчикам, когда набирается batch_size изменений или проходит
+flush_interval секунд с момента появления первого из них. Если подписчики
+не успевают обрабатывать изменения и очередь заполнена, монитор ждет
+освобождения места, поэтому объем памяти под очередь ограничен.
+"""
+import logging as log
+import queue
+import threading
+import time
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    NamedTuple,
+    Optional,
+    Union,
+)
+
+DEFAULT_BATCH_SIZE: int = 500
+DEFAULT_FLUSH_INTERVAL: float = 1.0
+DEFAULT_QUEUE_SIZE: int = 10000
+
+_STOP = object()  # признак остановки потока доставки
+
+
+class Change(NamedTuple):
+    """
+    Изменение объекта.
+
+    Attributes:
+        entity_id (int): Идентификатор объекта.
+        record_id (int): Идентификатор записи, в которой появилось изменение.
+        fields (Dict[str, Any]): Измененные атрибуты, для нового объекта - все атрибуты.
+        created (bool): Появился ли объект впервые.
+        table (Optional[str]): Имя отслеживаемой таблицы.
+    """
+
+    entity_id: int
+    record_id: int
+    fields: Dict[str, Any]
+    created: bool
+    table: Optional[str] = None
+
+
+class ChangeSink:
+    """
+    Базовый класс подписчика. Наследники должны реализовать deliver.
+    """
+
+    def deliver(self, batch: List[Change]) -> None:
+        """
+        Обрабатывает пачку изменений. Вызывается из потока доставки.
+
+        Args:
+            batch (List[Change]): Изменения в порядке их появления.
+        """
+        raise NotImplementedError
+
+    def close(self) -> None:
+        """Освобождает ресурсы подписчика после доставки последней пачки."""
+
+
+class CallbackSink(ChangeSink):
+    """
+    Подписчик, передающий пачки изменений в функцию.
+
+    Args:
+        callback (Callable[[List[Change]], Any]): Функция-обработчик пачки изменений.
+    """
+
+    def __init__(self, callback: Callable[[List[Change]], Any]) -> None:
+        self._callback = callback
+
+    def deliver(self, batch: List[Change]) -> None:
+        self._callback(batch)
+
+
+class ChangeNotifier:
+    """
+    Доставляет изменения подписчикам пачками в отдельном потоке.
+    Поток запускается при первой публикации изменений.
+
+    Args:
+        batch_size (int): Максимальное количество изменений в пачке.
+        flush_interval (float): Максимальное время ожидания пополнения пачки в секундах.
+        queue_size (int): Максимальное количество изменений в очереди.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+    ) -> None:
+        """
+        Создает объект доставки изменений без подписчиков.
+
+        Args:
+            batch_size (int): Максимальное количество изменений в пачке. (default: DEFAULT_BATCH_SIZE)
+            flush_interval (float): Максимальное время ожидания пополнения пачки в секундах. (default: DEFAULT_FLUSH_INTERVAL)
+            queue_size (int): Максимальное количество изменений в очереди. (default: DEFAULT_QUEUE_SIZE)
+        """
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._queue: "queue.Queue[Any]" = queue.Queue(maxsize=queue_size)
+        self._sinks: List[ChangeSink] = []
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def has_subscribers(self) -> bool:
+        """Есть ли у объекта подписчики."""
+        return bool(self._sinks)
+
+    def subscribe(
+        self, sink: Union[ChangeSink, Callable[[List[Change]], Any]]
+    ) -> ChangeSink:
+        """
+        Добавляет подписчика.
+
+        Args:
+            sink (Union[ChangeSink, Callable[[List[Change]], Any]]): Подписчик или функция-обработчик пачки изменений.
+
+        Returns:
+            ChangeSink: Добавленный подписчик, по которому от него можно отписаться.
+        """
+        if not isinstance(sink, ChangeSink):
+            sink = CallbackSink(sink)
+        with self._lock:
+            self._sinks = self._sinks + [sink]
+        return sink
+
+    def unsubscribe(self, sink: ChangeSink) -> None:
+        """
+        Удаляет подписчика.
+
+        Args:
+            sink (ChangeSink): Подписчик, возвращенный методом subscribe.
+        """
+        with self._lock:
+            self._sinks = [item for item in self._sinks if item is not sink]
+
+    def publish(self, changes: Iterable[Change]) -> None:
+        """
+        Ставит изменения в очередь доставки. Если очередь заполнена,
+        ждет, пока поток доставки ее освободит.
+
+        Args:
+            changes (Iterable[Change]): Изменения в порядке их появления.
+        """
+        if not self._sinks:
+            return
+        self._start()
+        for change in changes:
+            self._queue.put(change)
+
+    def close(self) -> None:
+        """
+        Доставляет оставшиеся в очереди изменения, останавливает поток
+        доставки и закрывает подписчиков.
+        """
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+        for sink in self._sinks:
+            sink.close()
+
+    def _start(self) -> None:
+        """Запускает поток доставки, если он еще не запущен."""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(
+                    target=self._run, name="change-notifier", daemon=True
+                )
+                self._thread.start()
+
+    def _run(self) -> None:
+        """Собирает изменения из очереди в пачки и доставляет их."""
+        stopped = False
+        while not stopped:
+            item = self._queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self._flush_interval
+            while len(batch) < self._batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopped = True
+                    break
+                batch.append(item)
+            self._deliver(batch)
+
+    def _deliver(self, batch: List[Change]) -> None:
+        """Передает пачку всем подписчикам, не прерываясь на их ошибках."""
+        for sink in self._sinks:
+            try:
+                sink.deliver(batch)
+            except Exception:
+                log.exception("Change sink %r failed", sink)
+        log.debug("Delivered %d changes", len(batch))
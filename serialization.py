@@ -0,0 +1,418 @@
+"""
+Сериализация ответов API за один проход. Объекты (патчи, сущности,
+пачки начального состояния) сначала преобразуются в простые словари и списки,
+которые затем кодируются одним вызовом без обращений к JSONEncoder.default
+для каждого объекта. Если установлен orjson, кодирование выполняется им,
+иначе стандартным модулем json.
+
+Кроме JSON поддерживаются колоночные форматы начального состояния: поток
+записей, где для каждой таблицы сначала идет заголовок {"table", "fields"},
+а затем пачки {"ids": [...], "columns": [[значения атрибута], ...]}, без
+повторения имен атрибутов у каждого объекта. Записи кодируются строками
+JSON (application/x-ndjson) или, если установлен msgpack, подряд идущими
+объектами MessagePack (application/x-msgpack). В MessagePack кодируются
+и обновления.
+"""
+import json
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import metrics
+from model.model import Entity, Patch
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson необязателен
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - msgpack необязателен
+    msgpack = None
+
+BACKEND: str = "json" if orjson is None else "orjson"
+
+JSON: str = "application/json"
+NDJSON: str = "application/x-ndjson"
+MSGPACK: str = "application/x-msgpack"
+# поддерживаемые форматы в порядке предпочтения сервера
+SNAPSHOT_TYPES: List[str] = [JSON, NDJSON] + ([MSGPACK] if msgpack else [])
+UPDATE_TYPES: List[str] = [JSON] + ([MSGPACK] if msgpack else [])
+
+Payload = Union[str, bytes]
+
+
+def dumps(obj: Any) -> str:
+    """
+    Кодирует простые словари, списки и скаляры в JSON.
+
+    Args:
+        obj (Any): Объект для кодирования.
+
+    Returns:
+        str: JSON-представление объекта.
+    """
+    if orjson is not None:
+        return orjson.dumps(obj).decode()
+    return json.dumps(obj, ensure_ascii=False)
+
+
+def packb(obj: Any) -> bytes:
+    """
+    Кодирует простые словари, списки и скаляры в MessagePack. Значения
+    других типов кодируются их строковым представлением.
+
+    Args:
+        obj (Any): Объект для кодирования.
+
+    Returns:
+        bytes: MessagePack-представление объекта.
+
+    Raises:
+        RuntimeError: Если msgpack не установлен.
+    """
+    if msgpack is None:
+        raise RuntimeError("msgpack is not installed")
+    return msgpack.packb(obj, use_bin_type=True, default=str)
+
+
+def encode(obj: Any, media_type: str = JSON) -> Payload:
+    """
+    Кодирует простые словари, списки и скаляры в указанном формате.
+
+    Args:
+        obj (Any): Объект для кодирования.
+        media_type (str): JSON или MSGPACK. (default: JSON)
+
+    Returns:
+        Payload: JSON-строка или MessagePack-байты.
+    """
+    if media_type == MSGPACK:
+        return packb(obj)
+    return dumps(obj)
+
+
+def negotiate(accept: Optional[str], offered: Sequence[str]) -> str:
+    """
+    Выбирает формат ответа по заголовку Accept. При равном приоритете,
+    а также если ни один формат не подходит, выбирается первый из offered.
+
+    Args:
+        accept (Optional[str]): Значение заголовка Accept.
+        offered (Sequence[str]): Поддерживаемые форматы в порядке предпочтения.
+
+    Returns:
+        str: Выбранный формат.
+    """
+    if not accept:
+        return offered[0]
+    # качество каждого формата по самому точному подходящему диапазону
+    quality: Dict[str, Tuple[int, float]] = {}
+    for item in accept.split(","):
+        media_range, *params = item.strip().lower().split(";")
+        media_range = media_range.strip()
+        q = 1.0
+        for param in params:
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        for media_type in offered:
+            if media_range == media_type:
+                precision = 2
+            elif media_range == media_type.split("/")[0] + "/*":
+                precision = 1
+            elif media_range == "*/*":
+                precision = 0
+            else:
+                continue
+            if precision >= quality.get(media_type, (-1, 0.0))[0]:
+                quality[media_type] = (precision, q)
+
+    best, best_q = offered[0], 0.0
+    for media_type in offered:
+        q = quality.get(media_type, (0, 0.0))[1]
+        if q > best_q:
+            best, best_q = media_type, q
+    return best
+
+
+def patch_to_dict(patch: Patch) -> Dict[str, Any]:
+    """
+    Преобразует патч в словарь формата JSON Patch.
+
+    Args:
+        patch (Patch): Патч.
+
+    Returns:
+        Dict[str, Any]: Словарь с ключами op, path и value.
+    """
+    return {"op": patch.operation, "path": patch.path, "value": patch.value}
+
+
+def entity_to_dict(entity: Entity) -> Dict[str, Any]:
+    """
+    Преобразует сущность в словарь отслеживаемых атрибутов.
+
+    Args:
+        entity (Entity): Сущность.
+
+    Returns:
+        Dict[str, Any]: Значения атрибутов Entity.relevant_atributes.
+    """
+    return {
+        field: getattr(entity, field) for field in Entity.relevant_atributes
+    }
+
+
+def dump_patches(patches: Iterable[Patch], media_type: str = JSON) -> Payload:
+    """
+    Кодирует список патчей.
+
+    Args:
+        patches (Iterable[Patch]): Патчи.
+        media_type (str): JSON или MSGPACK. (default: JSON)
+
+    Returns:
+        Payload: Представление списка патчей.
+    """
+    with metrics.SERIALIZATION_SECONDS.labels("patches").time():
+        return encode([patch_to_dict(patch) for patch in patches], media_type)
+
+
+def dump_state_chunk(
+    fields: Sequence[str], items: Iterable[Tuple[int, Sequence[Any]]]
+) -> str:
+    """
+    Кодирует пачку начального состояния как содержимое JSON-объекта
+    без обрамляющих фигурных скобок, чтобы пачки можно было склеивать
+    через запятую.
+
+    Args:
+        fields (Sequence[str]): Имена атрибутов в порядке значений.
+        items (Iterable[Tuple[int, Sequence[Any]]]): Идентификаторы объектов и значения их атрибутов.
+
+    Returns:
+        str: Пары "entity_id": {атрибуты} через запятую.
+    """
+    with metrics.SERIALIZATION_SECONDS.labels("state_chunk").time():
+        chunk: Dict[str, Dict[str, Any]] = {
+            str(entity_id): dict(zip(fields, values))
+            for entity_id, values in items
+        }
+        return dumps(chunk)[1:-1]
+
+
+def dump_update_page(
+    patches: Iterable[Patch],
+    has_more: bool,
+    watermark: Any,
+    media_type: str = JSON,
+) -> Payload:
+    """
+    Кодирует страницу обновлений.
+
+    Args:
+        patches (Iterable[Patch]): Патчи страницы.
+        has_more (bool): Остались ли записи после страницы.
+        watermark (Any): Курсор, достигнутый страницей: record_id или record_id по именам таблиц.
+        media_type (str): JSON или MSGPACK. (default: JSON)
+
+    Returns:
+        Payload: Объект с ключами patches, has_more и watermark.
+    """
+    with metrics.SERIALIZATION_SECONDS.labels("update_page").time():
+        return encode(
+            {
+                "patches": [patch_to_dict(patch) for patch in patches],
+                "has_more": has_more,
+                "watermark": watermark,
+            },
+            media_type,
+        )
+
+
+StateItems = Sequence[Tuple[int, Sequence[Any]]]
+
+
+class StateWriter:
+    """
+    Кодирует начальное состояние в JSON-объект по частям:
+    {"entity_id": {атрибуты}, ...} или, для нескольких таблиц,
+    {"table": {"entity_id": {атрибуты}, ...}, ...}.
+
+    Args:
+        nested (bool): Группировать ли объекты по именам таблиц.
+    """
+
+    def __init__(self, nested: bool = False) -> None:
+        self._nested = nested
+        self._tables = 0
+        self._fields: Sequence[str] = ()
+        self._separator = ""
+
+    def begin(self) -> Payload:
+        """Возвращает начало представления."""
+        return "{"
+
+    def begin_table(self, name: str, fields: Sequence[str]) -> Payload:
+        """
+        Возвращает начало части с объектами таблицы.
+
+        Args:
+            name (str): Имя таблицы.
+            fields (Sequence[str]): Имена атрибутов в порядке значений.
+        """
+        self._fields = fields
+        self._separator = ""
+        index, self._tables = self._tables, self._tables + 1
+        if not self._nested:
+            return ""
+        return "%s%s: {" % (", " if index else "", dumps(name))
+
+    def chunk(self, items: StateItems) -> Payload:
+        """
+        Кодирует пачку объектов текущей таблицы.
+
+        Args:
+            items (StateItems): Идентификаторы объектов и значения их атрибутов.
+        """
+        return self.join_chunk(self.encode_chunk(items))
+
+    def encode_chunk(self, items: StateItems) -> Payload:
+        """
+        Кодирует пачку объектов текущей таблицы без учета предыдущих пачек.
+        Не меняет состояние кодировщика, поэтому может вызываться
+        одновременно из нескольких потоков; результат передается в join_chunk
+        в порядке вывода.
+
+        Args:
+            items (StateItems): Идентификаторы объектов и значения их атрибутов.
+        """
+        return dump_state_chunk(self._fields, items)
+
+    def join_chunk(self, encoded: Payload) -> Payload:
+        """
+        Возвращает закодированную пачку в том виде, в котором она следует
+        за предыдущими пачками таблицы.
+
+        Args:
+            encoded (Payload): Результат encode_chunk.
+        """
+        chunk = self._separator + encoded
+        self._separator = ", "
+        return chunk
+
+    def end_table(self) -> Payload:
+        """Возвращает конец части с объектами таблицы."""
+        return "}" if self._nested else ""
+
+    def end(self) -> Payload:
+        """Возвращает конец представления."""
+        return "}"
+
+
+class ColumnarStateWriter(StateWriter):
+    """
+    Кодирует начальное состояние потоком колоночных записей NDJSON
+    или MessagePack (см. описание модуля).
+
+    Args:
+        media_type (str): NDJSON или MSGPACK.
+    """
+
+    def __init__(self, media_type: str = NDJSON) -> None:
+        super().__init__()
+        self._encode: Callable[[Any], Payload]
+        if media_type == MSGPACK:
+            self._encode = packb
+            self._empty: Payload = b""
+        else:
+            self._encode = lambda obj: dumps(obj) + "\n"
+            self._empty = ""
+
+    def begin(self) -> Payload:
+        return self._empty
+
+    def begin_table(self, name: str, fields: Sequence[str]) -> Payload:
+        self._fields = fields
+        return self._encode({"table": name, "fields": list(fields)})
+
+    def encode_chunk(self, items: StateItems) -> Payload:
+        with metrics.SERIALIZATION_SECONDS.labels("state_chunk").time():
+            ids = [entity_id for entity_id, _ in items]
+            columns = [list(column) for column in zip(*(v for _, v in items))]
+            return self._encode({"ids": ids, "columns": columns})
+
+    def join_chunk(self, encoded: Payload) -> Payload:
+        return encoded
+
+    def end_table(self) -> Payload:
+        return self._empty
+
+    def end(self) -> Payload:
+        return self._empty
+
+
+def state_writer(media_type: str = JSON, nested: bool = False) -> StateWriter:
+    """
+    Создает кодировщик начального состояния в указанном формате.
+
+    Args:
+        media_type (str): JSON, NDJSON или MSGPACK. (default: JSON)
+        nested (bool): Группировать ли объекты JSON по именам таблиц. (default: False)
+
+    Returns:
+        StateWriter: Кодировщик начального состояния.
+    """
+    if media_type == JSON:
+        return StateWriter(nested)
+    return ColumnarStateWriter(media_type)
+
+
+def dump_state(
+    name: str,
+    fields: Sequence[str],
+    items: Iterable[Tuple[int, Sequence[Any]]],
+    media_type: str = JSON,
+    batch_size: int = 1000,
+) -> Payload:
+    """
+    Кодирует состояние объектов одной таблицы целиком в том же виде,
+    что и начальное состояние монитора.
+
+    Args:
+        name (str): Имя таблицы.
+        fields (Sequence[str]): Имена атрибутов в порядке значений.
+        items (Iterable[Tuple[int, Sequence[Any]]]): Идентификаторы объектов и значения их атрибутов.
+        media_type (str): JSON, NDJSON или MSGPACK. (default: JSON)
+        batch_size (int): Количество объектов в одной пачке. (default: 1000)
+
+    Returns:
+        Payload: Представление состояния объектов.
+    """
+    writer = state_writer(media_type)
+    chunks = [writer.begin(), writer.begin_table(name, fields)]
+    batch: List[Tuple[int, Sequence[Any]]] = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            chunks.append(writer.chunk(batch))
+            batch = []
+    if batch:
+        chunks.append(writer.chunk(batch))
+    chunks += [writer.end_table(), writer.end()]
+    if media_type == MSGPACK:
+        return b"".join(chunks)
+    return "".join(chunks)
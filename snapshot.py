@@ -0,0 +1,177 @@
+"""
+Материализованное последнее состояние объектов таблицы Entity.
+Таблица latest_state хранит по одной строке на объект и отметку (watermark) -
+максимальный учтенный record_id. Новые мониторы читают начальное состояние
+прямо из нее, а затем догоняют изменения одним запросом record_id > watermark,
+поэтому стоимость подключения зависит от количества объектов, а не от длины
+истории изменений.
+
+Методы принимают синхронную сессию, поэтому их можно вызывать и напрямую,
+и из AsyncSession.run_sync.
+"""
+import datetime as dt
+import logging as log
+from typing import Dict, List, Optional
+
+import sqlalchemy as sa
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.session import Session
+
+from model.model import LatestState, SnapshotWatermark
+from tracking import ENTITY_TABLE
+
+WATERMARK_NAME: str = "latest_state"
+DEFAULT_DELTA_BATCH_SIZE: int = 10000
+DELETE_CHUNK_SIZE: int = 500
+
+# колонки latest_state в порядке ENTITY_TABLE.row_columns
+SNAPSHOT_COLUMNS: List[sa.ColumnElement] = [
+    LatestState.record_id,
+    LatestState.entity_id,
+    *(getattr(LatestState, field) for field in ENTITY_TABLE.fields),
+]
+
+
+class SnapshotMaterializer:
+    """
+    Поддерживает таблицу latest_state в актуальном состоянии.
+
+    При первом обновлении таблица заполняется одним запросом INSERT ... SELECT
+    по истории изменений, при последующих - только записями, появившимися
+    после отметки, пачками по batch_size.
+
+    Args:
+        batch_size (int): Количество записей истории в одной пачке обновления.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_DELTA_BATCH_SIZE) -> None:
+        """
+        Создает объект для обновления материализованного состояния.
+
+        Args:
+            batch_size (int): Количество записей истории в одной пачке обновления. (default: DEFAULT_DELTA_BATCH_SIZE)
+        """
+        self._batch_size = batch_size
+
+    def watermark(self, session: Session) -> Optional[int]:
+        """
+        Возвращает максимальный record_id, учтенный в latest_state.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+
+        Returns:
+            Optional[int]: Отметка или None, если таблица еще не заполнялась.
+        """
+        mark = session.get(SnapshotWatermark, WATERMARK_NAME)
+        return None if mark is None else mark.record_id
+
+    def refresh(self, session: Session) -> int:
+        """
+        Доводит latest_state до текущего состояния истории изменений.
+
+        Args:
+            session (Session): Сессия SQLAlchemy.
+
+        Returns:
+            int: Отметка, до которой актуально материализованное состояние.
+        """
+        target = session.scalar(ENTITY_TABLE.max_record_id_query()) or 0
+        watermark = self.watermark(session)
+
+        try:
+            if watermark is None:
+                self._build(session, target)
+            else:
+                while watermark < target:
+                    watermark = self._apply_delta(session, watermark, target)
+        except IntegrityError:
+            # состояние одновременно обновляет другой процесс
+            session.rollback()
+            log.warning("Concurrent latest state refresh, skipping")
+            return self.watermark(session) or 0
+        return target
+
+    def query(self, batch_size: int) -> sa.Select:
+        """
+        Формирует запрос материализованного состояния.
+
+        Args:
+            batch_size (int): Количество записей в одной пачке серверного курсора.
+
+        Returns:
+            sa.Select: Запрос с колонками в порядке ENTITY_TABLE.row_columns.
+        """
+        return (
+            sa.select(*SNAPSHOT_COLUMNS)
+            .order_by(LatestState.entity_id)
+            .execution_options(yield_per=batch_size)
+        )
+
+    def _build(self, session: Session, target: int) -> None:
+        """
+        Заполняет latest_state с нуля последними записями до target включительно.
+        """
+        source = ENTITY_TABLE.latest_rows_query(
+            ENTITY_TABLE.monotonic <= target
+        )
+        session.execute(sa.delete(LatestState))
+        session.execute(
+            sa.insert(LatestState).from_select(SNAPSHOT_COLUMNS, source)
+        )
+        self._set_watermark(session, target)
+        session.commit()
+        log.info("Built latest state up to record id %d", target)
+
+    def _apply_delta(
+        self, session: Session, watermark: int, target: int
+    ) -> int:
+        """
+        Применяет к latest_state очередную пачку записей после watermark.
+
+        Returns:
+            int: Новая отметка.
+        """
+        query = ENTITY_TABLE.rows_query(
+            ENTITY_TABLE.monotonic > watermark,
+            ENTITY_TABLE.monotonic <= target,
+        ).limit(self._batch_size)
+        rows = session.execute(query).all()
+        if not rows:
+            return target
+
+        latest: Dict[int, sa.Row] = {row.entity_id: row for row in rows}
+        entity_ids = list(latest)
+        for start in range(0, len(entity_ids), DELETE_CHUNK_SIZE):
+            stop = start + DELETE_CHUNK_SIZE
+            session.execute(
+                sa.delete(LatestState).where(
+                    LatestState.entity_id.in_(entity_ids[start:stop])
+                )
+            )
+        session.execute(
+            sa.insert(LatestState),
+            [
+                {
+                    column.key: value
+                    for column, value in zip(SNAPSHOT_COLUMNS, row)
+                }
+                for row in latest.values()
+            ],
+        )
+
+        watermark = rows[-1].record_id
+        self._set_watermark(session, watermark)
+        session.commit()
+        log.debug("Latest state updated up to record id %d", watermark)
+        return watermark
+
+    def _set_watermark(self, session: Session, record_id: int) -> None:
+        """Сохраняет отметку материализованного состояния."""
+        session.merge(
+            SnapshotWatermark(
+                name=WATERMARK_NAME,
+                record_id=record_id,
+                updated_at=dt.datetime.now(),
+            )
+        )
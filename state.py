@@ -0,0 +1,256 @@
+"""
+Компактное хранилище последнего известного состояния объектов для монитора.
+Вместо ORM-объектов Entity хранит для каждого entity_id только record_id
+и значения отслеживаемых атрибутов в колоночном виде.
+"""
+from array import array
+from itertools import islice
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+class StateStore:
+    """
+    Колоночное хранилище состояния объектов: entity_id -> (record_id, значения атрибутов).
+
+    Номер слота объекта хранится в словаре, record_id и хэш значений -
+    в массивах array("q"), значения каждого атрибута - в отдельном списке.
+    По хэшу можно быстро отсеять объекты, состояние которых изменилось,
+    не сравнивая атрибуты по одному. Повторяющиеся строковые
+    значения при необходимости интернируются, поэтому одинаковые значения
+    у разных объектов занимают память один раз.
+
+    Args:
+        fields (Sequence[str]): Имена отслеживаемых атрибутов.
+        intern_strings (bool): Интернировать ли строковые значения.
+    """
+
+    __slots__ = (
+        "_fields",
+        "_intern",
+        "_index",
+        "_record_ids",
+        "_hashes",
+        "_columns",
+    )
+
+    def __init__(
+        self, fields: Sequence[str], intern_strings: bool = True
+    ) -> None:
+        """
+        Создает пустое хранилище состояния.
+
+        Args:
+            fields (Sequence[str]): Имена отслеживаемых атрибутов.
+            intern_strings (bool): Интернировать ли строковые значения. (default: True)
+        """
+        self._fields: Tuple[str, ...] = tuple(fields)
+        self._intern = intern_strings
+        self._index: Dict[int, int] = {}
+        self._record_ids = array("q")
+        self._hashes = array("q")
+        self._columns: List[List[Any]] = [[] for _ in self._fields]
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        """Имена отслеживаемых атрибутов в порядке хранения значений."""
+        return self._fields
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def __contains__(self, entity_id: int) -> bool:
+        return entity_id in self._index
+
+    def get(self, entity_id: int) -> Optional[Tuple[Any, ...]]:
+        """
+        Возвращает значения атрибутов объекта.
+
+        Args:
+            entity_id (int): Идентификатор объекта.
+
+        Returns:
+            Optional[Tuple[Any, ...]]: Значения атрибутов или None, если объекта нет в хранилище.
+        """
+        slot = self._index.get(entity_id)
+        if slot is None:
+            return None
+        return tuple(column[slot] for column in self._columns)
+
+    def record_id(self, entity_id: int) -> Optional[int]:
+        """
+        Возвращает record_id последней известной записи объекта.
+
+        Args:
+            entity_id (int): Идентификатор объекта.
+
+        Returns:
+            Optional[int]: record_id или None, если объекта нет в хранилище.
+        """
+        slot = self._index.get(entity_id)
+        if slot is None:
+            return None
+        return self._record_ids[slot]
+
+    def digest(self, entity_id: int) -> Optional[int]:
+        """
+        Возвращает хэш значений атрибутов объекта.
+
+        Args:
+            entity_id (int): Идентификатор объекта.
+
+        Returns:
+            Optional[int]: Хэш значений или None, если объекта нет в хранилище.
+        """
+        slot = self._index.get(entity_id)
+        if slot is None:
+            return None
+        return self._hashes[slot]
+
+    @staticmethod
+    def hash_values(values: Sequence[Any]) -> int:
+        """
+        Вычисляет хэш значений атрибутов в том виде, в котором он хранится.
+
+        Args:
+            values (Sequence[Any]): Значения атрибутов в порядке fields.
+
+        Returns:
+            int: Хэш значений.
+        """
+        return hash(tuple(values))
+
+    def unchanged(self, entity_id: int, values: Sequence[Any]) -> bool:
+        """
+        Проверяет, совпадают ли значения атрибутов объекта с сохраненными.
+        Хэш отсекает большинство изменившихся объектов без сравнения
+        атрибутов, но совпадение хэшей не гарантирует совпадения значений
+        (например, hash(-1) == hash(-2)), поэтому затем значения сравниваются
+        вместе с их типами.
+
+        Args:
+            entity_id (int): Идентификатор объекта.
+            values (Sequence[Any]): Значения атрибутов в порядке fields.
+
+        Returns:
+            bool: True, если объект есть в хранилище и его значения не изменились.
+        """
+        slot = self._index.get(entity_id)
+        if slot is None or self._hashes[slot] != self.hash_values(values):
+            return False
+        return not any(
+            self.differs(value, column[slot])
+            for column, value in zip(self._columns, values)
+        )
+
+    @staticmethod
+    def differs(value: Any, old_value: Any) -> bool:
+        """
+        Сравнивает значения атрибута с учетом типа, чтобы, например,
+        замена 1 на True или 1.0 считалась изменением.
+
+        Args:
+            value (Any): Новое значение.
+            old_value (Any): Сохраненное значение.
+
+        Returns:
+            bool: True, если значение изменилось.
+        """
+        return type(value) is not type(old_value) or value != old_value
+
+    def touch(self, entity_id: int, record_id: int) -> None:
+        """
+        Обновляет record_id объекта, значения атрибутов которого не изменились.
+
+        Args:
+            entity_id (int): Идентификатор объекта, который уже есть в хранилище.
+            record_id (int): record_id новой записи объекта.
+        """
+        self._record_ids[self._index[entity_id]] = record_id
+
+    def put(
+        self, entity_id: int, record_id: int, values: Sequence[Any]
+    ) -> None:
+        """
+        Сохраняет состояние объекта, заменяя предыдущее.
+
+        Args:
+            entity_id (int): Идентификатор объекта.
+            record_id (int): record_id записи, из которой взято состояние.
+            values (Sequence[Any]): Значения атрибутов в порядке fields.
+        """
+        if self._intern:
+            values = [
+                sys.intern(value) if type(value) is str else value
+                for value in values
+            ]
+        values_hash = self.hash_values(values)
+
+        slot = self._index.get(entity_id)
+        if slot is None:
+            self._index[entity_id] = len(self._record_ids)
+            self._record_ids.append(record_id)
+            self._hashes.append(values_hash)
+            for column, value in zip(self._columns, values):
+                column.append(value)
+        else:
+            self._record_ids[slot] = record_id
+            self._hashes[slot] = values_hash
+            for column, value in zip(self._columns, values):
+                column[slot] = value
+
+    def items(self) -> Iterator[Tuple[int, int, Tuple[Any, ...]]]:
+        """
+        Перебирает все объекты хранилища в порядке добавления.
+
+        Yields:
+            Tuple[int, int, Tuple[Any, ...]]: entity_id, record_id и значения атрибутов.
+        """
+        for entity_id, slot in self._index.items():
+            yield (
+                entity_id,
+                self._record_ids[slot],
+                tuple(column[slot] for column in self._columns),
+            )
+
+    def nbytes(self, sample_size: int = 100) -> int:
+        """
+        Оценивает объем памяти, занятый хранилищем: размер словаря, массивов
+        и списков вычисляется точно, а размер ключей и значений атрибутов -
+        по выборке не более sample_size элементов, поэтому значения,
+        общие для нескольких объектов, учитываются несколько раз.
+
+        Args:
+            sample_size (int): Размер выборки значений каждого атрибута. (default: 100)
+
+        Returns:
+            int: Примерный размер хранилища в байтах.
+        """
+        size = sys.getsizeof(self._index)
+        size += sys.getsizeof(self._record_ids) + sys.getsizeof(self._hashes)
+        keys = list(islice(self._index, sample_size))
+        size += self._sampled_size(keys, len(self._index))
+        for column in self._columns:
+            step = max(len(column) // sample_size, 1)
+            sample = column[::step][:sample_size]
+            size += sys.getsizeof(column)
+            size += self._sampled_size(sample, len(column))
+        return size
+
+    @staticmethod
+    def _sampled_size(sample: Sequence[Any], count: int) -> int:
+        """Оценивает размер count объектов по размеру выборки из них."""
+        if not sample:
+            return 0
+        return (
+            sum(sys.getsizeof(value) for value in sample)
+            * count
+            // len(sample)
+        )
+
+    def clear(self) -> None:
+        """Удаляет все объекты из хранилища."""
+        self._index.clear()
+        self._record_ids = array("q")
+        self._hashes = array("q")
+        self._columns = [[] for _ in self._fields]
@@ -0,0 +1,35 @@
+import os
+import sys
+
+import pytest
+import sqlalchemy as sa
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from feed import ChangeFeed  # noqa: E402
+from model.base import Alchemy  # noqa: E402
+from tracking import TrackedTable  # noqa: E402
+
+
+@pytest.fixture(scope="session")
+def dburl(tmp_path_factory) -> str:
+    """База данных SQLite, общая для тестов (Alchemy - одна на процесс)."""
+    url = "sqlite:///" + str(tmp_path_factory.mktemp("db") / "test.db")
+    Alchemy(dburl=url)
+    return url
+
+
+@pytest.fixture
+def create_table(dburl):
+    """Создает таблицу в тестовой базе данных и возвращает ее."""
+
+    def create(table: sa.Table) -> sa.Table:
+        table.metadata.create_all(Alchemy()._engine)
+        return table
+
+    return create
+
+
+def poll_now(table: TrackedTable) -> None:
+    """Снимает ограничение частоты опроса с общего источника изменений таблицы."""
+    ChangeFeed.shared(Alchemy(), table)._poll_interval = 0
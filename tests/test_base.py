@@ -0,0 +1,12 @@
+import pytest
+
+from errors import ParameterError
+from model.base import Alchemy
+
+
+def test_reinitialization_with_other_database_fails(dburl, tmp_path):
+    alch = Alchemy(dburl=dburl)
+    assert Alchemy() is alch
+    assert Alchemy(dburl=dburl) is alch
+    with pytest.raises(ParameterError):
+        Alchemy(dburl="sqlite:///" + str(tmp_path / "other.db"))
@@ -0,0 +1,51 @@
+import asyncio
+import json
+
+import sqlalchemy as sa
+
+import changelog
+from conftest import poll_now
+from model.base import Alchemy
+from model.model import Base, Entity
+from monitor import ChangeMonitor
+from monitor_state import SQLiteStateBackend
+from tracking import ENTITY_TABLE
+
+RESERVING_KEY = "a" * 32
+UP_TO_DATE_KEY = "b" * 32
+
+
+def test_prune_keeps_events_after_reserved_snapshot(dburl, tmp_path):
+    alch = Alchemy()
+    Base.metadata.create_all(alch._engine)
+    alch.install_change_capture()
+    poll_now(ENTITY_TABLE)
+    poll_now(changelog.CHANGE_LOG)
+    with alch.get_session() as session:
+        session.add_all([Entity(101, "a", "x"), Entity(102, "a", "x")])
+        session.commit()
+        watermark = session.scalar(sa.select(sa.func.max(Entity.record_id)))
+
+    # два рабочих процесса с общим файлом состояния мониторов
+    path = str(tmp_path / "monitor_state.db")
+    worker_a, worker_b = SQLiteStateBackend(path), SQLiteStateBackend(path)
+
+    # процесс A резервирует курсор и загружает начальное состояние
+    asyncio.run(worker_a.save(RESERVING_KEY, watermark, replace=True))
+    monitor = ChangeMonitor(dburl=dburl, change_capture=True)
+    state = json.loads(monitor.get_initial_state())
+    assert state["101"] == {"foo": "a", "bar": "x"}
+
+    with alch.get_session() as session:
+        session.add(Entity(101, "b", "x"))
+        session.commit()
+    asyncio.run(worker_b.save(UP_TO_DATE_KEY, watermark + 1, replace=True))
+
+    # процесс B очищает журнал, пока A еще не сохранил свой курсор
+    with alch.get_session() as session:
+        changelog.prune(session, asyncio.run(worker_b.min_cursor()))
+
+    asyncio.run(worker_a.save(RESERVING_KEY, monitor.cursor, replace=True))
+    assert json.loads(monitor.get_update()) == [
+        {"op": "replace", "path": "/101/foo", "value": "b"}
+    ]
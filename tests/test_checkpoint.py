@@ -0,0 +1,36 @@
+import sqlalchemy as sa
+
+from checkpoint import CheckpointIndex
+from model.base import Alchemy
+from model.model import Base, Entity
+
+
+def test_changes_between_pages_match_full_range(dburl):
+    Base.metadata.create_all(Alchemy()._engine)
+    index = CheckpointIndex()
+    with Alchemy().get_session() as session:
+        start = session.scalar(
+            sa.select(sa.func.coalesce(sa.func.max(Entity.record_id), 0))
+        )
+        session.add_all(
+            [Entity(i % 5 + 1, "foo%d" % i, "bar") for i in range(30)]
+        )
+        session.commit()
+        start += 5
+        stop = start + 24
+
+        full = {
+            change.entity_id: change.fields
+            for change in index.changes_between(session, start, stop)
+        }
+        paged = {}
+        cursor, has_more = start, True
+        while has_more:
+            page_stop, has_more = index.page_stop(session, cursor, stop, 7)
+            assert page_stop - cursor <= 7
+            for change in index.changes_between(session, cursor, page_stop):
+                paged.setdefault(change.entity_id, {}).update(change.fields)
+            cursor = page_stop
+
+    assert cursor == stop
+    assert paged == full
@@ -0,0 +1,52 @@
+import json
+
+import sqlalchemy as sa
+
+from conftest import poll_now
+from model.base import Alchemy
+from monitor import ChangeMonitor
+from state import StateStore
+from tracking import registry
+
+
+def test_unchanged_compares_values_on_hash_collision():
+    assert hash(-1) == hash(-2)
+    store = StateStore(["value"])
+    store.put(1, 1, [-1])
+
+    store.put(2, 2, [1])
+
+    assert store.unchanged(1, [-1])
+    assert not store.unchanged(1, [-2])
+    assert not store.unchanged(2, [True])
+    assert not store.unchanged(2, [1.0])
+
+
+def test_update_reports_change_with_colliding_hash(dburl, create_table):
+    counters = create_table(
+        sa.Table(
+            "counters",
+            sa.MetaData(),
+            sa.Column("record_id", sa.Integer, primary_key=True),
+            sa.Column("id", sa.Integer, nullable=False),
+            sa.Column("value", sa.Integer, nullable=False),
+        )
+    )
+    table = registry.register(
+        counters, key="id", monotonic="record_id", fields=["value"]
+    )
+    poll_now(table)
+    with Alchemy().get_session() as session:
+        session.execute(counters.insert().values(id=1, value=-1))
+        session.commit()
+
+    monitor = ChangeMonitor(dburl=dburl, tables=[table])
+    assert json.loads(monitor.get_initial_state()) == {"1": {"value": -1}}
+
+    with Alchemy().get_session() as session:
+        session.execute(counters.insert().values(id=1, value=-2))
+        session.commit()
+
+    assert json.loads(monitor.get_update()) == [
+        {"op": "replace", "path": "/1/value", "value": -2}
+    ]
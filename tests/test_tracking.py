@@ -0,0 +1,36 @@
+import json
+
+import sqlalchemy as sa
+
+from conftest import poll_now
+from model.base import Alchemy
+from monitor import ChangeMonitor
+from tracking import registry
+
+
+def test_core_table_with_default_fields(dburl, create_table):
+    prices = create_table(
+        sa.Table(
+            "prices",
+            sa.MetaData(),
+            sa.Column("version", sa.Integer, primary_key=True),
+            sa.Column("sku", sa.Integer, nullable=False),
+            sa.Column("price", sa.Integer, nullable=False),
+            sa.Column("currency", sa.String(3), nullable=False),
+        )
+    )
+    table = registry.register(prices, key="sku", monotonic="version")
+    assert table.fields == ("price", "currency")
+    assert all(type(field) is str for field in table.fields)
+
+    poll_now(table)
+    with Alchemy().get_session() as session:
+        session.execute(
+            prices.insert(), [{"sku": 1, "price": 10, "currency": "EUR"}]
+        )
+        session.commit()
+
+    monitor = ChangeMonitor(dburl=dburl, tables=[table])
+    assert json.loads(monitor.get_initial_state()) == {
+        "1": {"price": 10, "currency": "EUR"}
+    }
@@ -0,0 +1,242 @@
+"""
+Описание отслеживаемых таблиц. Отслеживаемая таблица задается отображенным
+классом SQLAlchemy или объектом sa.Table, ключевой колонкой (идентификатор
+объекта) и монотонно возрастающей колонкой (идентификатор записи).
+Отслеживаемые атрибуты по умолчанию - все остальные колонки таблицы.
+
+Запросы всех отслеживаемых таблиц возвращают строки с одинаковой структурой:
+record_id, entity_id и значения атрибутов в порядке TrackedTable.fields,
+поэтому мониторы и общий источник изменений работают с любой таблицей
+одинаково.
+"""
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+import sqlalchemy as sa
+
+from errors import ParameterError
+from model.model import Entity
+
+ColumnSpec = Union[str, sa.ColumnElement]
+
+
+class TrackedTable:
+    """
+    Отслеживаемая таблица.
+
+    Args:
+        source (Union[type, sa.Table]): Отображенный класс SQLAlchemy или таблица.
+        key (ColumnSpec): Ключевая колонка или имя ее атрибута.
+        monotonic (ColumnSpec): Монотонно возрастающая колонка или имя ее атрибута.
+        fields (Optional[Sequence[str]]): Отслеживаемые атрибуты, по умолчанию все остальные колонки.
+        name (Optional[str]): Имя таблицы в ответах API, по умолчанию имя таблицы в базе данных.
+    """
+
+    def __init__(
+        self,
+        source: Union[type, sa.Table],
+        key: ColumnSpec,
+        monotonic: ColumnSpec,
+        fields: Optional[Sequence[str]] = None,
+        name: Optional[str] = None,
+    ) -> None:
+        """
+        Создает описание отслеживаемой таблицы.
+
+        Args:
+            source (Union[type, sa.Table]): Отображенный класс SQLAlchemy или таблица.
+            key (ColumnSpec): Ключевая колонка или имя ее атрибута.
+            monotonic (ColumnSpec): Монотонно возрастающая колонка или имя ее атрибута.
+            fields (Optional[Sequence[str]]): Отслеживаемые атрибуты, по умолчанию все остальные колонки. (default: None)
+            name (Optional[str]): Имя таблицы в ответах API, по умолчанию имя таблицы в базе данных. (default: None)
+
+        Raises:
+            ParameterError: Если колонка не найдена в таблице или не осталось отслеживаемых атрибутов.
+        """
+        columns = self._columns(source)
+        self.key = self._resolve(columns, key)
+        self.monotonic = self._resolve(columns, monotonic)
+
+        if fields is None:
+            fields = [
+                field
+                for field, column in columns.items()
+                if column is not self.key and column is not self.monotonic
+            ]
+        if not fields:
+            raise ParameterError("Tracked table has no fields to track")
+        # имена колонок sa.Table - quoted_name, который не все сериализаторы
+        # принимают в качестве ключа
+        self.fields: Tuple[str, ...] = tuple(str(field) for field in fields)
+        self.values = [self._resolve(columns, field) for field in fields]
+
+        self.table = self.key.table
+        self.name = str(name or self.table.name)
+        # колонки строк: record_id, entity_id и значения атрибутов
+        self.row_columns: List[sa.ColumnElement] = [
+            self.monotonic.label("record_id"),
+            self.key.label("entity_id"),
+            *(
+                column.label(field)
+                for field, column in zip(self.fields, self.values)
+            ),
+        ]
+
+    def __repr__(self) -> str:
+        return "TrackedTable(%r)" % self.name
+
+    def rows_query(self, *criteria: sa.ColumnElement) -> sa.Select:
+        """
+        Формирует запрос записей, удовлетворяющих условиям, по возрастанию
+        монотонной колонки.
+
+        Args:
+            *criteria (sa.ColumnElement): Условия отбора записей.
+
+        Returns:
+            sa.Select: Запрос с колонками row_columns.
+        """
+        return (
+            sa.select(*self.row_columns)
+            .filter(*criteria)
+            .order_by(self.monotonic)
+        )
+
+    def latest_rows_query(self, *criteria: sa.ColumnElement) -> sa.Select:
+        """
+        Формирует запрос последней записи каждого объекта среди записей,
+        удовлетворяющих условиям.
+
+        Args:
+            *criteria (sa.ColumnElement): Условия отбора записей.
+
+        Returns:
+            sa.Select: Запрос с колонками row_columns.
+        """
+        subq = (
+            sa.select(
+                self.key,
+                sa.func.max(self.monotonic).label("max_record_id"),
+            )
+            .filter(*criteria)
+            .group_by(self.key)
+            .subquery("t2")
+        )
+        return sa.select(*self.row_columns).join(
+            subq,
+            sa.and_(
+                self.monotonic == subq.c.max_record_id,
+            ),
+        )
+
+    def max_record_id_query(self) -> sa.Select:
+        """
+        Формирует запрос максимального значения монотонной колонки.
+
+        Returns:
+            sa.Select: Запрос одного значения.
+        """
+        return sa.select(sa.func.max(self.monotonic))
+
+    @staticmethod
+    def _columns(source: Union[type, sa.Table]) -> Dict[str, sa.Column]:
+        """Возвращает колонки таблицы по именам атрибутов."""
+        if isinstance(source, sa.Table):
+            return dict(source.c.items())
+        mapper = sa.inspect(source, raiseerr=False)
+        if mapper is None:
+            raise ParameterError(f"{source!r} is not a mapped class or table")
+        return {attr.key: attr.columns[0] for attr in mapper.column_attrs}
+
+    @staticmethod
+    def _resolve(
+        columns: Dict[str, sa.Column], column: ColumnSpec
+    ) -> sa.Column:
+        """
+        Находит колонку таблицы по имени атрибута, атрибуту отображенного
+        класса или самой колонке.
+        """
+        for item in columns.values():
+            if item is column:
+                return item
+        # атрибут отображенного класса ищется по имени
+        name = column if isinstance(column, str) else column.key
+        if name not in columns:
+            raise ParameterError(f"Unknown column: {name}")
+        return columns[name]
+
+
+class TableRegistry:
+    """
+    Реестр отслеживаемых таблиц по их именам в ответах API.
+    """
+
+    def __init__(self) -> None:
+        self._tables: Dict[str, TrackedTable] = {}
+
+    def __iter__(self) -> Iterator[TrackedTable]:
+        return iter(self._tables.values())
+
+    def __len__(self) -> int:
+        return len(self._tables)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._tables
+
+    def __getitem__(self, name: str) -> TrackedTable:
+        """
+        Raises:
+            ParameterError: Если таблица не зарегистрирована.
+        """
+        if name not in self._tables:
+            raise ParameterError(f"Table {name} is not tracked")
+        return self._tables[name]
+
+    def register(
+        self,
+        source: Union[type, sa.Table],
+        key: ColumnSpec,
+        monotonic: ColumnSpec,
+        fields: Optional[Sequence[str]] = None,
+        name: Optional[str] = None,
+    ) -> TrackedTable:
+        """
+        Регистрирует отслеживаемую таблицу (параметры как у TrackedTable).
+
+        Returns:
+            TrackedTable: Зарегистрированная таблица.
+
+        Raises:
+            ParameterError: Если таблица с таким именем уже зарегистрирована.
+        """
+        table = TrackedTable(source, key, monotonic, fields, name)
+        if table.name in self._tables:
+            raise ParameterError(f"Table {table.name} is already tracked")
+        self._tables[table.name] = table
+        return table
+
+    def resolve(
+        self, tables: Optional[Sequence[Union[TrackedTable, str]]] = None
+    ) -> List[TrackedTable]:
+        """
+        Возвращает описания таблиц по именам или самим описаниям.
+
+        Args:
+            tables (Optional[Sequence[Union[TrackedTable, str]]]): Таблицы, по умолчанию ENTITY_TABLE. (default: None)
+
+        Returns:
+            List[TrackedTable]: Описания таблиц.
+        """
+        if not tables:
+            return [ENTITY_TABLE]
+        return [
+            table if isinstance(table, TrackedTable) else self[table]
+            for table in tables
+        ]
+
+
+registry = TableRegistry()
+
+# таблица, которую отслеживают мониторы по умолчанию
+ENTITY_TABLE: TrackedTable = registry.register(
+    Entity, key=Entity.entity_id, monotonic=Entity.record_id
+)